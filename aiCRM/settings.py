@@ -131,7 +131,52 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 執行期資料（RFM 水位線等），不進版控
+CRM_DATA_DIR = os.getenv("CRM_DATA_DIR", os.path.join(BASE_DIR, 'var'))
+
+# 背景作業（RFM 重算等）的執行緒數量，以及排隊/執行中作業多久沒回報視為失效（秒）
+CRM_JOB_WORKERS = 2
+CRM_JOB_STALE_SECONDS = 900
+
+# 分析快取（首頁 KPI 快照等）；多個 worker process 時可改成 FileBasedCache 或 Redis 共用
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CRM_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CRM_CACHE_LOCATION", "aicrm-default"),
+        "TIMEOUT": 3600,
+    }
+}
+# 新交易偵測（查 transaction 最大 ID）的間隔秒數、首頁快照最長保存秒數
+CRM_DATA_VERSION_PROBE_SECONDS = 30
+CRM_DASHBOARD_CACHE_TTL = 3600
+# 聊天 / AI 建議用的客群分析上下文最長保存秒數（資料版本改變時會提早在背景重算）
+CRM_ANALYSIS_CONTEXT_TTL = 900
+# 客群消費狀態統計（consumption_stats）最長保存秒數
+CRM_CONSUMPTION_STATS_TTL = 3600
+
+# 預先計算流失分數的視窗天數（python manage.py score_churn）
+CRM_CHURN_STORE_WINDOWS = (365, 90, 30)
+
+# 分析服務（RFM、流失、下次購買、首頁 CRR/RPR）改用程序內的 transaction 欄位快照，不再每次查 transaction 表；
+# 快照只會增量併入新交易，每隔 CRM_TRANSACTION_STORE_FULL_RELOAD_SECONDS 秒整表重載以反映修改 / 刪除
+CRM_TRANSACTION_STORE = os.getenv("CRM_TRANSACTION_STORE", "0").lower() in ("1", "true", "yes")
+CRM_TRANSACTION_STORE_FULL_RELOAD_SECONDS = 3600
+
 ## openai api key
 from dotenv import load_dotenv
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
\ No newline at end of file
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# 相容 OpenAI API 的服務位址（例如本機 fake_openai_server.py：http://127.0.0.1:8765/v1），未設定時使用官方 API
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+# async 聊天 API 同時送往 LLM 的請求上限，以及排隊等待的最長秒數（逾時回 503）
+CRM_LLM_MAX_CONCURRENCY = int(os.getenv("CRM_LLM_MAX_CONCURRENCY", 8))
+CRM_LLM_QUEUE_TIMEOUT = 30
+# AI 建議初始化的 ChatGPT 回覆快取：保存秒數（0 為停用）與最多筆數（超過時淘汰最久沒用到的）
+CRM_LLM_CACHE_TTL = 3600
+CRM_LLM_CACHE_MAX_ENTRIES = 256
+# 顧客詳細頁每頁顯示的消費紀錄筆數
+CRM_PROFILE_TRANSACTIONS_PER_PAGE = 50
+# 顧客活躍度的算法："transactions"（期間內有交易的不同顧客，activity_engine 的 bitset 索引）或 "last_buy"（舊算法，看最近購買日）
+# 未啟用 CRM_TRANSACTION_STORE 時，索引只會增量併入新交易，每隔 CRM_ACTIVITY_INDEX_FULL_RELOAD_SECONDS 秒整表重載
+CRM_ACTIVITY_ENGINE = "transactions"
+CRM_ACTIVITY_INDEX_FULL_RELOAD_SECONDS = 3600
\ No newline at end of file
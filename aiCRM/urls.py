@@ -28,6 +28,7 @@ from myCRM import views
 from django.shortcuts import render, redirect
 from django.http import JsonResponse
 from myCRM.services import chat_views
+from myCRM.services import async_chat_views
 
 
 
@@ -43,20 +44,29 @@ urlpatterns = [
     path("index/",   views.index_view,        name="index"), #首頁
     path('calculate_rfm/', views.calculate_rfm, name='calculate_rfm'), #RFM計算
     path('rfm/update/', views.trigger_rfm_update, name='rfm_update'), #manual RFM refresh
+    path('rfm/update/status/', views.rfm_update_status, name='rfm_update_status'), #RFM 背景更新進度
     path("customer/",   views.customer_page, name="customer") ,#顧客詳細頁面
     path('churn/', views.churn_predictions), #流失測API
     path('churn/chart/', views.churn_chart), #流失測表API
+    path('churn/single/', views.churn_single), #單一客戶流失預測
     path('churn/train/', views.churn_train), #流失測訓練API
     path('next-purchase/chart/', views.next_purchase_chart, name='next_purchase_chart'), #下次購買預測圖表
     path('next-purchase/', views.next_purchase_predictions), #下次購買預測API
     path('next-purchase/single/', views.next_purchase_single), #單一客戶下次購買預測
     path('next-purchase/train/', views.next_purchase_train), #下次購買模型訓練
     path('activity/', views.customer_activity, name='customer_activity'), #顧客活動
+    path('activity/api/', views.customer_activity_api, name='customer_activity_api'), #顧客活躍度列表（keyset 分頁）
     path("api/member/", views.member_api), ## 顧客測試資料
     path("api/customer-growth/", views.customer_growth_api, name="customer_growth_api"),
     path('chat/', chat_views.chat, name='chat'),  # AI聊天機器人
+    path('chat/stream/', chat_views.chat_stream, name='chat_stream'),  # AI聊天（SSE 串流）
+    path('chat/async/', async_chat_views.chat_async, name='chat_async'),  # AI聊天（async，需 ASGI）
     path("ai-suggestion/", views.ai_suggestion_page, name="ai_suggestion"), #AI建議
     path("ai-suggestion/init/", chat_views.ai_suggestion_init, name="ai_suggestion_init"), #AI建議初始化
+    path("ai-suggestion/init/stream/", chat_views.ai_suggestion_init_stream, name="ai_suggestion_init_stream"), #AI建議初始化（SSE 串流）
     path("ai-suggestion/execute/", chat_views.execute_suggestion, name="execute_suggestion"), #執行AI建議
+    path("ai-suggestion/init/async/", async_chat_views.ai_suggestion_init_async, name="ai_suggestion_init_async"), #AI建議初始化（async）
+    path("ai-suggestion/execute/async/", async_chat_views.execute_suggestion_async, name="execute_suggestion_async"), #執行AI建議（async）
+    path("ai-suggestion/cache/", chat_views.llm_cache_status, name="llm_cache_status"), #ChatGPT 回覆快取統計
     
     ]
\ No newline at end of file
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本機測試用的 OpenAI 相容 API（只實作 POST /v1/chat/completions，含 stream=True）
+
+使用方式：
+    python fake_openai_server.py --port 8765 --delay 0.02 --latency 0.3
+    # 另一個終端機
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python manage.py runserver
+
+回覆內容固定為「建議優惠券 / 預期成果」格式，可以驗證建議解析與 chat_record 寫入。
+"""
+
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_REPLY = (
+    "建議優惠券:\n"
+    "- 滿 1000 折 150 回購券｜開始時間:2025-01-01｜結束時間:2025-01-31\n"
+    "- 指定品類 85 折券｜開始時間:2025-01-10｜結束時間:2025-02-10\n\n"
+    "預期成果:\n"
+    "- 回購率預估提升 5~8 個百分點\n"
+    "- 客單價預估提升約 10%，高風險顧客流失率下降約 3%\n"
+)
+
+
+def _tokens(text):
+    """每 4 個字切成一段，模擬 token 逐段產生"""
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    delay = 0.02     # 每段 token 之間的間隔（秒）
+    latency = 0.3    # 第一段 token 之前的等待（秒）
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        model = body.get("model", "gpt-4o-mini")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        time.sleep(self.latency)
+
+        if not body.get("stream"):
+            time.sleep(self.delay * len(_tokens(FAKE_REPLY)))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": FAKE_REPLY},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_chunk({"role": "assistant", "content": ""})
+        for token in _tokens(FAKE_REPLY):
+            send_chunk({"content": token})
+            time.sleep(self.delay)
+        send_chunk({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 OpenAI 相容測試伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.02, help="每段 token 間隔秒數")
+    parser.add_argument("--latency", type=float, default=0.3, help="第一段 token 前的等待秒數")
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.delay = args.delay
+    FakeOpenAIHandler.latency = args.latency
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    print(f"Fake OpenAI server: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
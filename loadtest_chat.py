@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+聊天 API 併發壓力測試（httpx）
+
+1. 啟動假的 LLM：
+       python fake_openai_server.py --port 8765 --latency 1.0
+2. 以 ASGI 啟動網站並指向假的 LLM：
+       OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test uvicorn aiCRM.asgi:application --port 8000
+3. 分別測同步與 async 版本：
+       python loadtest_chat.py --endpoint /chat/ --concurrency 50 --requests 200
+       python loadtest_chat.py --endpoint /chat/async/ --concurrency 50 --requests 200
+
+會印出吞吐量（req/s）、延遲分位數與狀態碼分布。
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+
+async def _worker(client, args, queue, latencies, statuses):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        payload = {
+            "message": args.message,
+            "categoryID": args.category,
+            "userID": 1,
+            "includeContext": not args.no_context,
+        }
+        start = time.perf_counter()
+        try:
+            if args.method == "GET":
+                resp = await client.get(args.endpoint, params={"categoryID": args.category, "period": "month"})
+            else:
+                resp = await client.post(args.endpoint, json=payload)
+            statuses[resp.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - start)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def run(args):
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    latencies = []
+    statuses = Counter()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            _worker(client, args, queue, latencies, statuses) for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    print(f"endpoint     : {args.method} {args.endpoint}")
+    print(f"concurrency  : {args.concurrency}")
+    print(f"requests     : {len(latencies)} in {elapsed:.2f}s")
+    print(f"throughput   : {len(latencies) / elapsed:.2f} req/s")
+    if latencies:
+        print(
+            f"latency (s)  : mean={statistics.mean(latencies):.3f} "
+            f"p50={_percentile(latencies, 50):.3f} p95={_percentile(latencies, 95):.3f} "
+            f"max={max(latencies):.3f}"
+        )
+    print(f"status codes : {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天 API 併發壓力測試")
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="/chat/async/")
+    parser.add_argument("--method", choices=["GET", "POST"], default="POST",
+                        help="ai-suggestion/init 系列請用 GET")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--category", type=int, default=1)
+    parser.add_argument("--message", default="請幫我調整優惠券門檻")
+    parser.add_argument("--no-context", action="store_true", help="不帶入客群分析上下文，只測 LLM 往返")
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from myCRM.services.churn_service import _parse_as_of
+from myCRM.services.feature_store import refresh_customer_features
+from myCRM.services.next_purchse import refresh_purchase_features
+
+
+class Command(BaseCommand):
+    help = "重建流失 / 下次購買模型共用的顧客特徵快照（各 worker 以 mmap 共用）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--as-of", dest="as_of", help="基準日期 YYYY-MM-DD，預設今天")
+
+    def handle(self, *args, **options):
+        as_of_date = _parse_as_of(options["as_of"])
+
+        meta = refresh_customer_features(as_of_date)
+        self.stdout.write(f"customer_features: version={meta['version']}，as_of={meta['as_of']}，視窗={meta['windows']}")
+
+        meta = refresh_purchase_features(as_of_date)
+        if meta is None:
+            self.stdout.write(self.style.WARNING("purchase_features: 尚未訓練 LSTM 模型，略過"))
+        else:
+            self.stdout.write(
+                f"purchase_features: version={meta['version']}，as_of={meta['as_of']}，"
+                f"序列長度={meta['max_sequence_length']}"
+            )
+        self.stdout.write(self.style.SUCCESS("特徵快照已更新"))
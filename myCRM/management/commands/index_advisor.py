@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+
+from myCRM.services.index_advisor import (
+    RECOMMENDED_INDEXES,
+    apply_indexes,
+    drop_indexes,
+    existing_tables,
+    explain,
+    index_report,
+    probe_queries,
+    time_query,
+)
+
+
+class Command(BaseCommand):
+    help = "以 EXPLAIN 檢查各服務的查詢並列出缺少的索引；--apply 建立建議索引並比較前後耗時"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="建立缺少的建議索引")
+        parser.add_argument("--drop", action="store_true", help="移除本工具建立的索引（還原用）")
+        parser.add_argument("--repeat", type=int, default=5, help="每個查詢重複執行次數，取中位數（預設 5）")
+        parser.add_argument("--no-explain", dest="show_explain", action="store_false", help="不輸出 EXPLAIN 內容")
+
+    def handle(self, *args, **options):
+        if options["drop"]:
+            tables = existing_tables()
+            dropped = drop_indexes([spec for spec in RECOMMENDED_INDEXES if spec.table in tables])
+            self.stdout.write(self.style.SUCCESS(f"已移除 {len(dropped)} 個索引：{', '.join(dropped) or '無'}"))
+            return
+
+        report = index_report()
+        status = {row["spec"].name: row for row in report}
+
+        self.stdout.write("== 建議索引 ==")
+        for row in report:
+            spec = row["spec"]
+            target = f"{spec.table}({', '.join(spec.columns)})"
+            if row["table_missing"]:
+                state = self.style.WARNING("資料表不存在")
+            elif row["covered_by"]:
+                state = self.style.SUCCESS(f"已有 {row['covered_by']}")
+            else:
+                state = self.style.ERROR("缺少")
+            self.stdout.write(f"  {target:<48} {state}  — {spec.reason}")
+
+        probes = [q for q in probe_queries() if not status[q.index_name]["table_missing"]]
+        before = {}
+        self.stdout.write("\n== 查詢計畫 ==")
+        for query in probes:
+            before[query.label] = time_query(query, options["repeat"])
+            self.stdout.write(f"[{query.label}] {before[query.label]:.2f} ms（需要 {query.index_name}）")
+            if options["show_explain"]:
+                for line in explain(query).splitlines():
+                    self.stdout.write(f"    {line}")
+
+        missing = [row["spec"] for row in report if row["missing"]]
+        if not options["apply"]:
+            if missing:
+                self.stdout.write(self.style.WARNING(
+                    f"\n缺少 {len(missing)} 個索引，執行 --apply 建立：{', '.join(s.name for s in missing)}"
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS("\n建議索引皆已存在"))
+            return
+
+        if not missing:
+            self.stdout.write(self.style.SUCCESS("\n建議索引皆已存在，不需建立"))
+            return
+
+        created = apply_indexes(missing)
+        self.stdout.write(self.style.SUCCESS(f"\n已建立 {len(created)} 個索引：{', '.join(created)}"))
+
+        self.stdout.write("\n== 建立前後耗時（中位數） ==")
+        for query in probe_queries():
+            if query.label not in before:
+                continue
+            after = time_query(query, options["repeat"])
+            ratio = before[query.label] / after if after else 0
+            self.stdout.write(f"  {query.label:<40} {before[query.label]:>9.2f} ms → {after:>9.2f} ms  ({ratio:.1f}x)")
+            if options["show_explain"]:
+                for line in explain(query).splitlines():
+                    self.stdout.write(f"    {line}")
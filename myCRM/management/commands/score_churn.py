@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from myCRM.services.churn_store import refresh_churn_store, store_windows
+
+
+class Command(BaseCommand):
+    help = "預先計算所有顧客的流失分數並寫入流失分數快照（建議以 cron 每日執行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--window",
+            type=int,
+            action="append",
+            dest="windows",
+            help="要計算的 window_days，可重複指定；預設為 CRM_CHURN_STORE_WINDOWS",
+        )
+        parser.add_argument("--as-of", dest="as_of", help="基準日期 YYYY-MM-DD，預設今天")
+
+    def handle(self, *args, **options):
+        windows = options["windows"] or store_windows()
+        report = refresh_churn_store(windows=windows, as_of=options["as_of"])
+        for window_days, meta in report["windows"].items():
+            self.stdout.write(
+                f"window_days={window_days}: {meta['rows']} 位顧客，"
+                f"as_of={meta['as_of']}，來源={meta['source']}，耗時 {meta['scoring_seconds']}s"
+            )
+        self.stdout.write(self.style.SUCCESS("流失分數快照已更新"))
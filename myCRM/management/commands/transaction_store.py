@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from myCRM.services.transaction_store import refresh_transaction_store, transaction_store_report
+
+
+class Command(BaseCommand):
+    help = "載入 transaction 欄位快照並列出各陣列的記憶體用量"
+
+    def handle(self, *args, **options):
+        refresh_transaction_store(full=True)
+        report = transaction_store_report()
+        self.stdout.write(
+            f"{report['rows']} 筆交易，{report['customers']} 位顧客，"
+            f"max transactionID={report['max_transaction_id']}"
+        )
+        for name, nbytes in report["bytes"].items():
+            self.stdout.write(f"  {name:<16} {nbytes / 2**20:>8.2f} MB")
+        self.stdout.write(f"  {'total':<16} {report['total_mb']:>8.2f} MB（每筆 {report['bytes_per_row']} bytes）")
+        if not report["enabled"]:
+            self.stdout.write(self.style.WARNING("CRM_TRANSACTION_STORE 未啟用，分析服務目前仍直接查詢 transaction 表"))
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myCRM', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerCategoryAffinity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customerid', models.IntegerField(db_column='customerID')),
+                ('productcategoryid', models.IntegerField(db_column='productCategoryID')),
+                ('purchasecount', models.IntegerField(db_column='purchaseCount', default=0)),
+                ('lineitems', models.IntegerField(db_column='lineItems', default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('subtotal', models.BigIntegerField(default=0)),
+                ('countshare', models.FloatField(db_column='countShare', default=0)),
+                ('amountshare', models.FloatField(db_column='amountShare', default=0)),
+                ('isessential', models.BooleanField(db_column='isEssential', default=False)),
+                ('lasttransactionid', models.IntegerField(db_column='lastTransactionID', default=0)),
+                ('updatedat', models.DateTimeField(db_column='updatedAt')),
+            ],
+            options={
+                'db_table': 'customer_category_affinity',
+                'indexes': [models.Index(fields=['productcategoryid'], name='idx_affinity_category')],
+                'constraints': [models.UniqueConstraint(fields=('customerid', 'productcategoryid'), name='uniq_affinity_customer_category')],
+            },
+        ),
+    ]
@@ -145,3 +145,27 @@ class Campaign(models.Model):
     class Meta:
         managed = False
         db_table = 'campaign'
+
+
+## 顧客 × 商品類別偏好（由 services/category_affinity.py 維護，Django 管理的資料表）
+class CustomerCategoryAffinity(models.Model):
+    customerid = models.IntegerField(db_column='customerID')  # 顧客ID
+    productcategoryid = models.IntegerField(db_column='productCategoryID')  # 商品類別ID
+    purchasecount = models.IntegerField(db_column='purchaseCount', default=0)  # 購買件數（數量為空或 0 算 1 件）
+    lineitems = models.IntegerField(db_column='lineItems', default=0)  # 交易明細筆數
+    quantity = models.IntegerField(default=0)  # 數量合計
+    subtotal = models.BigIntegerField(default=0)  # 金額合計
+    countshare = models.FloatField(db_column='countShare', default=0)  # 件數佔該顧客全部件數的比例
+    amountshare = models.FloatField(db_column='amountShare', default=0)  # 金額佔該顧客全部金額的比例
+    isessential = models.BooleanField(db_column='isEssential', default=False)  # 是否為剛需品
+    lasttransactionid = models.IntegerField(db_column='lastTransactionID', default=0)  # 計入的最大交易ID
+    updatedat = models.DateTimeField(db_column='updatedAt')  # 更新時間
+
+    class Meta:
+        db_table = 'customer_category_affinity'
+        constraints = [
+            models.UniqueConstraint(fields=['customerid', 'productcategoryid'], name='uniq_affinity_customer_category'),
+        ]
+        indexes = [
+            models.Index(fields=['productcategoryid'], name='idx_affinity_category'),
+        ]
@@ -0,0 +1,393 @@
+# myCRM/services/activity_engine.py
+"""
+以交易計算的活躍顧客（顧客活躍度的預設來源）：
+- 交易去重成（顧客, 交易日）配對後，每個週 / 月 / 季各建一個顧客 bitset（位元 k = 第 k 位顧客該期有交易），
+  整個矩陣由一次向量化運算建出，不必每期各做一次 DISTINCT 查詢
+- 任意日期區間的活躍顧客 = 區間內完整的季 / 月 / 週 bitset 取 OR，頭尾零碎的天數再以配對補上，
+  結果與「區間內有交易的不同顧客數」完全相同；顧客之後再購買也不會改變過去期間的數字
+- CRM_TRANSACTION_STORE=True 時直接由 transaction 欄位快照建立；否則自行載入配對，
+  之後只讀 transactionID 大於已載入最大值的新交易，每 CRM_ACTIVITY_INDEX_FULL_RELOAD_SECONDS 秒整表重載
+- 新交易以 ActivityIndex.extended() 併入：新顧客接在 bitset 最後面（既有顧客的位元位置不變），
+  只把新配對的位元 OR 進已建立的 bitmap，加入日也只查新顧客的
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from myCRM.models import Customer, Transaction
+
+from .data_version import max_transaction_id
+from .transaction_store import get_transaction_store, transaction_store_enabled, transaction_store_report
+
+logger = logging.getLogger(__name__)
+
+_LOAD_CHUNK_SIZE = 20000
+
+GRANULARITIES = ("quarter", "month", "week")
+
+_EPOCH = date(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+# 1970-01-01 是星期四，往後平移 3 天讓每週從星期一開始
+_WEEK_SHIFT = 3
+
+# 0~255 每個位元組的 1 位元數
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def period_index(granularity: str, ordinals: np.ndarray) -> np.ndarray:
+    """date.toordinal() 陣列 → 期間編號（1970 起算的第幾週 / 月 / 季）"""
+    days = np.asarray(ordinals, dtype=np.int64) - _EPOCH_ORDINAL
+    if granularity == "week":
+        return (days + _WEEK_SHIFT) // 7
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return months // 3 if granularity == "quarter" else months
+
+
+def period_start(granularity: str, index: int) -> date:
+    if granularity == "week":
+        return _EPOCH + timedelta(days=int(index) * 7 - _WEEK_SHIFT)
+    month = int(index) * 3 if granularity == "quarter" else int(index)
+    return date(1970 + month // 12, month % 12 + 1, 1)
+
+
+def period_end(granularity: str, index: int) -> date:
+    return period_start(granularity, index + 1) - timedelta(days=1)
+
+
+def popcount(bits: np.ndarray) -> int:
+    return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+class ActivityIndex:
+    """
+    唯讀的活躍度索引：
+      customer_ids[k]        第 k 位顧客的 ID，bitset 的第 k 個位元（初次建立時遞增，之後的新顧客依序接在後面）
+      pair_customer / days   去重後的（顧客, 交易日）配對，依交易日排序（days 為 date.toordinal()）
+      join_days[k]           加入日（ordinal），沒有加入日時為 0
+      bitmaps[g]             (第一期編號, uint8 矩陣[期數, 顧客數 / 8])，第一次用到該粒度時才建立
+    """
+
+    def __init__(self, customer_per_row: np.ndarray, days: np.ndarray, join_days: Optional[Dict[int, int]] = None):
+        self.customer_ids, inverse = np.unique(np.asarray(customer_per_row, dtype=np.int64), return_inverse=True)
+        keys = np.unique((inverse.astype(np.int64) << 32) | np.asarray(days, dtype=np.int64))
+        pair_customer = (keys >> 32).astype(np.int32)
+        pair_days = (keys & 0xFFFFFFFF).astype(np.int32)
+
+        order = np.argsort(pair_days, kind="stable")
+        self.pair_customer = pair_customer[order]
+        self.days = pair_days[order]
+        self.nbytes_per_set = (self.customers + 7) // 8
+
+        join_days = join_days or {}
+        self.join_days = np.fromiter(
+            (join_days.get(int(cid), 0) for cid in self.customer_ids), dtype=np.int64, count=self.customers
+        )
+        self._id_order = np.arange(self.customers)
+        self.bitmaps: Dict[str, Tuple[int, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def customers(self) -> int:
+        return len(self.customer_ids)
+
+    @property
+    def pairs(self) -> int:
+        return len(self.days)
+
+    def _positions(self, customer_ids: np.ndarray) -> np.ndarray:
+        """每個顧客ID在 bitset 中的位置，索引內沒有的顧客為 -1"""
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        if not self.customers:
+            return np.full(len(customer_ids), -1, dtype=np.int64)
+        sorted_ids = self.customer_ids[self._id_order]
+        i = np.minimum(np.searchsorted(sorted_ids, customer_ids), self.customers - 1)
+        return np.where(sorted_ids[i] == customer_ids, self._id_order[i], -1)
+
+    def unknown_customer_ids(self, customer_ids: np.ndarray) -> np.ndarray:
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        return np.unique(customer_ids[self._positions(customer_ids) < 0])
+
+    def extended(
+        self, customer_per_row: np.ndarray, days: np.ndarray, join_days: Optional[Dict[int, int]] = None
+    ) -> "ActivityIndex":
+        """
+        併入新的（顧客, 交易日）配對，回傳新的索引（原索引不變，讀取中的請求不受影響）。
+        join_days 只需包含 unknown_customer_ids() 的新顧客。
+        """
+        cids = np.asarray(customer_per_row, dtype=np.int64)
+        if not len(cids):
+            return self
+        new_ids = self.unknown_customer_ids(cids)
+        positions = self._positions(cids)
+        unknown = positions < 0
+        positions[unknown] = self.customers + np.searchsorted(new_ids, cids[unknown])
+
+        keys = np.unique((positions << 32) | np.asarray(days, dtype=np.int64))
+        new_customer = (keys >> 32).astype(np.int32)
+        new_days = (keys & 0xFFFFFFFF).astype(np.int32)
+        order = np.argsort(new_days, kind="stable")
+        new_customer, new_days = new_customer[order], new_days[order]
+
+        index = object.__new__(ActivityIndex)
+        index.customer_ids = np.concatenate([self.customer_ids, new_ids])
+        index._id_order = np.argsort(index.customer_ids, kind="stable")
+        at = np.searchsorted(self.days, new_days, side="right")
+        index.days = np.insert(self.days, at, new_days)
+        index.pair_customer = np.insert(self.pair_customer, at, new_customer)
+        index.nbytes_per_set = (index.customers + 7) // 8
+        join_days = join_days or {}
+        index.join_days = np.concatenate([
+            self.join_days,
+            np.fromiter((join_days.get(int(cid), 0) for cid in new_ids), dtype=np.int64, count=len(new_ids)),
+        ])
+        index.bitmaps = {
+            granularity: index._merge_bitmap(granularity, first, bits, new_customer, new_days)
+            for granularity, (first, bits) in self.bitmaps.items()
+        }
+        index._lock = threading.Lock()
+        return index
+
+    def _merge_bitmap(
+        self, granularity: str, first: int, bits: np.ndarray, customers: np.ndarray, days: np.ndarray
+    ) -> Tuple[int, np.ndarray]:
+        """既有 bitmap 補上新的期間 / 顧客欄位後，把新配對的位元 OR 進去"""
+        periods = period_index(granularity, days)
+        lo, hi = int(periods.min()), int(periods.max())
+        if len(bits):
+            lo, hi = min(lo, first), max(hi, first + len(bits) - 1)
+        merged = np.zeros((hi - lo + 1, self.nbytes_per_set), dtype=np.uint8)
+        if len(bits):
+            merged[first - lo:first - lo + len(bits), :bits.shape[1]] = bits
+        np.bitwise_or.at(merged, (periods - lo, customers >> 3), (128 >> (customers & 7)).astype(np.uint8))
+        return lo, merged
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros(self.nbytes_per_set, dtype=np.uint8)
+
+    def _pack(self, customer_rows: np.ndarray) -> np.ndarray:
+        present = np.zeros(self.customers, dtype=bool)
+        present[customer_rows] = True
+        return np.packbits(present)
+
+    def bitmap(self, granularity: str) -> Tuple[int, np.ndarray]:
+        """該粒度每一期的顧客 bitset：(第一期編號, 矩陣)，矩陣第 i 列是第一期編號 + i 那一期"""
+        cached = self.bitmaps.get(granularity)
+        if cached is not None:
+            return cached
+        with self._lock:
+            if granularity not in self.bitmaps:
+                self.bitmaps[granularity] = self._build_bitmap(granularity)
+            return self.bitmaps[granularity]
+
+    def _build_bitmap(self, granularity: str) -> Tuple[int, np.ndarray]:
+        if not self.pairs:
+            return 0, np.zeros((0, self.nbytes_per_set), dtype=np.uint8)
+        periods = period_index(granularity, self.days)
+        first = int(periods.min())
+        keys = np.unique((periods - first) * self.customers + self.pair_customer)
+        rows, customers = np.divmod(keys, self.customers)
+        bits = np.zeros((int(rows.max()) + 1, self.nbytes_per_set), dtype=np.uint8)
+        np.bitwise_or.at(bits, (rows, customers >> 3), (128 >> (customers & 7)).astype(np.uint8))
+        return first, bits
+
+    def _day_range_bits(self, start: int, end: int) -> np.ndarray:
+        lo = np.searchsorted(self.days, start, side="left")
+        hi = np.searchsorted(self.days, end, side="right")
+        if lo >= hi:
+            return self._empty()
+        return self._pack(self.pair_customer[lo:hi])
+
+    def _range_bits(self, start: int, end: int, levels: Tuple[str, ...]) -> np.ndarray:
+        """[start, end]（ordinal）內有交易的顧客 bitset：先取完整的粗粒度期間，剩下的頭尾交給細粒度"""
+        if start > end:
+            return self._empty()
+        if not levels:
+            return self._day_range_bits(start, end)
+
+        granularity, rest = levels[0], levels[1:]
+        first_full = int(period_index(granularity, np.array([start - 1]))[0]) + 1
+        last_full = int(period_index(granularity, np.array([end + 1]))[0]) - 1
+        if first_full > last_full:
+            return self._range_bits(start, end, rest)
+
+        first, bits = self.bitmap(granularity)
+        lo, hi = max(first_full - first, 0), min(last_full - first, len(bits) - 1)
+        acc = np.bitwise_or.reduce(bits[lo:hi + 1], axis=0) if lo <= hi else self._empty()
+        acc = acc | self._range_bits(start, period_start(granularity, first_full).toordinal() - 1, rest)
+        return acc | self._range_bits(period_end(granularity, last_full).toordinal() + 1, end, rest)
+
+    def active_bits(self, start: date, end: date, joined_by: Optional[date] = None) -> np.ndarray:
+        """start ~ end（含）之間有交易的顧客 bitset；joined_by 時只留加入日 <= joined_by 的顧客"""
+        bits = self._range_bits(start.toordinal(), end.toordinal(), GRANULARITIES)
+        if joined_by is not None:
+            joined = (self.join_days > 0) & (self.join_days <= joined_by.toordinal())
+            bits = bits & np.packbits(joined)
+        return bits
+
+    def count_active(self, start: date, end: date, joined_by: Optional[date] = None) -> int:
+        return popcount(self.active_bits(start, end, joined_by))
+
+    def active_customer_ids(self, start: date, end: date, joined_by: Optional[date] = None) -> np.ndarray:
+        bits = np.unpackbits(self.active_bits(start, end, joined_by), count=self.customers)
+        return self.customer_ids[bits.astype(bool)]
+
+    def nbytes(self) -> Dict[str, int]:
+        sizes = {
+            name: int(getattr(self, name).nbytes)
+            for name in ("customer_ids", "pair_customer", "days", "join_days")
+        }
+        for granularity, (_, bits) in self.bitmaps.items():
+            sizes[f"bitmap_{granularity}"] = int(bits.nbytes)
+        return sizes
+
+
+_state: Dict[str, Any] = {
+    "index": None, "source": None, "store_full_loads": None,
+    "max_transaction_id": 0, "full_loaded_at": 0.0, "builds": 0, "increments": 0,
+}
+_lock = threading.Lock()
+_JOIN_DAY_CHUNK_SIZE = 1000
+
+
+def _join_days(customer_ids: Optional[np.ndarray] = None) -> Dict[int, int]:
+    """{顧客ID: 加入日 ordinal}；指定 customer_ids 時只查這些顧客"""
+    qs = Customer.objects.filter(customerjoinday__isnull=False)
+    if customer_ids is None:
+        chunks = [qs]
+    else:
+        ids = [int(cid) for cid in customer_ids]
+        chunks = [
+            qs.filter(customerid__in=ids[i:i + _JOIN_DAY_CHUNK_SIZE])
+            for i in range(0, len(ids), _JOIN_DAY_CHUNK_SIZE)
+        ]
+    join_days = {}
+    for chunk in chunks:
+        for cid, join_day in chunk.values_list("customerid", "customerjoinday"):
+            join_days[int(cid)] = (join_day.date() if isinstance(join_day, datetime) else join_day).toordinal()
+    return join_days
+
+
+def _load_pairs(after_transaction_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    qs = Transaction.objects.filter(customerid__isnull=False, transdate__isnull=False)
+    if after_transaction_id is not None:
+        qs = qs.filter(transactionid__gt=after_transaction_id)
+
+    cids, days = [], []
+    for cid, trans_date in qs.values_list("customerid", "transdate").distinct().iterator(chunk_size=_LOAD_CHUNK_SIZE):
+        if isinstance(trans_date, datetime):
+            trans_date = trans_date.date()
+        cids.append(cid)
+        days.append(trans_date.toordinal())
+    return np.asarray(cids, dtype=np.int64), np.asarray(days, dtype=np.int32)
+
+
+def _build(cids: np.ndarray, days: np.ndarray, source: Any) -> ActivityIndex:
+    start = time.perf_counter()
+    index = ActivityIndex(cids, days, _join_days())
+    _state["index"] = index
+    _state["source"] = source
+    _state["builds"] += 1
+    logger.info(
+        "Built activity index: %s customer-days, %s customers in %.3fs",
+        index.pairs, index.customers, time.perf_counter() - start,
+    )
+    return index
+
+
+def _extend(cids: np.ndarray, days: np.ndarray, source: Any) -> ActivityIndex:
+    start = time.perf_counter()
+    index: ActivityIndex = _state["index"]
+    if len(cids):
+        index = index.extended(cids, days, _join_days(index.unknown_customer_ids(cids)))
+        _state["increments"] += 1
+        logger.info("Merged %s customer-days into activity index in %.3fs", len(cids), time.perf_counter() - start)
+    _state["index"] = index
+    _state["source"] = source
+    return index
+
+
+def _index_from_store() -> ActivityIndex:
+    snapshot = get_transaction_store()
+    index = _state["index"]
+    if index is not None and _state["source"] is snapshot:
+        return index
+    with _lock:
+        if _state["index"] is not None and _state["source"] is snapshot:
+            return _state["index"]
+        full_loads = transaction_store_report()["full_loads"]
+        if _state["index"] is None or _state["source"] is None or _state["store_full_loads"] != full_loads:
+            # 快照整表重載過（可能有修改 / 刪除），索引也整個重建
+            index = _build(snapshot.customer_ids[snapshot.row_customer], snapshot.days, snapshot)
+        else:
+            # 快照只併入了新交易：只取 transactionID 大於上次的列
+            rows = snapshot.transaction_ids > _state["max_transaction_id"]
+            index = _extend(snapshot.customer_ids[snapshot.row_customer[rows]], snapshot.days[rows], snapshot)
+        _state["store_full_loads"] = full_loads
+        _state["max_transaction_id"] = snapshot.max_transaction_id
+        return index
+
+
+def _index_from_database() -> ActivityIndex:
+    max_age = float(getattr(settings, "CRM_ACTIVITY_INDEX_FULL_RELOAD_SECONDS", 3600))
+
+    def needs_full() -> bool:
+        return (
+            _state["index"] is None or _state["source"] is not None
+            or (max_age > 0 and time.time() - _state["full_loaded_at"] > max_age)
+        )
+
+    if not needs_full() and max_transaction_id() <= _state["max_transaction_id"]:
+        return _state["index"]
+
+    with _lock:
+        full = needs_full()
+        probed_max_id = max_transaction_id()
+        if not full and probed_max_id <= _state["max_transaction_id"]:
+            return _state["index"]
+
+        if full:
+            index = _build(*_load_pairs(), None)
+            _state["full_loaded_at"] = time.time()
+        else:
+            index = _extend(*_load_pairs(after_transaction_id=_state["max_transaction_id"]), None)
+        _state["max_transaction_id"] = probed_max_id
+        return index
+
+
+def get_activity_index() -> ActivityIndex:
+    """
+    取得最新的活躍度索引：CRM_TRANSACTION_STORE=True 時跟著交易快照更新；
+    否則第一次呼叫時載入（顧客, 交易日）配對，之後有新交易時只讀新交易併入既有 bitset。
+    """
+    if transaction_store_enabled():
+        return _index_from_store()
+    return _index_from_database()
+
+
+def activity_index_report() -> Dict[str, Any]:
+    """索引大小與記憶體用量；尚未建立時 loaded=False。"""
+    index: Optional[ActivityIndex] = _state["index"]
+    report: Dict[str, Any] = {
+        "from_store": transaction_store_enabled(),
+        "loaded": index is not None,
+        "builds": _state["builds"],
+        "increments": _state["increments"],
+    }
+    if index is None:
+        return report
+
+    nbytes = index.nbytes()
+    report.update({
+        "pairs": index.pairs,
+        "customers": index.customers,
+        "bytes": nbytes,
+        "total_mb": round(sum(nbytes.values()) / 2**20, 2),
+    })
+    return report
@@ -0,0 +1,181 @@
+# myCRM/services/activity_list.py
+"""
+顧客活躍度列表（/activity/ 頁面的 JSON API）：
+- 依顧客彙總區間內的交易，活躍度等級用 SQL CASE 算出（高 / 中 / 低活躍），
+  等級篩選與排序都在資料庫完成
+- keyset 分頁：cursor 記錄上一頁最後一列的排序欄位值，下一頁只取排在它後面的列，
+  翻到後面的頁數也不必 OFFSET 掃過前面所有顧客
+- 各等級人數以一條 GROUP BY 查詢算出
+- 消費金額以「分」為單位的整數加總（spent_cents），排序與 cursor 比對都是精確的整數，
+  不受浮點數加總順序影響
+"""
+from __future__ import annotations
+
+import base64
+import json
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.db import connection
+from django.db.models import BigIntegerField, Case, Count, F, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+from myCRM.models import Customer, Transaction
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# (key, 標籤, 排序順位)；判斷條件與原本的頁面相同
+ACTIVITY_LEVELS = (
+    ("high", "高活躍", 0),
+    ("medium", "中活躍", 1),
+    ("low", "低活躍", 2),
+)
+LEVEL_LABEL = {rank: label for _, label, rank in ACTIVITY_LEVELS}
+LEVEL_KEY = {rank: key for key, _, rank in ACTIVITY_LEVELS}
+LEVEL_RANK = {key: rank for key, _, rank in ACTIVITY_LEVELS}
+
+HIGH_RECENCY_DAYS, HIGH_MIN_ORDERS = 14, 3
+MEDIUM_RECENCY_DAYS, MEDIUM_MIN_ORDERS = 45, 2
+
+# 排序方式 → [(欄位, 是否遞減), ...]，最後都以顧客ID決定先後，keyset 才會唯一
+SORT_OPTIONS: Dict[str, List[Tuple[str, bool]]] = {
+    "level": [("level_rank", False), ("last_purchase", True), ("orders", True), ("customerid", False)],
+    "recency": [("last_purchase", True), ("customerid", False)],
+    "orders": [("orders", True), ("customerid", False)],
+    "spent": [("spent_cents", True), ("customerid", False)],
+}
+DATE_FIELDS = {"last_purchase"}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def activity_queryset(since_date: date, today: date):
+    """[since_date, today) 有交易的顧客：最後消費日、訂單數、總消費（分）、活躍度順位（level_rank）"""
+    return (
+        Transaction.objects
+        .filter(transdate__gte=since_date, transdate__lt=today, customerid__isnull=False)
+        .values("customerid")
+        .annotate(
+            last_purchase=Max("transdate"),
+            orders=Count("transactionid"),
+            # 每筆先四捨五入成整數分再加總，結果與加總順序無關
+            spent_cents=Coalesce(
+                Sum(Cast(Round(F("totalprice") * 100), BigIntegerField())), Value(0), output_field=BigIntegerField()
+            ),
+        )
+        .annotate(
+            level_rank=Case(
+                When(
+                    Q(last_purchase__gte=today - timedelta(days=HIGH_RECENCY_DAYS), orders__gte=HIGH_MIN_ORDERS),
+                    then=Value(LEVEL_RANK["high"]),
+                ),
+                When(
+                    Q(last_purchase__gte=today - timedelta(days=MEDIUM_RECENCY_DAYS), orders__gte=MEDIUM_MIN_ORDERS),
+                    then=Value(LEVEL_RANK["medium"]),
+                ),
+                default=Value(LEVEL_RANK["low"]),
+                output_field=IntegerField(),
+            )
+        )
+    )
+
+
+def level_counts(since_date: date, today: date) -> Dict[str, int]:
+    """各活躍度等級的顧客數與總數（一條 GROUP BY 查詢）"""
+    inner_sql, params = activity_queryset(since_date, today).order_by().query.sql_with_params()
+    rank = connection.ops.quote_name("level_rank")
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT sub.{rank}, COUNT(*) FROM ({inner_sql}) sub GROUP BY sub.{rank}", params)
+        rows = cursor.fetchall()
+
+    counts = {key: 0 for key, _, _ in ACTIVITY_LEVELS}
+    for level_rank, count in rows:
+        counts[LEVEL_KEY[int(level_rank)]] = int(count)
+    counts["total"] = sum(counts.values())
+    return counts
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, ordering: List[Tuple[str, bool]]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError("cursor length mismatch")
+        return [
+            date.fromisoformat(v) if field in DATE_FIELDS and v is not None else v
+            for (field, _), v in zip(ordering, values)
+        ]
+    except (ValueError, TypeError, UnicodeError) as exc:
+        raise InvalidCursor(str(exc)) from exc
+
+
+def _after(ordering: List[Tuple[str, bool]], values: List[Any]) -> Q:
+    """排在 values 之後的列：(a > x) OR (a = x AND b > y) OR ...（遞減欄位改用 <）"""
+    condition = Q()
+    for i, (field, descending) in enumerate(ordering):
+        term = Q(**{f: v for (f, _), v in zip(ordering[:i], values[:i])})
+        term &= Q(**{f"{field}__{'lt' if descending else 'gt'}": values[i]})
+        condition |= term
+    return condition
+
+
+def get_activity_page(
+    since_date: date,
+    today: date,
+    level: Optional[str] = None,
+    sort: str = "level",
+    cursor: Optional[str] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Dict[str, Any]:
+    """
+    一頁活躍顧客：{"results": [...], "next_cursor": str | None, "sort", "level"}
+    level 為 high / medium / low（None 為全部），cursor 取自上一頁的 next_cursor。
+    """
+    sort = sort if sort in SORT_OPTIONS else "level"
+    ordering = SORT_OPTIONS[sort]
+    page_size = max(1, min(int(page_size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+
+    qs = activity_queryset(since_date, today)
+    if level in LEVEL_RANK:
+        qs = qs.filter(level_rank=LEVEL_RANK[level])
+    else:
+        level = None
+    if cursor:
+        qs = qs.filter(_after(ordering, decode_cursor(cursor, ordering)))
+    qs = qs.order_by(*[f"-{field}" if descending else field for field, descending in ordering])
+
+    rows = list(qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    names = dict(
+        Customer.objects
+        .filter(customerid__in=[row["customerid"] for row in rows])
+        .values_list("customerid", "customername")
+    )
+    results = []
+    for row in rows:
+        last_purchase = row["last_purchase"]
+        results.append({
+            "customer_id": row["customerid"],
+            "customer_name": names.get(row["customerid"]) or "未知顧客",
+            "orders": row["orders"],
+            "total_spent": row["spent_cents"] / 100,
+            "last_purchase": last_purchase.isoformat() if last_purchase else None,
+            "recency_days": (today - last_purchase).days if last_purchase else None,
+            "activity_level": LEVEL_LABEL[row["level_rank"]],
+            "level": LEVEL_KEY[row["level_rank"]],
+        })
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_cursor([rows[-1][field] for field, _ in ordering])
+
+    return {"results": results, "next_cursor": next_cursor, "sort": sort, "level": level}
@@ -3,10 +3,12 @@
 import re
 from datetime import datetime, timedelta
 from django.utils import timezone
-from django.db.models import Count, Sum, Avg, Max
-from myCRM.models import AiSuggection, Campaign, Customer, Transaction, RFMscore
-from myCRM.services.churn_service import predict_churn
-from myCRM.services.rfm_count import recalc_rfm_scores, get_rfm_category_distribution
+from django.db.models import Avg, Max
+from myCRM.models import AiSuggection, Campaign, Customer, RFMscore
+from myCRM.services.category_affinity import get_segment_category_affinity
+from myCRM.services.churn_store import get_churn_scores
+from myCRM.services.consumption_stats import get_consumption_statistics
+from myCRM.services.rfm_count import get_rfm_category_distribution, schedule_rfm_refresh
 from myCRM.services.next_purchse import predict_next_purchase_batch
 from myCRM.services.customerActivityRate import get_customer_growth, get_customer_activity  
 
@@ -48,28 +50,34 @@ def parse_chatgpt_suggestion(text: str):
 
 
 # 綜合模型數據分析函數
-def get_comprehensive_customer_analysis(category_id: int = None, top_customers: int = 20):
+def get_comprehensive_customer_analysis(category_id: int = None, top_customers: int = 20, all_categories: bool = False):
     """
     綜合分析顧客數據，整合RFM模型、CatBoost流失率預測、LSTM下次購買天數預測，以及客群消費狀態
     
     Args:
         category_id: 特定客群ID，若為None則分析所有客群
         top_customers: 要分析的前N位客戶數量
+        all_categories: True 時一次算出全部客群的詳細分析（category_analyses / consumption_statistics_by_category），
+                        給預先計算的快取使用
     
     Returns:
         dict: 包含所有模型預測結果和客群分析的綜合報告
     """
     
-    # 1. RFM分析 - 重新計算所有顧客的RFM分數
-    print("正在更新RFM分數...")
-    recalc_rfm_scores()
+    # 1. RFM分析 - 在背景增量更新有變動顧客的RFM分數（經由 job_runner，不會與其他 RFM 重算同時執行），
+    #    這次分析先用目前的分數，更新完成後資料版本改變會再觸發重算
+    print("正在排入RFM分數更新...")
+    try:
+        schedule_rfm_refresh(incremental=True)
+    except Exception as e:
+        print(f"RFM更新排入失敗: {e}")
     
     # 2. 獲取RFM客群分佈
     rfm_distribution = get_rfm_category_distribution(exclude_labels=['其他'])
     
     # 3. CatBoost流失率預測
     print("正在進行流失率預測...")
-    churn_predictions = predict_churn()
+    churn_predictions = get_churn_scores()
     
     # 4. LSTM下次購買天數預測
     print("正在預測下次購買時間...")
@@ -91,6 +99,10 @@ def get_comprehensive_customer_analysis(category_id: int = None, top_customers:
         category_analysis = _get_category_detailed_analysis(category_id, churn_predictions, next_purchase_predictions)
     else:
         category_analysis = None
+
+    if all_categories:
+        category_analyses = get_all_category_analyses(churn_predictions, next_purchase_predictions)
+        consumption_by_category = {cid: _get_consumption_statistics(cid) for cid in SEGMENT_NAME}
     
     # 8. 建立綜合報告
     comprehensive_report = {
@@ -118,107 +130,113 @@ def get_comprehensive_customer_analysis(category_id: int = None, top_customers:
         "consumption_statistics": consumption_stats,  # 保留原始鍵名作為備份
         "category_specific_analysis": category_analysis
     }
+    if all_categories:
+        comprehensive_report["category_analyses"] = category_analyses
+        comprehensive_report["consumption_statistics_by_category"] = consumption_by_category
     
     return comprehensive_report
 
 
 def _get_consumption_statistics(category_id: int = None):
     """
-    獲取客群消費狀態統計
+    獲取客群消費狀態統計（所有客群一次以單一 SQL 算好並快取，見 consumption_stats）
     """
-    # 基本查詢條件
-    base_query = Customer.objects.all()
-    if category_id:
-        base_query = base_query.filter(categoryid=category_id)
-    
-    # 消費統計
-    stats = {}
-    
-    # 總客戶數
-    stats["total_customers"] = base_query.count()
-    
-    # 有購買紀錄的客戶數
-    customers_with_purchases = base_query.filter(
-        customerid__in=Transaction.objects.values('customerid').distinct()
-    ).count()
-    stats["customers_with_purchases"] = customers_with_purchases
-    
-    # 最近30天活躍客戶
-    thirty_days_ago = timezone.now().date() - timedelta(days=30)
-    recent_active = base_query.filter(customerlastdaybuy__gte=thirty_days_ago).count()
-    stats["recent_active_customers"] = recent_active
-    
-    # 消費金額統計
-    if category_id:
-        customer_ids = base_query.values_list('customerid', flat=True)
-        transactions = Transaction.objects.filter(customerid__in=customer_ids)
-    else:
-        transactions = Transaction.objects.all()
-    
-    consumption_data = transactions.aggregate(
-        total_revenue=Sum('totalprice'),
-        average_order_value=Avg('totalprice'),
-        max_order_value=Max('totalprice'),
-        total_transactions=Count('transactionid')
-    )
-    
-    stats.update({
-        "total_revenue": round(consumption_data.get("total_revenue", 0) or 0, 2),
-        "average_order_value": round(consumption_data.get("average_order_value", 0) or 0, 2),
-        "max_order_value": round(consumption_data.get("max_order_value", 0) or 0, 2),
-        "total_transactions": consumption_data.get("total_transactions", 0),
-        "purchase_conversion_rate": round((customers_with_purchases / stats["total_customers"]) * 100, 2) if stats["total_customers"] > 0 else 0,
-        "recent_activity_rate": round((recent_active / stats["total_customers"]) * 100, 2) if stats["total_customers"] > 0 else 0
-    })
-    
-    return stats
+    return get_consumption_statistics(category_id)
 
 
 def _get_category_detailed_analysis(category_id: int, churn_predictions: list, next_purchase_predictions: list):
     """
     獲取特定客群的詳細分析
     """
-    # 篩選出該客群的預測結果
-    category_churn = [p for p in churn_predictions if p.get("categoryID") == category_id]
-    
-    # 從next_purchase_predictions中找到對應客戶的預測
-    category_customers = Customer.objects.filter(categoryid=category_id).values_list('customerid', flat=True)
-    category_next_purchase = [p for p in next_purchase_predictions if p.get("customer_id") in category_customers]
-    
+    return _build_category_analyses([category_id], churn_predictions, next_purchase_predictions)[category_id]
+
+
+def get_all_category_analyses(churn_predictions: list, next_purchase_predictions: list):
+    """
+    一次算出所有客群（SEGMENT_NAME）的詳細分析，回傳 {category_id: _get_category_detailed_analysis 的格式}
+    """
+    return _build_category_analyses(list(SEGMENT_NAME), churn_predictions, next_purchase_predictions)
+
+
+def _build_category_analyses(category_ids: list, churn_predictions: list, next_purchase_predictions: list):
+    """
+    把流失 / 下次購買預測各掃過一次，以 dict 依客群分組；
+    顧客所屬客群、RFM 平均與商品類別偏好（category_affinity 預先計算）各只查一次資料庫
+    """
+    category_ids = [int(cid) for cid in category_ids]
+    wanted = set(category_ids)
+
+    # 顧客ID → 客群（customer.categoryID 是字串欄位）
+    customers = Customer.objects.filter(categoryid__in=[str(cid) for cid in category_ids])
+    customer_category = {}
+    for customer_id, category in customers.values_list('customerid', 'categoryid'):
+        try:
+            customer_category[customer_id] = int(category)
+        except (TypeError, ValueError):
+            continue
+    customer_counts = {cid: 0 for cid in category_ids}
+    for category in customer_category.values():
+        customer_counts[category] = customer_counts.get(category, 0) + 1
+
+    # 篩選出各客群的預測結果
+    churn_by_category = {cid: [] for cid in category_ids}
+    for p in churn_predictions:
+        category = p.get("categoryID")
+        if category in wanted:
+            churn_by_category[category].append(p)
+
+    next_purchase_by_category = {cid: [] for cid in category_ids}
+    for p in next_purchase_predictions:
+        category = customer_category.get(p.get("customer_id"))
+        if category is not None:
+            next_purchase_by_category[category].append(p)
+
     # RFM分佈
-    rfm_scores = RFMscore.objects.filter(categoryID=category_id)
-    rfm_stats = rfm_scores.aggregate(
-        avg_r_score=Avg('rScore'),
-        avg_f_score=Avg('fScore'),
-        avg_m_score=Avg('mScore'),
-        avg_rfm_total=Avg('RFMscore')
-    )
-    
-    analysis = {
-        "category_id": category_id,
-        "category_name": SEGMENT_NAME.get(category_id, f"客群 {category_id}"),
-        "total_customers_in_category": len(category_customers),
-        "churn_analysis": {
-            "analyzed_count": len(category_churn),
-            "average_churn_probability": round(sum(p.get("probability", 0) for p in category_churn) / len(category_churn), 3) if category_churn else 0,
-            "high_risk_count": sum(1 for p in category_churn if p.get("risk_level") == "high"),
-            "top_risk_customers": sorted(category_churn, key=lambda x: x.get("probability", 0), reverse=True)[:5]
-        },
-        "next_purchase_analysis": {
-            "analyzed_count": len(category_next_purchase),
-            "average_next_purchase_days": round(sum(p.get("predicted_days", 0) for p in category_next_purchase) / len(category_next_purchase), 1) if category_next_purchase else 0,
-            "customers_buying_soon": [p for p in category_next_purchase if p.get("predicted_days", 999) <= 7],  # 7天內會購買的客戶
-            "customers_buying_later": [p for p in category_next_purchase if p.get("predicted_days", 0) > 30]  # 30天後才購買的客戶
-        },
-        "rfm_statistics": {
-            "average_recency_score": round(rfm_stats.get("avg_r_score", 0) or 0, 2),
-            "average_frequency_score": round(rfm_stats.get("avg_f_score", 0) or 0, 2),
-            "average_monetary_score": round(rfm_stats.get("avg_m_score", 0) or 0, 2),
-            "average_total_rfm_score": round(rfm_stats.get("avg_rfm_total", 0) or 0, 2)
-        }
+    rfm_by_category = {
+        row["categoryID"]: row
+        for row in RFMscore.objects.filter(categoryID__in=category_ids).values('categoryID').annotate(
+            avg_r_score=Avg('rScore'),
+            avg_f_score=Avg('fScore'),
+            avg_m_score=Avg('mScore'),
+            avg_rfm_total=Avg('RFMscore')
+        )
     }
-    
-    return analysis
+
+    # 各客群最常購買的商品類別
+    affinity_by_category = get_segment_category_affinity()
+
+    analyses = {}
+    for category_id in category_ids:
+        category_churn = churn_by_category[category_id]
+        category_next_purchase = next_purchase_by_category[category_id]
+        rfm_stats = rfm_by_category.get(category_id, {})
+
+        analyses[category_id] = {
+            "category_id": category_id,
+            "category_name": SEGMENT_NAME.get(category_id, f"客群 {category_id}"),
+            "total_customers_in_category": customer_counts.get(category_id, 0),
+            "churn_analysis": {
+                "analyzed_count": len(category_churn),
+                "average_churn_probability": round(sum(p.get("probability", 0) for p in category_churn) / len(category_churn), 3) if category_churn else 0,
+                "high_risk_count": sum(1 for p in category_churn if p.get("risk_level") == "high"),
+                "top_risk_customers": sorted(category_churn, key=lambda x: x.get("probability", 0), reverse=True)[:5]
+            },
+            "next_purchase_analysis": {
+                "analyzed_count": len(category_next_purchase),
+                "average_next_purchase_days": round(sum(p.get("predicted_days", 0) for p in category_next_purchase) / len(category_next_purchase), 1) if category_next_purchase else 0,
+                "customers_buying_soon": [p for p in category_next_purchase if p.get("predicted_days", 999) <= 7],  # 7天內會購買的客戶
+                "customers_buying_later": [p for p in category_next_purchase if p.get("predicted_days", 0) > 30]  # 30天後才購買的客戶
+            },
+            "rfm_statistics": {
+                "average_recency_score": round(rfm_stats.get("avg_r_score", 0) or 0, 2),
+                "average_frequency_score": round(rfm_stats.get("avg_f_score", 0) or 0, 2),
+                "average_monetary_score": round(rfm_stats.get("avg_m_score", 0) or 0, 2),
+                "average_total_rfm_score": round(rfm_stats.get("avg_rfm_total", 0) or 0, 2)
+            },
+            "product_affinity": affinity_by_category.get(category_id, []),
+        }
+
+    return analyses
 
 
 # 初始模型建議（頁面一載入就會用到）
@@ -229,8 +247,8 @@ def get_initial_suggestion(category_id: int):
     """
     seg_name = SEGMENT_NAME.get(category_id, f"顧客類型 {category_id}")
 
-    # 用原本的CatBoost 函數
-    all_rows = predict_churn()
+    # 讀取預先計算的 CatBoost 流失分數
+    all_rows = get_churn_scores()
 
     # 找出對應 categoryID 的那一群
     target = next((r for r in all_rows if int(r["categoryID"]) == int(category_id)), None)
@@ -0,0 +1,159 @@
+# myCRM/services/analysis_cache.py
+"""
+聊天 / AI 建議用的客群分析上下文快取：
+- 以「客群 + 資料版本」當 key，資料沒變就直接回傳，不必每次對話都重跑綜合分析
+- 版本變了時先回傳上一份（stale-while-revalidate），同時在背景重算；
+  只有該客群完全沒有快取時才同步計算
+- RFM / 流失分數重算完成送出 data_version_changed 後，在背景用一次綜合分析預先重算所有客群
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .ai_suggestion_service import SEGMENT_NAME, get_comprehensive_customer_analysis
+from .data_version import data_version_changed, get_data_version
+
+logger = logging.getLogger(__name__)
+
+_KEY_PREFIX = "crm:analysis_context"
+
+
+def _context_key(category_id: int, version: str) -> str:
+    return f"{_KEY_PREFIX}:{category_id}:{version}"
+
+
+def _latest_key(category_id: int) -> str:
+    return f"{_KEY_PREFIX}:latest:{category_id}"
+
+
+def _lock_key(category_id: int) -> str:
+    return f"{_KEY_PREFIX}:refreshing:{category_id}"
+
+
+def _context_from_analysis(category_id: int, category_analysis: Dict[str, Any], general_stats: Dict[str, Any]) -> Dict[str, Any]:
+    churn = category_analysis.get('churn_analysis', {})
+    next_purchase = category_analysis.get('next_purchase_analysis', {})
+
+    return {
+        'category_name': SEGMENT_NAME.get(category_id, f'客群{category_id}'),
+        'total_customers': category_analysis.get('total_customers_in_category', 0),
+        'churn_probability': churn.get('average_churn_probability', 0),
+        'high_risk_count': churn.get('high_risk_count', 0),
+        'avg_next_purchase_days': next_purchase.get('average_next_purchase_days', 0),
+        'customers_buying_soon': len(next_purchase.get('customers_buying_soon', [])),
+        'rfm_scores': category_analysis.get('rfm_statistics', {}),
+        'top_product_categories': category_analysis.get('product_affinity', [])[:3],
+        'general_revenue': general_stats.get('total_revenue', 0),
+        'general_conversion_rate': general_stats.get('purchase_conversion_rate', 0),
+    }
+
+
+def build_analysis_context(category_id: int) -> Dict[str, Any]:
+    """由綜合分析結果整理出單一客群的上下文（不經過快取）。"""
+    comprehensive_data = get_comprehensive_customer_analysis(category_id=category_id, top_customers=10)
+    return _context_from_analysis(
+        category_id,
+        comprehensive_data.get('category_specific_analysis') or {},
+        comprehensive_data.get('consumption_statistics') or {},
+    )
+
+
+def build_all_analysis_contexts() -> Dict[int, Dict[str, Any]]:
+    """只跑一次綜合分析，整理出所有客群的上下文 {category_id: context}。"""
+    comprehensive_data = get_comprehensive_customer_analysis(top_customers=10, all_categories=True)
+    analyses = comprehensive_data['category_analyses']
+    consumption = comprehensive_data['consumption_statistics_by_category']
+    return {
+        category_id: _context_from_analysis(category_id, analyses[category_id], consumption.get(category_id) or {})
+        for category_id in analyses
+    }
+
+
+def _store_context(category_id: int, context: Dict[str, Any], version: str) -> Dict[str, Any]:
+    entry = {
+        "context": context,
+        "version": version,
+        "generated_at": timezone.now().isoformat(),
+    }
+    ttl = int(getattr(settings, "CRM_ANALYSIS_CONTEXT_TTL", 900))
+    cache.set(_context_key(category_id, version), entry, ttl)
+    cache.set(_latest_key(category_id), entry, None)
+    return entry
+
+
+def refresh_analysis_context(category_id: int) -> Dict[str, Any]:
+    """重新計算某客群的上下文並寫入快取，回傳新的快取內容。"""
+    context = build_analysis_context(category_id)
+    # 綜合分析本身會先增量更新 RFM（可能換掉版本），所以算完才取版本
+    return _store_context(category_id, context, get_data_version())
+
+
+def refresh_all_analysis_contexts() -> Dict[int, Dict[str, Any]]:
+    """一次重算所有客群的上下文並寫入快取。"""
+    contexts = build_all_analysis_contexts()
+    version = get_data_version()
+    return {category_id: _store_context(category_id, context, version) for category_id, context in contexts.items()}
+
+
+def _refresh_in_background(category_ids) -> None:
+    try:
+        if len(category_ids) > 1:
+            refresh_all_analysis_contexts()
+        else:
+            refresh_analysis_context(category_ids[0])
+    except Exception:
+        logger.exception("Analysis context refresh failed for categories %s", category_ids)
+    finally:
+        for category_id in category_ids:
+            cache.delete(_lock_key(category_id))
+        connection.close()
+
+
+def schedule_analysis_refresh(category_ids: Optional[Iterable[int]] = None) -> bool:
+    """在背景執行緒重算各客群的上下文（預設全部客群，只跑一次綜合分析）；已在重算中的客群會略過。"""
+    ids = sorted(SEGMENT_NAME) if category_ids is None else list(category_ids)
+    pending = [cid for cid in ids if cache.add(_lock_key(cid), True, 600)]
+    if not pending:
+        return False
+    thread = threading.Thread(
+        target=_refresh_in_background,
+        args=(pending,),
+        name="analysis-context-refresh",
+        daemon=True,
+    )
+    thread.start()
+    return True
+
+
+def get_analysis_context(category_id: int) -> Dict[str, Any]:
+    """
+    取得客群分析上下文：
+    {"context": build_analysis_context() 的結果, "version", "generated_at", "stale": bool}
+    """
+    version = get_data_version()
+
+    entry = cache.get(_context_key(category_id, version))
+    if entry is not None:
+        return {**entry, "stale": False}
+
+    latest = cache.get(_latest_key(category_id))
+    if latest is not None:
+        schedule_analysis_refresh([category_id])
+        return {**latest, "stale": True}
+
+    # 冷啟動：這個客群還沒有任何快取，只能同步計算
+    return {**refresh_analysis_context(category_id), "stale": False}
+
+
+def _on_data_version_changed(sender, **kwargs):
+    schedule_analysis_refresh()
+
+
+data_version_changed.connect(_on_data_version_changed, dispatch_uid="analysis_context_refresh")
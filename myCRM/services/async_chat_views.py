@@ -0,0 +1,198 @@
+# myCRM/services/async_chat_views.py
+"""
+chat / ai_suggestion_init / execute_suggestion 的 async 版本（需以 ASGI 執行，例如 uvicorn aiCRM.asgi:application）：
+- 呼叫 ChatGPT 時不佔用 worker thread（AsyncOpenAI）
+- ORM 與分析計算透過 sync_to_async 執行
+- 同時送往 LLM 的請求數由 CRM_LLM_MAX_CONCURRENCY 限制，
+  等待超過 CRM_LLM_QUEUE_TIMEOUT 秒回傳 503
+請求參數與回傳格式都和 chat_views 的同步版本相同。
+"""
+import asyncio
+import logging
+import os
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from openai import AsyncOpenAI
+
+from myCRM.services.ai_suggestion_service import save_final_suggestion
+from myCRM.services.chat_views import (
+    CHAT_MODEL,
+    INIT_MAX_TOKENS,
+    INIT_TEMPERATURE,
+    _build_chat_messages,
+    _build_init_prompt,
+    _execute_payload,
+    _finish_chat,
+    _finish_init,
+    _init_cache_key,
+    _parse_chat_request,
+    _parse_execute_request,
+    _parse_init_params,
+    _use_llm_cache,
+)
+from myCRM.services.llm_cache import get_cached_reply, store_reply
+
+logger = logging.getLogger(__name__)
+
+# AsyncOpenAI 內部的連線池與 asyncio.Semaphore 都綁定 event loop，所以每個 loop 各建一份
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+class LLMBusy(Exception):
+    """等待 LLM 併發名額逾時"""
+
+
+def _get_loop_state() -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = {
+            "client": AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=getattr(settings, "OPENAI_BASE_URL", None) or None,
+            ),
+            "semaphore": asyncio.Semaphore(int(getattr(settings, "CRM_LLM_MAX_CONCURRENCY", 8))),
+        }
+        _loop_state[loop] = state
+    return state
+
+
+@asynccontextmanager
+async def _llm_slot():
+    semaphore = _get_loop_state()["semaphore"]
+    timeout = float(getattr(settings, "CRM_LLM_QUEUE_TIMEOUT", 30))
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise LLMBusy()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+async def _complete(messages: list, max_tokens: int, temperature: float = 0.7) -> str:
+    async with _llm_slot():
+        completion = await _get_loop_state()["client"].chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+    return completion.choices[0].message.content.strip()
+
+
+def _busy_response() -> JsonResponse:
+    return JsonResponse({"success": False, "error": "AI服務忙碌中，請稍後再試"}, status=503)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def ai_suggestion_init_async(request):
+    """ai_suggestion_init 的 async 版本"""
+    try:
+        _get_loop_state()
+    except Exception as e:
+        logger.error(f"AsyncOpenAI client initialization failed: {e}")
+        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
+
+    category_id, period = _parse_init_params(request)
+    messages, user_question, analysis_context = await sync_to_async(_build_init_prompt)(category_id, period)
+    cache_key = _init_cache_key(messages)
+
+    try:
+        full_text = get_cached_reply(cache_key) if _use_llm_cache(request) else None
+        cached = full_text is not None
+        if not cached:
+            full_text = await _complete(messages, max_tokens=INIT_MAX_TOKENS, temperature=INIT_TEMPERATURE)
+            store_reply(cache_key, full_text)
+        payload = _finish_init(full_text, user_question, analysis_context)
+        payload["cached"] = cached
+        logger.info(f"Generated AI suggestion for category {category_id} (cached={cached})")
+        return JsonResponse(payload)
+
+    except LLMBusy:
+        return _busy_response()
+    except Exception as e:
+        logger.error(f"AI suggestion generation failed: {e}")
+        return JsonResponse({
+            "success": False,
+            "error": "AI建議生成失敗，請稍後再試",
+            "analysis_summary": analysis_context
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def chat_async(request):
+    """chat 的 async 版本"""
+    try:
+        _get_loop_state()
+    except Exception as e:
+        logger.error(f"AsyncOpenAI client initialization failed: {e}")
+        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
+
+    params, error = _parse_chat_request(request)
+    if error:
+        return error
+
+    try:
+        messages, analysis_context = await sync_to_async(_build_chat_messages)(
+            params["category_id"], params["user_msg"], params["include_context"]
+        )
+        reply = await _complete(messages, max_tokens=1200)
+
+    except LLMBusy:
+        return _busy_response()
+    except Exception as e:
+        logger.error(f"ChatGPT API call failed: {e}")
+        return JsonResponse({
+            "error": "AI服務暫時不可用，請稍後再試",
+            "success": False
+        }, status=500)
+
+    try:
+        payload = await sync_to_async(_finish_chat)(
+            params["user_id"], params["category_id"], params["user_msg"], reply, analysis_context
+        )
+        return JsonResponse(payload)
+
+    except Exception as e:
+        logger.error(f"Chat processing failed: {e}")
+        return JsonResponse({
+            "success": False,
+            "error": "對話處理失敗，請重試"
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def execute_suggestion_async(request):
+    """execute_suggestion 的 async 版本"""
+    params, error = _parse_execute_request(request)
+    if error:
+        return error
+
+    try:
+        suggest_id = await sync_to_async(save_final_suggestion)(
+            category_id=params["category_id"],
+            guideline=params["guideline"],
+            expected=params["outcome"],
+            user_id=params["user_id"],
+        )
+        return JsonResponse(_execute_payload(params, suggest_id))
+
+    except Exception as e:
+        logger.error(f"Failed to execute suggestion: {e}")
+        return JsonResponse({
+            "success": False,
+            "error": "建議執行失敗，請重試"
+        }, status=500)
@@ -1,10 +1,14 @@
 #==========首頁前三個比率計算========
-from django.db.models import Count, Sum, Max
+from time import perf_counter
+from django.db.models import Count, Sum, Max, Q
 from django.shortcuts import render, redirect
 from myCRM.models import Customer, Transaction
 from datetime import datetime, timedelta,date
 from django.db.models import Count
 from django.db.models.functions import TruncDate
+from .rfm_count import build_category_distribution
+from .customerActivityRate import get_customer_activity_series
+from .transaction_store import get_transaction_store, transaction_store_enabled
 
 ## 顧客留存率
 def calculate_CRR():
@@ -107,3 +111,127 @@ def calculate_allCus():
     return totalCus
 
     
+
+
+def _monthly_order_stats(prev_first_day, first_day, next_first_day):
+    """
+    上月 / 本月的顧客購買統計，回傳 (上月有購買, 兩個月都有購買, 本月有購買, 本月購買≧2筆) 的顧客數
+    """
+    if transaction_store_enabled():
+        store = get_transaction_store()
+        prev_orders = store.count_by_customer(store.day_mask(prev_first_day, first_day, end_inclusive=False))
+        cur_orders = store.count_by_customer(store.day_mask(first_day, next_first_day, end_inclusive=False))
+        return (
+            int((prev_orders > 0).sum()),
+            int(((prev_orders > 0) & (cur_orders > 0)).sum()),
+            int((cur_orders > 0).sum()),
+            int((cur_orders >= 2).sum()),
+        )
+
+    monthly_rows = (
+        Transaction.objects
+        .filter(transdate__gte=prev_first_day, transdate__lt=next_first_day)
+        .values('customerid')
+        .annotate(
+            prev_orders=Count('transactionid', distinct=True, filter=Q(transdate__lt=first_day)),
+            cur_orders=Count('transactionid', distinct=True, filter=Q(transdate__gte=first_day)),
+        )
+    )
+    prev_count = retained = cur_customers = repeat_customers = 0
+    for row in monthly_rows:
+        if row['cur_orders']:
+            cur_customers += 1
+            if row['cur_orders'] >= 2:
+                repeat_customers += 1
+        if row['customerid'] is None:
+            continue
+        if row['prev_orders']:
+            prev_count += 1
+            if row['cur_orders']:
+                retained += 1
+    return prev_count, retained, cur_customers, repeat_customers
+
+
+## 首頁 KPI 一次計算
+def get_dashboard_kpis(exclude_labels=None, activity_points: int = 4):
+    """
+    首頁所有指標集中在這裡用最少的分組查詢算完：
+      1. 上月 + 本月交易依顧客分組（條件 COUNT）→ CRR、RPR
+      2. 顧客依 categoryid 分組 → 高價值顧客佔比、總顧客數、RFM 分群分布
+      3. 季 / 週活躍度合併成一個條件聚合查詢
+    每一段各自容錯（失敗時給預設值），並回傳各段耗時（毫秒）。
+
+    回傳：
+    {
+        "crr", "rpr", "vip_ratio": 0~1 或 None,
+        "total_customers": int,
+        "distribution": {"labels", "counts", "total"},
+        "quarter_activity", "week_activity": get_customer_activity 的格式,
+        "timings": {"crr_rpr": ms, "customers": ms, "activity": ms, "total": ms},
+    }
+    """
+    started = perf_counter()
+    timings = {}
+    kpis = {
+        "crr": None,
+        "rpr": None,
+        "vip_ratio": None,
+        "total_customers": 0,
+        "distribution": {"labels": [], "counts": [], "total": 0},
+        "quarter_activity": None,
+        "week_activity": None,
+    }
+
+    today = date.today()
+    first_day = today.replace(day=1)
+    prev_first_day = (first_day - timedelta(days=1)).replace(day=1)
+    next_first_day = (first_day + timedelta(days=32)).replace(day=1)
+
+    # === 1. 顧客留存率 CRR + 本月回購率 RPR ===
+    t0 = perf_counter()
+    try:
+        prev_count, retained, cur_customers, repeat_customers = _monthly_order_stats(
+            prev_first_day, first_day, next_first_day
+        )
+        kpis["crr"] = float(retained) / float(prev_count) if prev_count else None
+        kpis["rpr"] = repeat_customers / cur_customers if cur_customers else None
+    except Exception as e:
+        print(f"CRR/RPR 計算錯誤: {e}")
+    timings["crr_rpr"] = round((perf_counter() - t0) * 1000, 2)
+
+    # === 2. 高價值顧客佔比、總顧客數、RFM 分群分布 ===
+    t0 = perf_counter()
+    try:
+        category_rows = list(
+            Customer.objects
+            .values('categoryid')
+            .annotate(
+                count=Count('customerid'),
+                joined=Count('customerid', filter=Q(customerjoinday__lte=today)),
+            )
+        )
+        all_customers = sum(row['count'] for row in category_rows)
+        vip_customers = sum(row['count'] for row in category_rows if row['categoryid'] == '1')
+        kpis["vip_ratio"] = float(vip_customers) / float(all_customers) if all_customers else None
+        kpis["total_customers"] = sum(row['joined'] for row in category_rows)
+        kpis["distribution"] = build_category_distribution(
+            [(row['categoryid'], row['count']) for row in category_rows],
+            exclude_labels=exclude_labels,
+        )
+    except Exception as e:
+        print(f"顧客分群計算錯誤: {e}")
+    timings["customers"] = round((perf_counter() - t0) * 1000, 2)
+
+    # === 3. 季 / 週活躍度 ===
+    t0 = perf_counter()
+    try:
+        activity = get_customer_activity_series({"quarter": activity_points, "week": activity_points})
+        kpis["quarter_activity"] = activity["quarter"]
+        kpis["week_activity"] = activity["week"]
+    except Exception as e:
+        print(f"活躍度計算錯誤: {e}")
+    timings["activity"] = round((perf_counter() - t0) * 1000, 2)
+
+    timings["total"] = round((perf_counter() - started) * 1000, 2)
+    kpis["timings"] = timings
+    return kpis
@@ -0,0 +1,319 @@
+# myCRM/services/category_affinity.py
+"""
+顧客 × 商品類別偏好表（customer_category_affinity）：
+- 每位顧客在每個商品類別的購買件數、明細筆數、數量、金額、件數 / 金額佔比與是否為剛需品
+- rebuild_category_affinity()：整表重建；update_category_affinity()：依交易明細水位線
+  （已處理的最大 transactionID）只重算有新明細的顧客
+- 顧客詳細頁、AI 建議上下文與客群分析都改讀這張表，不必每次掃交易明細
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from myCRM.models import Customer, CustomerCategoryAffinity, Product, ProductCategory, Transaction, TransactionDetail
+
+from .data_version import bump_data_version
+from .sql_utils import quote_column
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# 剛需品判斷：購買頻率 >= 20% 或金額佔比 >= 15%，且購買次數 >= 3
+ESSENTIAL_FREQUENCY = 0.2
+ESSENTIAL_AMOUNT_RATIO = 0.15
+ESSENTIAL_MIN_COUNT = 3
+
+
+def is_essential(count: int, count_share: float, amount_share: float) -> bool:
+    return (count_share >= ESSENTIAL_FREQUENCY or amount_share >= ESSENTIAL_AMOUNT_RATIO) and count >= ESSENTIAL_MIN_COUNT
+
+
+def product_category_names() -> Dict[int, str]:
+    names = {}
+    for category_id, name in ProductCategory.objects.values_list("categoryid", "categoryname"):
+        names[category_id] = name.strip() if name and name.strip() else f"類別 {category_id}"
+    return names
+
+
+# ==================== 彙總 ====================
+
+def _aggregate_sql(customer_count: int = 0) -> str:
+    """依 (顧客, 商品類別) 彙總交易明細；customer_count > 0 時只算 IN (...) 內的顧客"""
+    qn = connection.ops.quote_name
+    d_quantity = quote_column(TransactionDetail, "quantity")
+    d_subtotal = quote_column(TransactionDetail, "subtotal")
+    t_customer = quote_column(Transaction, "customerid")
+    t_id = quote_column(Transaction, "transactionid")
+    p_category = quote_column(Product, "categoryid")
+    where = f"t.{t_customer} IS NOT NULL"
+    if customer_count:
+        where += f" AND t.{t_customer} IN ({', '.join(['%s'] * customer_count)})"
+    return f"""
+        SELECT t.{t_customer},
+               p.{p_category},
+               SUM(CASE WHEN d.{d_quantity} IS NULL OR d.{d_quantity} = 0 THEN 1 ELSE d.{d_quantity} END),
+               COUNT(*),
+               SUM(COALESCE(d.{d_quantity}, 0)),
+               SUM(COALESCE(d.{d_subtotal}, 0)),
+               MAX(t.{t_id})
+        FROM {qn(TransactionDetail._meta.db_table)} d
+        JOIN {qn(Transaction._meta.db_table)} t ON t.{t_id} = d.{quote_column(TransactionDetail, "transactionid")}
+        JOIN {qn(Product._meta.db_table)} p ON p.{quote_column(Product, "productid")} = d.{quote_column(TransactionDetail, "productid")}
+        WHERE {where}
+        GROUP BY t.{t_customer}, p.{p_category}
+    """
+
+
+def aggregate_customer_categories(customer_ids: Optional[Sequence[int]] = None) -> List[tuple]:
+    """(顧客ID, 商品類別原始值, 件數, 明細筆數, 數量, 金額, 最大交易ID) 列表；customer_ids=None 為全部顧客"""
+    params = list(customer_ids or [])
+    if customer_ids is not None and not params:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(_aggregate_sql(len(params)), params)
+        return cursor.fetchall()
+
+
+def build_affinity_rows(aggregates: Iterable[tuple], updated_at=None) -> List[CustomerCategoryAffinity]:
+    """
+    把彙總結果轉成 CustomerCategoryAffinity（尚未存檔）：
+    商品類別無法轉成整數的略過，同一顧客的佔比以其餘類別的合計為分母
+    """
+    updated_at = updated_at or timezone.now()
+    by_customer: Dict[int, Dict[int, List[int]]] = defaultdict(dict)
+    for customer_id, raw_category, count, line_items, quantity, subtotal, last_id in aggregates:
+        try:
+            category_id = int(raw_category)
+        except (TypeError, ValueError):
+            continue
+        totals = by_customer[int(customer_id)].setdefault(category_id, [0, 0, 0, 0, 0])
+        totals[0] += int(count or 0)
+        totals[1] += int(line_items or 0)
+        totals[2] += int(quantity or 0)
+        totals[3] += int(subtotal or 0)
+        totals[4] = max(totals[4], int(last_id or 0))
+
+    rows = []
+    for customer_id, categories in by_customer.items():
+        total_count = sum(t[0] for t in categories.values())
+        total_amount = sum(t[3] for t in categories.values())
+        for category_id, (count, line_items, quantity, subtotal, last_id) in categories.items():
+            count_share = count / total_count if total_count > 0 else 0
+            amount_share = subtotal / total_amount if total_amount > 0 else 0
+            rows.append(CustomerCategoryAffinity(
+                customerid=customer_id,
+                productcategoryid=category_id,
+                purchasecount=count,
+                lineitems=line_items,
+                quantity=quantity,
+                subtotal=subtotal,
+                countshare=round(count_share, 6),
+                amountshare=round(amount_share, 6),
+                isessential=is_essential(count, count_share, amount_share),
+                lasttransactionid=last_id,
+                updatedat=updated_at,
+            ))
+    return rows
+
+
+# ==================== 水位線 ====================
+
+def _watermark_path() -> str:
+    data_dir = str(settings.CRM_DATA_DIR)
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, "category_affinity_watermark.json")
+
+
+def read_affinity_watermark() -> Optional[Dict[str, Any]]:
+    """上次維護偏好表時的交易明細水位線；沒有或格式錯誤時回傳 None。"""
+    try:
+        with open(_watermark_path(), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {**data, "last_transaction_id": int(data["last_transaction_id"])}
+    except Exception:
+        return None
+
+
+def _write_watermark(last_transaction_id: int) -> Dict[str, Any]:
+    watermark = {"last_transaction_id": int(last_transaction_id), "updated_at": timezone.now().isoformat()}
+    path = _watermark_path()
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(watermark, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return watermark
+
+
+def _max_detail_transaction_id() -> int:
+    return int(TransactionDetail.objects.aggregate(max_id=Max("transactionid"))["max_id"] or 0)
+
+
+# ==================== 維護 ====================
+
+def rebuild_category_affinity(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """整表重建偏好表並更新水位線，回傳報告。"""
+    start = time.perf_counter()
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+    # 先記下水位線：計算期間新增的明細留給下一次增量更新
+    last_transaction_id = _max_detail_transaction_id()
+    rows = build_affinity_rows(aggregate_customer_categories())
+
+    with transaction.atomic():
+        CustomerCategoryAffinity.objects.all().delete()
+        CustomerCategoryAffinity.objects.bulk_create(rows, batch_size=batch_size)
+
+    watermark = _write_watermark(last_transaction_id)
+    bump_data_version("category_affinity")
+    return {
+        "mode": "rebuild",
+        "customers": len({row.customerid for row in rows}),
+        "rows": len(rows),
+        "watermark": watermark,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def _customers_with_new_details(last_transaction_id: int) -> List[int]:
+    txn_ids = TransactionDetail.objects.filter(transactionid__gt=last_transaction_id).values("transactionid")
+    return sorted(
+        cid for cid in
+        Transaction.objects.filter(transactionid__in=txn_ids).values_list("customerid", flat=True).distinct()
+        if cid is not None
+    )
+
+
+def update_category_affinity(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    只重算水位線之後有新交易明細的顧客（每位顧客整段歷史重算，佔比才會正確）；
+    沒有水位線時改跑 rebuild_category_affinity()。
+    修改 / 刪除既有明細偵測不到，需要時請整表重建。
+    """
+    previous = read_affinity_watermark()
+    if previous is None:
+        return rebuild_category_affinity(batch_size=batch_size)
+
+    start = time.perf_counter()
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+    last_transaction_id = _max_detail_transaction_id()
+    affected = _customers_with_new_details(previous["last_transaction_id"])
+
+    updated_rows = 0
+    updated_at = timezone.now()
+    for i in range(0, len(affected), batch_size):
+        chunk = affected[i:i + batch_size]
+        rows = build_affinity_rows(aggregate_customer_categories(chunk), updated_at)
+        with transaction.atomic():
+            CustomerCategoryAffinity.objects.filter(customerid__in=chunk).delete()
+            CustomerCategoryAffinity.objects.bulk_create(rows, batch_size=batch_size)
+        updated_rows += len(rows)
+
+    watermark = _write_watermark(max(last_transaction_id, previous["last_transaction_id"]))
+    if affected:
+        bump_data_version("category_affinity")
+    return {
+        "mode": "incremental",
+        "customers": len(affected),
+        "rows": updated_rows,
+        "previous_watermark": previous,
+        "watermark": watermark,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+# ==================== 讀取 ====================
+
+def affinity_is_current(last_transaction_id: int) -> bool:
+    """顧客最新的交易（last_transaction_id）是否已計入偏好表"""
+    watermark = read_affinity_watermark()
+    return watermark is not None and int(last_transaction_id or 0) <= watermark["last_transaction_id"]
+
+
+def get_customer_category_stats(customer_id: int, live: bool = False) -> List[Dict[str, Any]]:
+    """
+    顧客詳細頁「產品類別統計」格式：[{"name", "count", "total_amount"}, ...]，
+    同名類別合併，依件數由多到少排序。預設讀偏好表；live=True 時直接彙總交易明細
+    """
+    if live:
+        rows = [
+            (row.productcategoryid, row.purchasecount, row.subtotal)
+            for row in build_affinity_rows(aggregate_customer_categories([customer_id]))
+        ]
+    else:
+        rows = list(
+            CustomerCategoryAffinity.objects
+            .filter(customerid=customer_id)
+            .values_list("productcategoryid", "purchasecount", "subtotal")
+        )
+    names = product_category_names() if rows else {}
+    stats: Dict[str, Dict[str, Any]] = {}
+    for category_id, count, subtotal in rows:
+        name = names.get(category_id, f"類別 {category_id}")
+        entry = stats.setdefault(name, {"name": name, "count": 0, "total_amount": 0})
+        entry["count"] += count
+        entry["total_amount"] += subtotal
+    return sorted(stats.values(), key=lambda x: x["count"], reverse=True)
+
+
+def _segment_sql() -> str:
+    qn = connection.ops.quote_name
+    a_customer = quote_column(CustomerCategoryAffinity, "customerid")
+    a_category = quote_column(CustomerCategoryAffinity, "productcategoryid")
+    c_segment = quote_column(Customer, "categoryid")
+    return f"""
+        SELECT c.{c_segment},
+               a.{a_category},
+               COUNT(*),
+               SUM(a.{quote_column(CustomerCategoryAffinity, "purchasecount")}),
+               SUM(a.{quote_column(CustomerCategoryAffinity, "subtotal")}),
+               SUM(CASE WHEN a.{quote_column(CustomerCategoryAffinity, "isessential")} THEN 1 ELSE 0 END)
+        FROM {qn(CustomerCategoryAffinity._meta.db_table)} a
+        JOIN {qn(Customer._meta.db_table)} c ON c.{quote_column(Customer, "customerid")} = a.{a_customer}
+        GROUP BY c.{c_segment}, a.{a_category}
+    """
+
+
+def get_segment_category_affinity(top_n: int = 5) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    各客群（customer.categoryID）購買件數最多的 top_n 個商品類別：
+    {客群: [{"category_id", "name", "customers", "count", "total_amount", "essential_customers"}, ...]}
+    偏好表尚未建立時回傳 {}。
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(_segment_sql())
+            rows = cursor.fetchall()
+    except DatabaseError:
+        logger.warning("customer_category_affinity is not available; run migrate and build_category_affinity")
+        return {}
+
+    names = product_category_names() if rows else {}
+    by_segment: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for raw_segment, category_id, customers, count, subtotal, essential in rows:
+        try:
+            segment = int(raw_segment)
+        except (TypeError, ValueError):
+            continue
+        by_segment[segment].append({
+            "category_id": category_id,
+            "name": names.get(category_id, f"類別 {category_id}"),
+            "customers": int(customers or 0),
+            "count": int(count or 0),
+            "total_amount": int(subtotal or 0),
+            "essential_customers": int(essential or 0),
+        })
+    return {
+        segment: sorted(items, key=lambda x: x["count"], reverse=True)[:top_n]
+        for segment, items in by_segment.items()
+    }
@@ -5,7 +5,10 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError
@@ -17,16 +20,24 @@ from myCRM.services.ai_suggestion_service import (
     parse_chatgpt_suggestion,
     get_initial_suggestion,
     save_final_suggestion,
-    get_comprehensive_customer_analysis,  # 新增綜合分析
     SEGMENT_NAME,  # 客群名稱映射
 )
+from myCRM.services.analysis_cache import get_analysis_context
+from myCRM.services.llm_cache import get_cached_reply, llm_cache_stats, make_key, store_reply
 
 # 設置日誌
 logger = logging.getLogger(__name__)
 
-# 初始化OpenAI客戶端
+CHAT_MODEL = "gpt-4o-mini"
+INIT_TEMPERATURE = 0.7
+INIT_MAX_TOKENS = 1500
+
+# 初始化OpenAI客戶端（OPENAI_BASE_URL 可指向相容 OpenAI API 的其他服務，例如本機測試用的 fake server）
 try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=getattr(settings, "OPENAI_BASE_URL", None) or None,
+    )
 except Exception as e:
     logger.error(f"OpenAI client initialization failed: {e}")
     client = None
@@ -34,31 +45,10 @@ except Exception as e:
 
 def _get_enhanced_analysis_context(category_id: int) -> Dict[str, Any]:
     """
-    獲取增強的客群分析上下文信息
+    獲取增強的客群分析上下文信息（經由 analysis_cache，資料沒變時不重跑綜合分析）
     """
     try:
-        # 獲取綜合分析數據
-        comprehensive_data = get_comprehensive_customer_analysis(
-            category_id=category_id, 
-            top_customers=10
-        )
-        
-        category_analysis = comprehensive_data.get('category_specific_analysis', {})
-        general_stats = comprehensive_data.get('consumption_statistics', {})
-        
-        context = {
-            'category_name': SEGMENT_NAME.get(category_id, f'客群{category_id}'),
-            'total_customers': category_analysis.get('total_customers_in_category', 0),
-            'churn_probability': category_analysis.get('churn_analysis', {}).get('average_churn_probability', 0),
-            'high_risk_count': category_analysis.get('churn_analysis', {}).get('high_risk_count', 0),
-            'avg_next_purchase_days': category_analysis.get('next_purchase_analysis', {}).get('average_next_purchase_days', 0),
-            'customers_buying_soon': len(category_analysis.get('next_purchase_analysis', {}).get('customers_buying_soon', [])),
-            'rfm_scores': category_analysis.get('rfm_statistics', {}),
-            'general_revenue': general_stats.get('total_revenue', 0),
-            'general_conversion_rate': general_stats.get('purchase_conversion_rate', 0)
-        }
-        
-        return context
+        return get_analysis_context(category_id)["context"]
         
     except Exception as e:
         logger.warning(f"Failed to get comprehensive analysis for category {category_id}: {e}")
@@ -66,24 +56,23 @@ def _get_enhanced_analysis_context(category_id: int) -> Dict[str, Any]:
             'category_name': SEGMENT_NAME.get(category_id, f'客群{category_id}'),
             'total_customers': 0,
             'churn_probability': 0,
+            'high_risk_count': 0,
+            'customers_buying_soon': 0,
+            'avg_next_purchase_days': 'N/A',
+            'top_product_categories': [],
             'error': '無法獲取詳細分析數據'
         }
 
 
-# API：ai建議頁面初始載入->給1筆模型分析+ChatGPT建議
-@csrf_exempt
-@require_http_methods(["GET"])
-def ai_suggestion_init(request):
-    """
-    前端一打開 ai-suggestion.html，就會呼叫這個 API，
-    提供基於綜合客戶分析的智能優惠券建議：
-    - 整合RFM、CatBoost流失預測、LSTM購買預測
-    - 右側聊天區會顯示這次問答
-    - 左側列表會顯示從這次回答解析出的「建議優惠券 / 預期成果」
-    """
-    if not client:
-        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
-    
+def _format_product_categories(analysis_context: Dict[str, Any]) -> str:
+    """客群最常購買的商品類別，例如「生鮮（120人購買，45人為剛需）」；沒有資料時回傳空字串"""
+    return "、".join(
+        f"{item['name']}（{item['customers']}人購買，{item['essential_customers']}人為剛需）"
+        for item in analysis_context.get('top_product_categories') or []
+    )
+
+
+def _parse_init_params(request) -> Tuple[int, str]:
     try:
         category_id = int(request.GET.get("categoryID", 1))
         if category_id not in range(1, 8):  # 有效客群ID範圍
@@ -92,7 +81,20 @@ def ai_suggestion_init(request):
         category_id = 1
         
     period = request.GET.get("period", "month")
-    
+    return category_id, period
+
+
+def _use_llm_cache(request) -> bool:
+    """?cache=0 時不讀取快取的回覆，強制重新產生"""
+    return request.GET.get("cache", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _init_cache_key(messages: list) -> str:
+    return make_key(CHAT_MODEL, messages, INIT_TEMPERATURE, INIT_MAX_TOKENS)
+
+
+def _build_init_prompt(category_id: int, period: str) -> Tuple[list, str, Dict[str, Any]]:
+    """初始建議的 messages、使用者問題與分析上下文"""
     period_text = {
         "month": "本月",
         "quarter": "本季",
@@ -101,6 +103,8 @@ def ai_suggestion_init(request):
     # 獲取增強的分析上下文
     analysis_context = _get_enhanced_analysis_context(category_id)
     
+    product_categories = _format_product_categories(analysis_context)
+
     # 構建更詳細的用戶問題
     user_question = (
         f"基於我們的綜合客戶分析系統（整合RFM模型、CatBoost流失預測、LSTM購買預測），"
@@ -108,7 +112,9 @@ def ai_suggestion_init(request):
         f"- 平均流失機率：{analysis_context['churn_probability']:.1%}\n"
         f"- 高風險客戶數：{analysis_context['high_risk_count']}人\n"
         f"- 預期下次購買天數：{analysis_context.get('avg_next_purchase_days', 'N/A')}天\n"
-        f"- 即將購買客戶數：{analysis_context['customers_buying_soon']}人\n\n"
+        f"- 即將購買客戶數：{analysis_context['customers_buying_soon']}人\n"
+        + (f"- 主要購買商品類別：{product_categories}\n" if product_categories else "")
+        + "\n"
         "請幫我設計具體的優惠券方案（包括優惠券類型與使用門檻、開始時間、結束時間），"
         "以及根據這些優惠券方案推估的預期成效（例如回購率、營收、流失率的變化）。"
     )
@@ -116,41 +122,76 @@ def ai_suggestion_init(request):
     # 取得模型摘要+提示詞（保持原有邏輯）
     system_text = get_initial_suggestion(category_id)
 
+    messages = [
+        {"role": "system", "content": system_text},
+        {"role": "user", "content": user_question}
+    ]
+    return messages, user_question, analysis_context
+
+
+def _finish_init(full_text: str, user_question: str, analysis_context: Dict[str, Any]) -> Dict[str, Any]:
+    """解析初始建議的回覆，組成回傳給前端的資料"""
+    # 解析ChatGPT回覆 → 建議優惠券/預期成果
+    coupon, outcome = parse_chatgpt_suggestion(full_text)
+    
+    # 構建建議項目
+    item = {
+        "id": f"init-{datetime.now().timestamp()}",
+        "strategy_points": coupon or [],
+        "outcome_points": outcome or [],
+        "executed": False,
+        "tag": "AI綜合分析建議",
+        "analysis_context": analysis_context,  # 添加分析上下文
+    }
+    
+    return {
+        "success": True,
+        "initial": item,              # 左側列表用
+        "question": user_question,     # 右側聊天使用者Q
+        "reply": full_text,           # 右側聊天AI回覆全文
+        "analysis_summary": analysis_context  # 分析摘要
+    }
+
+
+# API：ai建議頁面初始載入->給1筆模型分析+ChatGPT建議
+@csrf_exempt
+@require_http_methods(["GET"])
+def ai_suggestion_init(request):
+    """
+    前端一打開 ai-suggestion.html，就會呼叫這個 API，
+    提供基於綜合客戶分析的智能優惠券建議：
+    - 整合RFM、CatBoost流失預測、LSTM購買預測
+    - 右側聊天區會顯示這次問答
+    - 左側列表會顯示從這次回答解析出的「建議優惠券 / 預期成果」
+    """
+    if not client:
+        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
+    
+    category_id, period = _parse_init_params(request)
+    messages, user_question, analysis_context = _build_init_prompt(category_id, period)
+    cache_key = _init_cache_key(messages)
+
     try:
-        # 呼叫ChatGPT
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_text},
-                {"role": "user", "content": user_question}
-            ],
-            temperature=0.7,
-            max_tokens=1500
-        )
-        full_text = completion.choices[0].message.content.strip()
+        # 同樣的提示詞已問過時直接使用快取的回覆（?cache=0 可略過）
+        full_text = get_cached_reply(cache_key) if _use_llm_cache(request) else None
+        cached = full_text is not None
+        if not cached:
+            # 呼叫ChatGPT
+            completion = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=INIT_TEMPERATURE,
+                max_tokens=INIT_MAX_TOKENS
+            )
+            full_text = completion.choices[0].message.content.strip()
+            store_reply(cache_key, full_text)
         
-        # 解析ChatGPT回覆 → 建議優惠券/預期成果
-        coupon, outcome = parse_chatgpt_suggestion(full_text)
+        payload = _finish_init(full_text, user_question, analysis_context)
+        payload["cached"] = cached
         
-        # 構建建議項目
-        item = {
-            "id": f"init-{datetime.now().timestamp()}",
-            "strategy_points": coupon or [],
-            "outcome_points": outcome or [],
-            "executed": False,
-            "tag": "AI綜合分析建議",
-            "analysis_context": analysis_context,  # 添加分析上下文
-        }
-        
-        logger.info(f"Generated AI suggestion for category {category_id}")
+        logger.info(f"Generated AI suggestion for category {category_id} (cached={cached})")
         
-        return JsonResponse({
-            "success": True,
-            "initial": item,              # 左側列表用
-            "question": user_question,     # 右側聊天使用者Q
-            "reply": full_text,           # 右側聊天AI回覆全文
-            "analysis_summary": analysis_context  # 分析摘要
-        })
+        return JsonResponse(payload)
         
     except Exception as e:
         logger.error(f"AI suggestion generation failed: {e}")
@@ -160,21 +201,8 @@ def ai_suggestion_init(request):
             "analysis_summary": analysis_context
         }, status=500)
 
-#API 2：聊天用（右邊chatGPT對話框）
-@csrf_exempt
-@require_http_methods(["POST"])
-def chat(request):
-    """
-    增強版聊天API：
-    - 使用者問問題
-    - ChatGPT基於綜合分析數據回答
-    - 存入chat_record table
-    - 若回答符合「建議優惠券 / 預期成果」格式 → 自動產生新的建議項目（左側欄位）
-    - 支持上下文感知的對話
-    """
-    if not client:
-        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
-
+def _parse_chat_request(request) -> Tuple[Optional[Dict[str, Any]], Optional[JsonResponse]]:
+    """解析並驗證聊天請求，回傳 (參數, 錯誤回應)"""
     try:
         data = json.loads(request.body.decode("utf-8"))
         user_msg = (data.get("message") or "").strip()
@@ -186,16 +214,26 @@ def chat(request):
         
     except (json.JSONDecodeError, ValueError, TypeError) as e:
         logger.warning(f"Invalid request data: {e}")
-        return JsonResponse({"error": "Invalid JSON format or data types"}, status=400)
+        return None, JsonResponse({"error": "Invalid JSON format or data types"}, status=400)
 
     # 參數驗證
     if not user_msg:
-        return JsonResponse({"error": "message required"}, status=400)
+        return None, JsonResponse({"error": "message required"}, status=400)
     if not category_id or category_id not in range(1, 8):
-        return JsonResponse({"error": "valid categoryID (1-7) required"}, status=400)
+        return None, JsonResponse({"error": "valid categoryID (1-7) required"}, status=400)
     if len(user_msg) > 1000:  # 限制消息長度
-        return JsonResponse({"error": "message too long (max 1000 characters)"}, status=400)
+        return None, JsonResponse({"error": "message too long (max 1000 characters)"}, status=400)
 
+    return {
+        "user_msg": user_msg,
+        "category_id": category_id,
+        "user_id": user_id,
+        "include_context": include_context,
+    }, None
+
+
+def _build_chat_messages(category_id: int, user_msg: str, include_context: bool) -> Tuple[list, Dict[str, Any]]:
+    """組出送給 ChatGPT 的 messages（系統提示詞 + 最近對話 + 使用者問題）與分析上下文"""
     # 獲取當前客群的分析上下文
     analysis_context = _get_enhanced_analysis_context(category_id) if include_context else {}
     
@@ -212,6 +250,9 @@ def chat(request):
 - 即將購買客戶：{analysis_context['customers_buying_soon']}人
 - 平均下次購買天數：{analysis_context.get('avg_next_purchase_days', 'N/A')}天
 """
+        product_categories = _format_product_categories(analysis_context)
+        if product_categories:
+            context_info += f"- 主要購買商品類別：{product_categories}\n"
     
     system_prompt = f"""
 你是一位專業的中文AI行銷顧問，專門基於數據分析設計「優惠券方案」。
@@ -242,28 +283,93 @@ def chat(request):
 請保持專業、數據導向的建議風格。
 """
 
-    try:
-        # 構建對話消息
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ]
+    # 構建對話消息
+    messages = [
+        {"role": "system", "content": system_prompt},
+    ]
+    
+    # 可選：添加最近的對話歷史
+    if include_context:
+        recent_chats = ChatRecord.objects.filter(
+            categoryID=category_id
+        ).order_by('-chatID')[:3]  # 最近3條對話
         
-        # 可選：添加最近的對話歷史
-        if include_context:
-            recent_chats = ChatRecord.objects.filter(
-                categoryID=category_id
-            ).order_by('-chatID')[:3]  # 最近3條對話
-            
-            for chat in reversed(recent_chats):  # 按時間順序
-                messages.append({"role": "user", "content": chat.userContent})
-                messages.append({"role": "assistant", "content": chat.aiContent})
+        for chat in reversed(recent_chats):  # 按時間順序
+            messages.append({"role": "user", "content": chat.userContent})
+            messages.append({"role": "assistant", "content": chat.aiContent})
+    
+    # 添加當前用戶消息
+    messages.append({"role": "user", "content": user_msg})
+    return messages, analysis_context
+
+
+def _finish_chat(
+    user_id: int,
+    category_id: int,
+    user_msg: str,
+    reply: str,
+    analysis_context: Dict[str, Any],
+) -> Dict[str, Any]:
+    """寫入 chat_record 並解析回覆中的建議，回傳給前端的資料"""
+    # 寫入chat_record
+    ChatRecord.objects.create(
+        user_id=user_id,           
+        categoryID=category_id,
+        userContent=user_msg,
+        aiContent=reply,
+    )
+    
+    # 判斷回覆是否有「建議優惠券: ... 預期成果: ...」
+    coupon, outcome = parse_chatgpt_suggestion(reply)
+    
+    new_suggestion = None
+    if coupon and outcome:
+        new_suggestion = {
+            "id": f"chat-{datetime.now().timestamp()}",
+            "strategy_points": coupon,
+            "outcome_points": outcome,
+            "executed": False,
+            "tag": "AI智能微調建議",
+            "analysis_context": analysis_context,  # 添加分析上下文
+        }
         
-        # 添加當前用戶消息
-        messages.append({"role": "user", "content": user_msg})
+    logger.info(f"Chat processed for category {category_id}, user {user_id}")
+    
+    return {
+        "success": True,
+        "reply": reply,
+        "newSuggestion": new_suggestion,  # 左邊自動新增
+        "analysis_context": analysis_context  # 返回分析上下文
+    }
+
+
+#API 2：聊天用（右邊chatGPT對話框）
+@csrf_exempt
+@require_http_methods(["POST"])
+def chat(request):
+    """
+    增強版聊天API：
+    - 使用者問問題
+    - ChatGPT基於綜合分析數據回答
+    - 存入chat_record table
+    - 若回答符合「建議優惠券 / 預期成果」格式 → 自動產生新的建議項目（左側欄位）
+    - 支持上下文感知的對話
+    """
+    if not client:
+        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
+
+    params, error = _parse_chat_request(request)
+    if error:
+        return error
+
+    try:
+        messages, analysis_context = _build_chat_messages(
+            params["category_id"], params["user_msg"], params["include_context"]
+        )
         
         # 送交 ChatGPT
         completion = client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=CHAT_MODEL,
             messages=messages,
             temperature=0.7,
             max_tokens=1200
@@ -278,36 +384,9 @@ def chat(request):
         }, status=500)
 
     try:
-        # 寫入chat_record
-        ChatRecord.objects.create(
-            user_id=user_id,           
-            categoryID=category_id,
-            userContent=user_msg,
-            aiContent=reply,
-        )
-        
-        # 判斷回覆是否有「建議優惠券: ... 預期成果: ...」
-        coupon, outcome = parse_chatgpt_suggestion(reply)
-        
-        new_suggestion = None
-        if coupon and outcome:
-            new_suggestion = {
-                "id": f"chat-{datetime.now().timestamp()}",
-                "strategy_points": coupon,
-                "outcome_points": outcome,
-                "executed": False,
-                "tag": "AI智能微調建議",
-                "analysis_context": analysis_context,  # 添加分析上下文
-            }
-            
-        logger.info(f"Chat processed for category {category_id}, user {user_id}")
-        
-        return JsonResponse({
-            "success": True,
-            "reply": reply,
-            "newSuggestion": new_suggestion,  # 左邊自動新增
-            "analysis_context": analysis_context  # 返回分析上下文
-        })
+        return JsonResponse(_finish_chat(
+            params["user_id"], params["category_id"], params["user_msg"], reply, analysis_context
+        ))
         
     except Exception as e:
         logger.error(f"Chat processing failed: {e}")
@@ -317,16 +396,131 @@ def chat(request):
         }, status=500)
 
 
-#API 3：執行建議（寫入ai_suggection表）
+# ========== 串流回覆（Server-Sent Events） ==========
+# 事件：
+#   meta  → 開始產生前先送出的資料（例如初始建議的使用者問題、分析上下文）
+#   token → {"delta": "..."} 逐段送出 ChatGPT 的回覆
+#   done  → 與非串流 API 相同的完整回傳資料（已寫入 chat_record / 解析建議）
+#   error → {"error": "..."}
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _iter_reply_deltas(messages: list, max_tokens: int, temperature: float = 0.7):
+    """以 stream=True 呼叫 ChatGPT，逐段產生回覆文字"""
+    stream = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def _stream_events(deltas, finish, meta: Optional[Dict[str, Any]] = None):
+    if meta is not None:
+        yield _sse("meta", meta)
+    parts = []
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            yield _sse("token", {"delta": delta})
+        yield _sse("done", finish("".join(parts).strip()))
+    except Exception as e:
+        logger.error(f"Streaming chat failed: {e}")
+        yield _sse("error", {"success": False, "error": "AI服務暫時不可用，請稍後再試"})
+
+
+async def _stream_events_async(deltas, finish, meta: Optional[Dict[str, Any]] = None):
+    """ASGI 版本：OpenAI 串流在 thread pool 讀取，寫資料庫交給 sync_to_async"""
+    if meta is not None:
+        yield _sse("meta", meta)
+    next_delta = sync_to_async(next, thread_sensitive=False)
+    parts = []
+    try:
+        while True:
+            delta = await next_delta(deltas, None)
+            if delta is None:
+                break
+            parts.append(delta)
+            yield _sse("token", {"delta": delta})
+        payload = await sync_to_async(finish)("".join(parts).strip())
+        yield _sse("done", payload)
+    except Exception as e:
+        logger.error(f"Streaming chat failed: {e}")
+        yield _sse("error", {"success": False, "error": "AI服務暫時不可用，請稍後再試"})
+
+
+def _sse_response(request, deltas, finish, meta: Optional[Dict[str, Any]] = None) -> StreamingHttpResponse:
+    # ASGI 下同步 iterator 會被整個讀完才送出，所以改用 async iterator
+    if isinstance(request, ASGIRequest):
+        content = _stream_events_async(deltas, finish, meta)
+    else:
+        content = _stream_events(deltas, finish, meta)
+    response = StreamingHttpResponse(content, content_type="text/event-stream; charset=utf-8")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # 避免 nginx 緩衝
+    return response
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def execute_suggestion(request):
-    """
-    使用者執行AI建議：
-    - 保存建議到ai_suggection表
-    - 創建優惠券活動到campaign表
-    - 記錄執行日誌
-    """
+def chat_stream(request):
+    """聊天 API 的串流版本：參數與 chat 相同，回覆以 SSE 逐段送出"""
+    if not client:
+        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
+
+    params, error = _parse_chat_request(request)
+    if error:
+        return error
+
+    messages, analysis_context = _build_chat_messages(
+        params["category_id"], params["user_msg"], params["include_context"]
+    )
+
+    def finish(reply: str) -> Dict[str, Any]:
+        return _finish_chat(params["user_id"], params["category_id"], params["user_msg"], reply, analysis_context)
+
+    return _sse_response(request, _iter_reply_deltas(messages, max_tokens=1200), finish)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def ai_suggestion_init_stream(request):
+    """初始建議 API 的串流版本：先送出 meta（使用者問題），再逐段送出回覆"""
+    if not client:
+        return JsonResponse({"error": "OpenAI service unavailable"}, status=503)
+
+    category_id, period = _parse_init_params(request)
+    messages, user_question, analysis_context = _build_init_prompt(category_id, period)
+    cache_key = _init_cache_key(messages)
+    cached_text = get_cached_reply(cache_key) if _use_llm_cache(request) else None
+
+    def finish(full_text: str) -> Dict[str, Any]:
+        if cached_text is None:
+            store_reply(cache_key, full_text)
+        payload = _finish_init(full_text, user_question, analysis_context)
+        payload["cached"] = cached_text is not None
+        return payload
+
+    if cached_text is not None:
+        # 命中快取時整段回覆一次送出
+        deltas = iter([cached_text])
+    else:
+        deltas = _iter_reply_deltas(messages, max_tokens=INIT_MAX_TOKENS, temperature=INIT_TEMPERATURE)
+    meta = {"question": user_question, "analysis_summary": analysis_context, "cached": cached_text is not None}
+    return _sse_response(request, deltas, finish, meta=meta)
+
+
+def _parse_execute_request(request) -> Tuple[Optional[Dict[str, Any]], Optional[JsonResponse]]:
+    """解析並驗證執行建議的請求，回傳 (參數, 錯誤回應)"""
     try:
         data = json.loads(request.body.decode("utf-8"))
         category_id = int(data.get("categoryID"))
@@ -339,31 +533,60 @@ def execute_suggestion(request):
         
     except (json.JSONDecodeError, ValueError, TypeError) as e:
         logger.warning(f"Invalid execute suggestion data: {e}")
-        return JsonResponse({"error": "Invalid request data"}, status=400)
+        return None, JsonResponse({"error": "Invalid request data"}, status=400)
 
     # 參數驗證
     if not category_id or category_id not in range(1, 8):
-        return JsonResponse({"error": "Valid categoryID required"}, status=400)
+        return None, JsonResponse({"error": "Valid categoryID required"}, status=400)
     if not guideline:
-        return JsonResponse({"error": "Guideline content required"}, status=400)
+        return None, JsonResponse({"error": "Guideline content required"}, status=400)
+
+    return {
+        "category_id": category_id,
+        "guideline": guideline,
+        "outcome": outcome,
+        "user_id": user_id,
+        "source": suggestion_source,
+    }, None
+
+
+def _execute_payload(params: Dict[str, Any], suggest_id) -> Dict[str, Any]:
+    logger.info(
+        f"Suggestion executed: ID={suggest_id}, Category={params['category_id']}, "
+        f"User={params['user_id']}, Source={params['source']}"
+    )
+    return {
+        "success": True,
+        "status": "executed",
+        "suggestID": suggest_id,
+        "message": "建議已成功執行並創建優惠券活動"
+    }
+
+
+#API 3：執行建議（寫入ai_suggection表）
+@csrf_exempt
+@require_http_methods(["POST"])
+def execute_suggestion(request):
+    """
+    使用者執行AI建議：
+    - 保存建議到ai_suggection表
+    - 創建優惠券活動到campaign表
+    - 記錄執行日誌
+    """
+    params, error = _parse_execute_request(request)
+    if error:
+        return error
 
     try:
         # 執行建議保存
         suggest_id = save_final_suggestion(
-            category_id=category_id,
-            guideline=guideline,
-            expected=outcome,
-            user_id=user_id,
+            category_id=params["category_id"],
+            guideline=params["guideline"],
+            expected=params["outcome"],
+            user_id=params["user_id"],
         )
         
-        logger.info(f"Suggestion executed: ID={suggest_id}, Category={category_id}, User={user_id}, Source={suggestion_source}")
-        
-        return JsonResponse({
-            "success": True,
-            "status": "executed",
-            "suggestID": suggest_id,
-            "message": "建議已成功執行並創建優惠券活動"
-        })
+        return JsonResponse(_execute_payload(params, suggest_id))
         
     except Exception as e:
         logger.error(f"Failed to execute suggestion: {e}")
@@ -400,3 +623,8 @@ def get_category_analysis(request):
             "error": "無法獲取客群分析"
         }, status=500)
 
+
+@require_http_methods(["GET"])
+def llm_cache_status(request):
+    """ChatGPT 回覆快取的命中 / 未命中統計"""
+    return JsonResponse({"success": True, "llm_cache": llm_cache_stats()})
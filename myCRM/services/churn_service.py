@@ -2,10 +2,12 @@ from __future__ import annotations
 
 import json
 import os
+import threading
 from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional
 
-from django.db.models import Count, Max, Sum
+import numpy as np
+from django.db.models import Count, Max, Q, Sum
 
 try:
     from catboost import CatBoostClassifier
@@ -15,7 +17,13 @@ except Exception:  # pragma: no cover
 
 
 from myCRM.models import Transaction
-from .rfm_count import rfm_score_from_raw, classify_customer
+from .rfm_count import rfm_scores_from_raw_array, classify_customers_array
+from .model_registry import get_model, model_registry_stats
+from .feature_store import customer_rfm_features, rfm_raw_arrays
+from .transaction_store import get_transaction_store, transaction_store_enabled
+
+CHURN_MODEL_NAME = "churn_catboost"
+DEFAULT_CHURN_FEATURES = ["rScore", "fScore", "mScore"]
 
 
 def _parse_as_of(as_of: Optional[str]) -> date:
@@ -36,69 +44,120 @@ def _meta_path() -> str:
     return os.path.join(_model_dir(), "churn_model.meta.json")
 
 
+def _load_churn_model() -> Dict[str, Any]:
+    model = CatBoostClassifier()
+    model.load_model(_model_path())
+    meta: Dict[str, Any] = {}
+    try:
+        if os.path.exists(_meta_path()):
+            with open(_meta_path(), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+    except Exception:
+        pass
+    return {
+        "model": model,
+        "features": meta.get("features", DEFAULT_CHURN_FEATURES),
+        "meta": meta,
+    }
+
+
+def get_churn_model() -> Optional[Dict[str, Any]]:
+    """
+    取得快取的流失模型 {"model", "features", "meta"}；沒有模型檔或未安裝 catboost 時回傳 None。
+    模型檔或 meta 檔更新後（重新訓練）會自動重新載入。
+    """
+    if not (_CATBOOST_AVAILABLE and os.path.exists(_model_path())):
+        return None
+    return get_model(CHURN_MODEL_NAME, _load_churn_model, [_model_path(), _meta_path()])
+
+
+def churn_model_info() -> Dict[str, Any]:
+    """目前使用中的模型版本與快取統計（載入耗時、命中次數）。"""
+    loaded = get_churn_model()
+    meta = loaded["meta"] if loaded else {}
+    return {
+        "source": "catboost" if loaded else "heuristic",
+        "version": meta.get("version"),
+        "as_of": meta.get("as_of"),
+        "registry": model_registry_stats().get(CHURN_MODEL_NAME),
+    }
+
+
+def _write_atomic_json(path: str, data: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
 def _build_rfm(as_of: Optional[str] = None, window_days: int = 365) -> List[Dict[str, Any]]:
     as_of_date = _parse_as_of(as_of)
-    window_start = as_of_date - timedelta(days=window_days)
 
-    last_dates = (
-        Transaction.objects
-        .filter(transdate__lte=as_of_date)
-        .values("customerid")
-        .annotate(last_date=Max("transdate"))
-    )
+    # 優先讀取 worker 間共用的特徵快照，不可用時即時計算
+    features = customer_rfm_features(as_of_date, window_days)
+    if features is None:
+        features = rfm_raw_arrays(as_of_date, as_of_date - timedelta(days=window_days))
+    cids, recency, freq, money = features
 
-    last_date_by_cust: Dict[int, date] = {}
-    for row in last_dates:
-        cid = row.get("customerid")
-        if cid is None:
-            continue
-        last_date_by_cust[int(cid)] = row.get("last_date")
+    if len(cids) == 0:
+        return []
+    return _rfm_rows(cids.tolist(), recency, freq, money)
 
-    window_stats = (
-        Transaction.objects
-        .filter(transdate__gte=window_start, transdate__lte=as_of_date)
-        .values("customerid")
-        .annotate(freq=Count("transactionid"), money=Sum("totalprice"))
-    )
 
-    freq_by_cust: Dict[int, int] = {}
-    money_by_cust: Dict[int, float] = {}
-    for row in window_stats:
-        cid = row.get("customerid")
-        if cid is None:
-            continue
-        freq_by_cust[int(cid)] = int(row.get("freq") or 0)
-        total = row.get("money")
-        money_by_cust[int(cid)] = float(total) if total is not None else 0.0
+def _rfm_rows(cids: List[int], recency: np.ndarray, freq: np.ndarray, money: np.ndarray) -> List[Dict[str, Any]]:
+    # 計算 RFM 分數與客戶分類（向量化）
+    r_scores, f_scores, m_scores = rfm_scores_from_raw_array(recency, freq, money)
+    categories = classify_customers_array(r_scores, f_scores, m_scores)
 
     results: List[Dict[str, Any]] = []
-    for cid, last_dt in last_date_by_cust.items():
-        recency_days = (as_of_date - last_dt).days if last_dt else 10**9
-        freq = freq_by_cust.get(cid, 0)
-        money = money_by_cust.get(cid, 0.0)
-        
-        # 計算 RFM 分數
-        r_score, f_score, m_score = rfm_score_from_raw(
-            int(recency_days), int(freq), float(money)
-        )
-        
-        # 計算客戶分類
-        category_id = classify_customer(r_score, f_score, m_score)
-        
+    for i, cid in enumerate(cids):
         results.append({
             "customerid": cid,
-            "recency_days": int(recency_days),
-            "frequency": int(freq),
-            "monetary": float(money),
-            "rScore": r_score,
-            "fScore": f_score,
-            "mScore": m_score,
-            "categoryID": category_id,
+            "recency_days": int(recency[i]),
+            "frequency": int(freq[i]),
+            "monetary": float(money[i]),
+            "rScore": int(r_scores[i]),
+            "fScore": int(f_scores[i]),
+            "mScore": int(m_scores[i]),
+            "categoryID": int(categories[i]),
         })
 
     return results
 
 
+def _build_rfm_for_customer(
+    customer_id: int,
+    as_of: Optional[str] = None,
+    window_days: int = 365,
+) -> Optional[Dict[str, Any]]:
+    """單一顧客的 RFM 特徵（一次 aggregate 查詢）；as_of 之前沒有交易時回傳 None。"""
+    as_of_date = _parse_as_of(as_of)
+    window_start = as_of_date - timedelta(days=window_days)
+    in_window = Q(transdate__gte=window_start)
+
+    stats = (
+        Transaction.objects
+        .filter(customerid=customer_id, transdate__lte=as_of_date)
+        .aggregate(
+            last_date=Max("transdate"),
+            freq=Count("transactionid", filter=in_window),
+            money=Sum("totalprice", filter=in_window),
+        )
+    )
+    last_date = stats["last_date"]
+    if last_date is None:
+        return None
+    if isinstance(last_date, datetime):
+        last_date = last_date.date()
+
+    return _rfm_rows(
+        [int(customer_id)],
+        np.array([(as_of_date - last_date).days], dtype=np.int64),
+        np.array([int(stats["freq"] or 0)], dtype=np.int64),
+        np.array([float(stats["money"]) if stats["money"] is not None else 0.0], dtype=np.float64),
+    )[0]
+
+
 def _make_labels(data: List[Dict[str, Any]], churn_threshold_days: int) -> List[int]:
     """舊版標籤生成（基於當前 recency，有洩漏風險）"""
     return [1 if int(d.get("recency_days", 0)) > churn_threshold_days else 0 for d in data]
@@ -126,13 +185,18 @@ def _build_rfm_with_future_label(
         return []
 
     # 查詢「未來視窗」內有消費的客戶
-    future_qs = (
-        Transaction.objects
-        .filter(transdate__gt=as_of_date, transdate__lte=future_end)
-        .values_list("customerid", flat=True)
-        .distinct()
-    )
-    future_active: set = {int(cid) for cid in future_qs if cid is not None}
+    if transaction_store_enabled():
+        store = get_transaction_store()
+        future_rows = store.day_mask(start=as_of_date + timedelta(days=1), end=future_end)
+        future_active: set = set(store.customer_ids[store.count_by_customer(future_rows) > 0].tolist())
+    else:
+        future_qs = (
+            Transaction.objects
+            .filter(transdate__gt=as_of_date, transdate__lte=future_end)
+            .values_list("customerid", flat=True)
+            .distinct()
+        )
+        future_active = {int(cid) for cid in future_qs if cid is not None}
 
     # 為每位客戶加上標籤
     results: List[Dict[str, Any]] = []
@@ -243,9 +307,12 @@ def train_churn_model(
         except Exception as e:
             pass
 
-    # 儲存模型與中繼資料
-    model.save_model(_model_path())
+    # 儲存模型與中繼資料：先寫暫存檔再替換，避免其他 process 讀到寫一半的模型
+    tmp_model_path = f"{_model_path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    model.save_model(tmp_model_path)
+    os.replace(tmp_model_path, _model_path())
     meta = {
+        "version": datetime.now().strftime("%Y%m%d%H%M%S"),
         "as_of": _parse_as_of(as_of).isoformat() if as_of else date.today().isoformat(),
         "window_days": window_days,
         "churn_threshold_days": churn_threshold_days,
@@ -258,8 +325,7 @@ def train_churn_model(
         **val_metrics,
     }
     try:
-        with open(_meta_path(), "w", encoding="utf-8") as f:
-            json.dump(meta, f, ensure_ascii=False)
+        _write_atomic_json(_meta_path(), meta)
     except Exception:
         pass
 
@@ -294,28 +360,13 @@ def _risk_from_rfm(row: Dict[str, Any]) -> float:
     return max(0.0, min(1.0, score))
 
 
-def predict_churn(
-    as_of: Optional[str] = None,
-    window_days: int = 365,
-) -> List[Dict[str, Any]]:
-    rfm = _build_rfm(as_of=as_of, window_days=window_days)
-
-    model_path = _model_path()
-    meta_path = _meta_path()
-    use_model = _CATBOOST_AVAILABLE and os.path.exists(model_path)
+def _score_rows(rfm: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """替 RFM 特徵加上流失機率與風險等級（有模型用 CatBoost，否則用啟發式）"""
+    loaded = get_churn_model()
 
-    if use_model:
-        model = CatBoostClassifier()
-        model.load_model(model_path)
-        # 預設使用 RFM 分數
-        features = ["rScore", "fScore", "mScore"]
-        try:
-            if os.path.exists(meta_path):
-                with open(meta_path, "r", encoding="utf-8") as f:
-                    meta = json.load(f)
-                    features = meta.get("features", features)
-        except Exception:
-            pass
+    if loaded is not None and rfm:
+        model = loaded["model"]
+        features = loaded["features"]
 
         X = [[float(d.get(k, 0)) for k in features] for d in rfm]
         proba = model.predict_proba(X)
@@ -332,7 +383,6 @@ def predict_churn(
         for row, prob in zip(rfm, y_prob):
             prob = max(0.0, min(1.0, float(prob)))
             results.append({**row, "probability": prob, "risk_level": _risk_level(prob)})
-        results.sort(key=lambda x: x["probability"], reverse=True)
         return results
 
     # 無模型：退化為啟發式
@@ -340,6 +390,15 @@ def predict_churn(
     for row in rfm:
         p = _risk_from_rfm(row)
         results.append({**row, "probability": p, "risk_level": _risk_level(p)})
+    return results
+
+
+def predict_churn(
+    as_of: Optional[str] = None,
+    window_days: int = 365,
+) -> List[Dict[str, Any]]:
+    rfm = _build_rfm(as_of=as_of, window_days=window_days)
+    results = _score_rows(rfm)
     results.sort(key=lambda x: x["probability"], reverse=True)
     return results
 
@@ -349,9 +408,8 @@ def predict_churn_for_customer(
     as_of: Optional[str] = None,
     window_days: int = 365,
 ) -> Dict[str, Any]:
-    res = predict_churn(as_of=as_of, window_days=window_days)
-    for r in res:
-        if int(r.get("customerid")) == int(customer_id):
-            return r
-    raise ValueError(f"customer_id={customer_id} 無交易紀錄或不在視窗內")
-
+    """單一顧客的流失預測：只查這位顧客的交易，用快取的模型評分。"""
+    row = _build_rfm_for_customer(customer_id, as_of=as_of, window_days=window_days)
+    if row is None:
+        raise ValueError(f"customer_id={customer_id} 無交易紀錄或不在視窗內")
+    return _score_rows([row])[0]
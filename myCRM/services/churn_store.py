@@ -0,0 +1,165 @@
+# myCRM/services/churn_store.py
+"""
+預先計算的顧客流失分數：
+- refresh_churn_store() 對每個 window_days 執行一次 predict_churn()，結果存成 columnar 快照
+  （由 `python manage.py score_churn` 排程執行）
+- get_churn_scores() 讀取快照回傳與 predict_churn() 相同格式的結果，不會重新評分；
+  只有 rescore=True 或指定了與快照不同的 as_of 時才即時計算
+- 快照的 as_of 早於今天時照常回傳舊快照，同時排入背景重新評分作業（CHURN_SCORING_JOB）
+- 只有 store_windows() 的視窗會存成快照，其他視窗一律即時計算
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .churn_service import _parse_as_of, churn_model_info, predict_churn
+from .columnar_store import read_snapshot, write_snapshot
+from .data_version import bump_data_version
+from .feature_store import refresh_customer_features
+from .job_runner import submit_job
+
+logger = logging.getLogger(__name__)
+
+# 背景流失分數重新評分作業的 kind
+CHURN_SCORING_JOB = "churn_scoring"
+
+# 預設要預先計算的視窗天數：/churn/ 與 AI 建議用 365，分群摘要用 30（月）/ 90（季）
+DEFAULT_STORE_WINDOWS = (365, 90, 30)
+# API 接受的 window_days 範圍
+MIN_WINDOW_DAYS, MAX_WINDOW_DAYS = 1, 3650
+
+_INT_COLUMNS = ("customerid", "recency_days", "frequency", "rScore", "fScore", "mScore", "categoryID")
+_FLOAT_COLUMNS = ("monetary", "probability")
+
+
+def _store_name(window_days: int) -> str:
+    return f"churn_scores_w{int(window_days)}"
+
+
+def store_windows() -> List[int]:
+    return [int(w) for w in getattr(settings, "CRM_CHURN_STORE_WINDOWS", DEFAULT_STORE_WINDOWS)]
+
+
+def score_and_store(window_days: int = 365, as_of: Optional[str] = None) -> Dict[str, Any]:
+    """對所有顧客評分並寫入快照，回傳快照的 meta。"""
+    start = time.perf_counter()
+    rows = predict_churn(as_of=as_of, window_days=window_days)
+
+    columns = {
+        name: np.array([int(r[name]) for r in rows], dtype=np.int64) for name in _INT_COLUMNS
+    }
+    columns.update({
+        name: np.array([float(r[name]) for r in rows], dtype=np.float64) for name in _FLOAT_COLUMNS
+    })
+
+    model = churn_model_info()
+    meta = {
+        "as_of": _parse_as_of(as_of).isoformat(),
+        "window_days": int(window_days),
+        "source": model["source"],
+        "model_version": model["version"],
+        "generated_at": timezone.now().isoformat(),
+        "scoring_seconds": round(time.perf_counter() - start, 3),
+    }
+    version = write_snapshot(_store_name(window_days), columns, meta)
+    return {**meta, "version": version, "rows": len(rows)}
+
+
+def refresh_churn_store(
+    windows: Optional[Iterable[int]] = None,
+    as_of: Optional[str] = None,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> Dict[str, Any]:
+    """重新計算所有視窗的流失分數（可直接交給 job_runner.submit_job 執行）。"""
+    windows = list(windows or store_windows())
+    # 先重建特徵快照，各視窗評分直接讀取，不必每個視窗各查一次交易
+    refresh_customer_features(_parse_as_of(as_of))
+    results = {}
+    for i, window_days in enumerate(windows, start=1):
+        results[str(window_days)] = score_and_store(window_days=window_days, as_of=as_of)
+        if progress:
+            progress(i, len(windows))
+    bump_data_version("churn_scores")
+    return {"windows": results}
+
+
+def load_churn_snapshot(window_days: int = 365, as_of: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    取得流失分數快照 {"version", "meta", "columns"}（columns 為唯讀 NumPy 陣列，依流失機率由高到低）。
+    沒有快照，或指定的 as_of 與快照不同時回傳 None。
+    """
+    snapshot = read_snapshot(_store_name(window_days))
+    if snapshot is None:
+        return None
+    if as_of and _parse_as_of(as_of).isoformat() != snapshot["meta"].get("as_of"):
+        return None
+    return snapshot
+
+
+def _risk_levels(probability: np.ndarray) -> np.ndarray:
+    # 與 churn_service._risk_level 相同的門檻
+    return np.where(probability >= 0.66, "high", np.where(probability >= 0.33, "medium", "low"))
+
+
+def rows_from_snapshot(snapshot: Dict[str, Any], mask: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """把快照（或其中 mask 選到的部分）轉回 predict_churn() 的 dict 格式。"""
+    cols = snapshot["columns"]
+    names = _INT_COLUMNS + _FLOAT_COLUMNS
+    values = {name: (cols[name][mask] if mask is not None else cols[name]).tolist() for name in names}
+    probability = np.asarray(cols["probability"] if mask is None else cols["probability"][mask])
+    values["risk_level"] = _risk_levels(probability).tolist()
+
+    keys = list(names) + ["risk_level"]
+    return [dict(zip(keys, row)) for row in zip(*(values[k] for k in keys))]
+
+
+def schedule_churn_refresh() -> Optional[str]:
+    """排入背景重新評分（同時間只會有一個），回傳 job id；排入失敗時回傳 None。"""
+    try:
+        job, _created = submit_job(CHURN_SCORING_JOB, refresh_churn_store)
+    except Exception:
+        logger.exception("Failed to schedule churn scoring job")
+        return None
+    return job["id"]
+
+
+def get_churn_scores(
+    as_of: Optional[str] = None,
+    window_days: int = 365,
+    rescore: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    與 predict_churn() 相同格式的流失預測結果，優先讀取預先計算的快照。
+    - rescore=True 或視窗不在 store_windows()：即時重新評分（不寫入快照）
+    - 指定了與快照不同的 as_of（回溯分析）：即時計算
+    - 尚未有快照：先計算一次並寫入
+    - 快照不是今天算的：先回傳舊快照，並在背景重新評分
+    """
+    if rescore or int(window_days) not in store_windows():
+        return predict_churn(as_of=as_of, window_days=window_days)
+
+    snapshot = load_churn_snapshot(window_days=window_days, as_of=as_of)
+    if snapshot is None:
+        if as_of and _parse_as_of(as_of) != _parse_as_of(None):
+            return predict_churn(as_of=as_of, window_days=window_days)
+        score_and_store(window_days=window_days)
+        snapshot = load_churn_snapshot(window_days=window_days)
+        if snapshot is None:
+            # 快照剛寫入卻讀不到（例如版本目錄被其他 worker 清掉）：直接即時計算
+            return predict_churn(window_days=window_days)
+    elif not as_of and snapshot["meta"].get("as_of") != _parse_as_of(None).isoformat():
+        schedule_churn_refresh()
+    return rows_from_snapshot(snapshot)
+
+
+def churn_store_info(window_days: int = 365) -> Optional[Dict[str, Any]]:
+    if int(window_days) not in store_windows():
+        return None
+    snapshot = read_snapshot(_store_name(window_days))
+    return dict(snapshot["meta"]) if snapshot else None
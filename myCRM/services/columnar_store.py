@@ -0,0 +1,126 @@
+# myCRM/services/columnar_store.py
+"""
+以 .npy 欄位檔保存的唯讀快照（CRM_DATA_DIR/<name>/）：
+- write_snapshot() 把每個欄位寫成一個 .npy 到新的版本目錄，最後才替換 CURRENT 指標，
+  讀取端不會看到寫到一半的資料
+- read_snapshot() 以 mmap 唯讀方式開啟，多個 worker process 共用同一份 page cache；
+  CURRENT 改變時自動換成新版本
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+from django.conf import settings
+
+# 每個快照保留的舊版本數（讀取端可能還開著舊檔）
+_KEEP_VERSIONS = 2
+
+_cache: Dict[str, Dict[str, Any]] = {}
+_cache_lock = threading.Lock()
+
+
+def _store_dir(name: str) -> str:
+    path = os.path.join(str(settings.CRM_DATA_DIR), name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _current_path(name: str) -> str:
+    return os.path.join(_store_dir(name), "CURRENT")
+
+
+def _read_current(name: str) -> Optional[str]:
+    try:
+        with open(_current_path(name), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_snapshot(name: str, columns: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None) -> str:
+    """寫入新版本快照，回傳版本字串。所有欄位長度必須相同，且不可為 object dtype。"""
+    lengths = {len(col) for col in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"{name} 欄位長度不一致：{lengths}")
+
+    version = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+    base = _store_dir(name)
+    tmp_dir = os.path.join(base, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+    try:
+        for col_name, values in columns.items():
+            values = np.ascontiguousarray(values)
+            if values.dtype == object:
+                raise ValueError(f"{name}.{col_name} 不支援 object dtype")
+            np.save(os.path.join(tmp_dir, f"{col_name}.npy"), values, allow_pickle=False)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                **(meta or {}),
+                "version": version,
+                "rows": lengths.pop() if lengths else 0,
+                "columns": list(columns.keys()),
+            }, f, ensure_ascii=False, default=str)
+        os.replace(tmp_dir, os.path.join(base, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    pointer_tmp = f"{_current_path(name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, _current_path(name))
+
+    _prune_versions(name, version)
+    return version
+
+
+def _prune_versions(name: str, current: str) -> None:
+    base = _store_dir(name)
+    versions = sorted(
+        d for d in os.listdir(base)
+        if d != current and not d.startswith(".") and os.path.isdir(os.path.join(base, d))
+    )
+    for old in versions[:max(0, len(versions) - (_KEEP_VERSIONS - 1))]:
+        # Linux 上已 mmap 的檔案被刪除後仍可繼續讀取
+        shutil.rmtree(os.path.join(base, old), ignore_errors=True)
+
+
+def read_snapshot(name: str) -> Optional[Dict[str, Any]]:
+    """
+    讀取目前版本：{"version", "meta", "columns": {欄位: 唯讀 memmap 陣列}}。
+    尚未寫入過時回傳 None。
+    """
+    version = _read_current(name)
+    if version is None:
+        return None
+
+    cached = _cache.get(name)
+    if cached is not None and cached["version"] == version:
+        return cached
+
+    with _cache_lock:
+        cached = _cache.get(name)
+        if cached is not None and cached["version"] == version:
+            return cached
+
+        version_dir = os.path.join(_store_dir(name), version)
+        try:
+            with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            columns = {
+                col: np.load(os.path.join(version_dir, f"{col}.npy"), mmap_mode="r", allow_pickle=False)
+                for col in meta.get("columns", [])
+            }
+        except (OSError, ValueError):
+            return cached
+
+        snapshot = {"version": version, "meta": meta, "columns": columns}
+        _cache[name] = snapshot
+        return snapshot
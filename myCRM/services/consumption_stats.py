@@ -0,0 +1,139 @@
+# myCRM/services/consumption_stats.py
+"""
+客群消費狀態統計：
+- 一條 SQL 先把 transaction 依顧客彙總，再 join customer 依 categoryID 分組，
+  一次算出所有客群的顧客數、有購買顧客數、近30天活躍數、營收、客單價、最大訂單、交易筆數
+- 結果以「日期 + 資料版本」快取，RFM 重算 / 新交易進來時自動失效
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from myCRM.models import Customer, Transaction
+
+from .data_version import get_data_version
+from .sql_utils import quote_column
+
+_KEY_PREFIX = "crm:consumption_stats"
+
+RECENT_ACTIVE_DAYS = 30
+
+
+def _grouped_sql() -> str:
+    qn = connection.ops.quote_name
+    c_category = quote_column(Customer, "categoryid")
+    c_customer = quote_column(Customer, "customerid")
+    c_last_buy = quote_column(Customer, "customerlastdaybuy")
+    t_customer = quote_column(Transaction, "customerid")
+    t_id = quote_column(Transaction, "transactionid")
+    t_price = quote_column(Transaction, "totalprice")
+    return f"""
+        SELECT c.{c_category},
+               COUNT(*),
+               SUM(CASE WHEN t.txn_count > 0 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN c.{c_last_buy} >= %s THEN 1 ELSE 0 END),
+               SUM(t.revenue),
+               SUM(t.priced_count),
+               MAX(t.max_order),
+               SUM(t.txn_count)
+        FROM {qn(Customer._meta.db_table)} c
+        LEFT JOIN (
+            SELECT {t_customer} AS customer_id,
+                   COUNT({t_id}) AS txn_count,
+                   COUNT({t_price}) AS priced_count,
+                   SUM({t_price}) AS revenue,
+                   MAX({t_price}) AS max_order
+            FROM {qn(Transaction._meta.db_table)}
+            GROUP BY {t_customer}
+        ) t ON t.customer_id = c.{c_customer}
+        GROUP BY c.{c_category}
+    """
+
+
+def _category_key(value) -> Optional[int]:
+    # customer.categoryID 是字串欄位
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _empty_totals() -> Dict[str, float]:
+    return {
+        "total_customers": 0, "customers_with_purchases": 0, "recent_active_customers": 0,
+        "revenue": 0.0, "priced_count": 0, "max_order": 0.0, "transactions": 0,
+    }
+
+
+def _finalize(totals: Dict[str, float]) -> Dict[str, Any]:
+    """轉成 _get_consumption_statistics() 原本的回傳格式"""
+    total = totals["total_customers"]
+    return {
+        "total_customers": total,
+        "customers_with_purchases": totals["customers_with_purchases"],
+        "recent_active_customers": totals["recent_active_customers"],
+        "total_revenue": round(totals["revenue"], 2),
+        "average_order_value": round(totals["revenue"] / totals["priced_count"], 2) if totals["priced_count"] else 0,
+        "max_order_value": round(totals["max_order"], 2),
+        "total_transactions": totals["transactions"],
+        "purchase_conversion_rate": round((totals["customers_with_purchases"] / total) * 100, 2) if total > 0 else 0,
+        "recent_activity_rate": round((totals["recent_active_customers"] / total) * 100, 2) if total > 0 else 0,
+    }
+
+
+def compute_consumption_statistics(today: Optional[date] = None) -> Dict[Optional[int], Dict[str, Any]]:
+    """
+    不經快取直接查詢：{categoryID: 統計, ..., None: 全部顧客}。
+    沒有對應顧客資料的交易不計入。
+    """
+    today = today or timezone.now().date()
+    with connection.cursor() as cursor:
+        cursor.execute(_grouped_sql(), [today - timedelta(days=RECENT_ACTIVE_DAYS)])
+        rows = cursor.fetchall()
+
+    grouped: Dict[Optional[int], Dict[str, float]] = {}
+    overall = _empty_totals()
+    for category, customers, purchasers, recent, revenue, priced, max_order, txns in rows:
+        totals = grouped.setdefault(_category_key(category), _empty_totals())
+        values = {
+            "total_customers": int(customers or 0),
+            "customers_with_purchases": int(purchasers or 0),
+            "recent_active_customers": int(recent or 0),
+            "revenue": float(revenue or 0),
+            "priced_count": int(priced or 0),
+            "transactions": int(txns or 0),
+        }
+        for target in (totals, overall):
+            for name, value in values.items():
+                target[name] += value
+            target["max_order"] = max(target["max_order"], float(max_order or 0))
+
+    # 無法辨識的 categoryID 只計入全體
+    grouped.pop(None, None)
+    stats = {category: _finalize(totals) for category, totals in grouped.items()}
+    stats[None] = _finalize(overall)
+    return stats
+
+
+def get_consumption_statistics_by_category() -> Dict[Optional[int], Dict[str, Any]]:
+    """與 compute_consumption_statistics() 相同，但以日期 + 資料版本快取。"""
+    today = timezone.now().date()
+    key = f"{_KEY_PREFIX}:{today.isoformat()}:{get_data_version()}"
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_consumption_statistics(today)
+        cache.set(key, stats, int(getattr(settings, "CRM_CONSUMPTION_STATS_TTL", 3600)))
+    return stats
+
+
+def get_consumption_statistics(category_id: Optional[int] = None) -> Dict[str, Any]:
+    """單一客群（category_id=None 為全體顧客）的消費狀態統計"""
+    stats = get_consumption_statistics_by_category()
+    key = int(category_id) if category_id else None
+    return dict(stats.get(key) or _finalize(_empty_totals()))
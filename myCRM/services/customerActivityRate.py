@@ -1,12 +1,20 @@
 # myCRM/services/customerActivityRate.py
 
-from datetime import date, timedelta
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
 from calendar import monthrange
-from django.db.models import Count, Q
+from django.conf import settings
+from django.db.models import Count, F
 from django.db.models.functions import TruncMonth, TruncWeek, TruncQuarter
 
 from myCRM.models import Customer   # 如果 app 名稱不是 myCRM，記得改這行
 
+from .activity_engine import get_activity_index
+
+ACTIVITY_PERIODS = {"quarter", "month", "week"}
+# "transactions"：期間內有任何交易（activity_engine）；"last_buy"：舊算法，看 customerLastDayBuy 落在哪一期
+ACTIVITY_ENGINES = {"transactions", "last_buy"}
+
 
 # ========== 顧客成長率服務（折線圖） ==========
 
@@ -69,20 +77,27 @@ def _collect_monthly_counts():
     return counts
 
 
-def get_customer_activity(period: str = "quarter", points: int = 4):
+def get_customer_activity(period: str = "quarter", points: int = 4, as_of=None, engine=None):
     """
-    計算「顧客活躍度」數據，支援季度和周度分析。
+    計算「顧客活躍度」數據，支援季度、月度和周度分析。
     
     period:
         "quarter" -> 以季度為單位分析顧客活躍度
+        "month"   -> 以月為單位分析顧客活躍度
         "week"    -> 以周為單位分析顧客活躍度
     
     points:
-        要回傳幾個時間點（最近 N 個季度 / 周）
+        要回傳幾個時間點（最近 N 個季度 / 月 / 周）
+
+    as_of:
+        基準日（date 或 "YYYY-MM-DD"），預設今天；回補歷史資料時使用
+
+    engine:
+        "transactions"（預設，見 CRM_ACTIVITY_ENGINE）或 "last_buy"
     
     回傳格式：
     {
-        "period": "quarter" | "week",
+        "period": "quarter" | "month" | "week",
         "labels": [...],           # X 軸標籤
         "activity_rates": [...],   # 顧客活躍度（% 數值）
         "active_customers": [...], # 活躍顧客數
@@ -90,71 +105,181 @@ def get_customer_activity(period: str = "quarter", points: int = 4):
     }
     
     活躍度定義：
-        - 季度：該季內有進行任何活動的顧客比例
-        - 周：該周內有進行任何活動的顧客比例
+        - 該期內有任何交易、且加入日不晚於期末的顧客 / 期末的總顧客數
+        - "last_buy" 只看最近購買日，顧客之後再購買時過去期間的人數會變少，僅供比對舊數字
     """
-    # 1. 參數整理
     period = (period or "quarter").lower()
-    if period not in {"quarter", "week"}:
+    if period not in ACTIVITY_PERIODS:
         period = "quarter"
-    
-    points = max(1, int(points or 4))
-    
-    # 2. 取得時間範圍
-    today = date.today()
-    time_periods = _get_time_periods(period, points, today)
-    
-    if not time_periods:
-        return {
-            "period": period,
-            "labels": [],
-            "activity_rates": [],
-            "active_customers": [],
-            "total_customers": [],
-        }
-    
-    # 3. 計算每個時間段的顧客活躍度
-    labels = []
-    activity_rates = []
-    active_customers = []
-    total_customers = []
-    
-    for period_info in time_periods:
-        start_date = period_info['start']
-        end_date = period_info['end']
-        label = period_info['label']
-        
-        # 計算該期間內的總顧客數（截至期間結束）
-        total_count = Customer.objects.filter(
-            customerjoinday__lte=end_date
-        ).count()
-        
-        # 計算該期間內活躍的顧客數
-        # 使用 customerlastdaybuy 欄位來判斷活躍度
-        active_count = Customer.objects.filter(
-            customerjoinday__lte=end_date,
-            customerlastdaybuy__gte=start_date,
-            customerlastdaybuy__lte=end_date
-        ).count()
-        
-        # 計算活躍率
-        if total_count > 0:
-            activity_rate = (active_count / total_count) * 100.0
-        else:
-            activity_rate = 0.0
-        
-        labels.append(label)
-        activity_rates.append(round(activity_rate, 2))
-        active_customers.append(active_count)
-        total_customers.append(total_count)
-    
+    return get_customer_activity_series({period: points}, as_of=as_of, engine=engine)[period]
+
+
+def _as_date(value) -> date:
+    if hasattr(value, "date"):
+        return value.date()
+    return value
+
+
+def _parse_activity_as_of(as_of) -> date:
+    if not as_of:
+        return date.today()
+    if isinstance(as_of, str):
+        return datetime.strptime(as_of, "%Y-%m-%d").date()
+    return _as_date(as_of)
+
+
+def _join_histogram(as_of: date):
+    """各加入日的顧客數（加入日 <= as_of），依日期分組"""
     return {
-        "period": period,
-        "labels": labels,
-        "activity_rates": activity_rates,
-        "active_customers": active_customers,
-        "total_customers": total_customers,
+        _as_date(row["customerjoinday"]): row["count"]
+        for row in (
+            Customer.objects
+            .filter(customerjoinday__lte=as_of)
+            .values("customerjoinday")
+            .annotate(count=Count("customerid"))
+            .order_by()
+        )
+    }
+
+
+def _activity_histograms(first_start: date, as_of: date):
+    """
+    "last_buy" 算法所有期間共用的三個分組查詢（依日期分組，筆數是不同日期的數量而不是顧客數）：
+      - 各加入日的顧客數（加入日 <= as_of）
+      - 各最近購買日的顧客數（最近購買日在 [first_start, as_of]、加入日 <= as_of）
+      - 最近購買日早於加入日的少數異常顧客，分桶時要確認加入日沒有晚於該期
+    """
+    joined = _join_histogram(as_of)
+    active_qs = Customer.objects.filter(
+        customerlastdaybuy__gte=first_start,
+        customerlastdaybuy__lte=as_of,
+        customerjoinday__lte=as_of,
+    )
+    last_buy = {
+        _as_date(row["customerlastdaybuy"]): row["count"]
+        for row in active_qs.values("customerlastdaybuy").annotate(count=Count("customerid")).order_by()
     }
+    joined_later = [
+        (_as_date(last_buy_day), _as_date(join_day))
+        for last_buy_day, join_day in active_qs
+        .filter(customerjoinday__gt=F("customerlastdaybuy"))
+        .values_list("customerlastdaybuy", "customerjoinday")
+    ]
+    return joined, last_buy, joined_later
+
+
+def _bucket_activity_counts(time_periods, histograms):
+    """
+    把日期分組的數量分到各期間：第一期之前加入的顧客數 + 逐期累加 = 每期期末的總顧客數；
+    最近購買日落在該期（且加入日不晚於期末）= 該期活躍顧客數。
+    回傳 (total_customers, active_customers)，順序同 time_periods
+    """
+    joined, last_buy, joined_later = histograms
+    starts = [p["start"] for p in time_periods]
+    ends = [p["end"] for p in time_periods]
+    bucket_of = _bucketer(starts, ends)
+
+    active_customers = [0] * len(starts)
+    for day, count in last_buy.items():
+        i = bucket_of(day)
+        if i >= 0:
+            active_customers[i] += count
+    for last_buy_day, join_day in joined_later:
+        i = bucket_of(last_buy_day)
+        if i >= 0 and join_day > ends[i]:
+            active_customers[i] -= 1
+
+    return _bucket_total_customers(time_periods, joined), active_customers
+
+
+def _bucketer(starts, ends):
+    def bucket_of(day: date) -> int:
+        i = bisect_right(starts, day) - 1
+        return i if i >= 0 and day <= ends[i] else -1
+    return bucket_of
+
+
+def _bucket_total_customers(time_periods, joined):
+    """各期期末的總顧客數：第一期之前加入的顧客數 + 逐期累加"""
+    starts = [p["start"] for p in time_periods]
+    bucket_of = _bucketer(starts, [p["end"] for p in time_periods])
+
+    base_total = 0
+    new_counts = [0] * len(starts)
+    for day, count in joined.items():
+        if day < starts[0]:
+            base_total += count
+        else:
+            i = bucket_of(day)
+            if i >= 0:
+                new_counts[i] += count
+
+    total_customers = []
+    cumulative = base_total
+    for count in new_counts:
+        cumulative += count
+        total_customers.append(cumulative)
+    return total_customers
+
+
+def _activity_engine(engine) -> str:
+    engine = (engine or getattr(settings, "CRM_ACTIVITY_ENGINE", "transactions") or "").lower()
+    return engine if engine in ACTIVITY_ENGINES else "transactions"
+
+
+def get_customer_activity_series(series, as_of=None, engine=None):
+    """
+    一次計算多組活躍度資料，例如 {"quarter": 4, "week": 52}；
+    總顧客數共用一個依加入日分組的查詢，活躍顧客數由 activity_engine 的 bitset 算出
+    （engine="last_buy" 時改用 _activity_histograms），組數、點數再多查詢次數也不變。
+    as_of 為基準日（預設今天），回傳 {period: get_customer_activity 的格式}
+    """
+    as_of = _parse_activity_as_of(as_of)
+    engine = _activity_engine(engine)
+
+    # 1. 參數整理 + 2. 取得時間範圍
+    periods_by_series = {}
+    for period, points in series.items():
+        period = (period or "quarter").lower()
+        if period not in ACTIVITY_PERIODS:
+            period = "quarter"
+        points = max(1, int(points or 4))
+        periods_by_series[period] = _get_time_periods(period, points, as_of)
+
+    # 3. 每個時間段的總顧客數（截至期間結束）與活躍顧客數（期間內有交易）
+    if engine == "last_buy":
+        first_start = min(time_periods[0]["start"] for time_periods in periods_by_series.values())
+        histograms = _activity_histograms(first_start, as_of)
+    else:
+        joined = _join_histogram(as_of)
+        index = get_activity_index()
+
+    results = {}
+    for period, time_periods in periods_by_series.items():
+        if engine == "last_buy":
+            total_customers, active_customers = _bucket_activity_counts(time_periods, histograms)
+        else:
+            total_customers = _bucket_total_customers(time_periods, joined)
+            active_customers = [index.count_active(p["start"], p["end"], joined_by=p["end"]) for p in time_periods]
+
+        activity_rates = []
+        for total_count, active_count in zip(total_customers, active_customers):
+            # 計算活躍率
+            if total_count > 0:
+                activity_rate = (active_count / total_count) * 100.0
+            else:
+                activity_rate = 0.0
+            activity_rates.append(round(activity_rate, 2))
+
+        results[period] = {
+            "period": period,
+            "labels": [p["label"] for p in time_periods],
+            "activity_rates": activity_rates,
+            "active_customers": active_customers,
+            "total_customers": total_customers,
+        }
+
+    return results
 
 
 def _get_time_periods(period: str, points: int, end_date: date):
@@ -178,6 +303,22 @@ def _get_time_periods(period: str, points: int, end_date: date):
             })
         
         periods.reverse()  # 由舊到新排序
+
+    elif period == "month":
+        # 月分析
+        current_month_start = end_date.replace(day=1)
+
+        for i in range(points):
+            month_start = _shift_month(current_month_start, -i)
+            month_end = _shift_month(month_start, 1) - timedelta(days=1)
+
+            periods.append({
+                'start': month_start,
+                'end': min(month_end, end_date) if i == 0 else month_end,
+                'label': month_start.strftime("%Y-%m")
+            })
+
+        periods.reverse()  # 由舊到新排序
         
     elif period == "week":
         # 周分析
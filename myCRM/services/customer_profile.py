@@ -0,0 +1,154 @@
+# myCRM/services/customer_profile.py
+"""
+顧客詳細頁資料：
+- 查詢次數固定（顧客 + 會員等級、消費總額與筆數、一頁交易、該頁明細、商品名稱、類別統計、類別名稱），
+  與顧客的交易 / 明細筆數無關
+- 產品類別統計讀取預先計算的顧客 × 商品類別偏好表（category_affinity）；
+  顧客有偏好表水位線之後的新交易時，改由 SQL 即時依商品類別彙總
+- 消費紀錄分頁，每頁 CRM_PROFILE_TRANSACTIONS_PER_PAGE 筆
+"""
+from __future__ import annotations
+
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast
+
+from myCRM.models import Customer, CustomerCategory, Product, Transaction, TransactionDetail
+
+from .category_affinity import affinity_is_current, get_customer_category_stats, is_essential
+
+
+def _page_size() -> int:
+    return max(1, int(getattr(settings, "CRM_PROFILE_TRANSACTIONS_PER_PAGE", 50)))
+
+
+def classify_category_needs(category_stats: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """依購買頻率與金額佔比分成 (剛需品, 彈性需求品)，各自依購買次數由多到少排序"""
+    essential_items: List[Dict[str, Any]] = []
+    flexible_items: List[Dict[str, Any]] = []
+
+    total_purchases = sum(cat["count"] for cat in category_stats)
+    total_amount_spent = sum(cat["total_amount"] for cat in category_stats)
+    for stats in category_stats:
+        purchase_frequency = stats["count"] / total_purchases if total_purchases > 0 else 0
+        amount_ratio = stats["total_amount"] / total_amount_spent if total_amount_spent > 0 else 0
+        item = {
+            "name": stats["name"],
+            "count": stats["count"],
+            "total_amount": stats["total_amount"],
+            "frequency": f"{purchase_frequency:.1%}",
+            "amount_ratio": f"{amount_ratio:.1%}",
+        }
+        target = essential_items if is_essential(stats["count"], purchase_frequency, amount_ratio) else flexible_items
+        target.append(item)
+
+    essential_items.sort(key=lambda x: x["count"], reverse=True)
+    flexible_items.sort(key=lambda x: x["count"], reverse=True)
+    return essential_items, flexible_items
+
+
+def _load_customer(customer_id: int) -> Optional[Dict[str, Any]]:
+    category_name = CustomerCategory.objects.filter(
+        categoryid=Cast(OuterRef("categoryid"), IntegerField())
+    ).values("customercategory")[:1]
+    return (
+        Customer.objects
+        .filter(customerid=customer_id)
+        .annotate(category_name=Subquery(category_name))
+        .values(
+            "customerid", "customername", "gender", "customerregion",
+            "customerjoinday", "categoryid", "category_name",
+        )
+        .first()
+    )
+
+
+def _page_items(transaction_ids: List[int]) -> Dict[int, List[str]]:
+    """該頁交易的商品名稱 {transactionID: [名稱, ...]}"""
+    if not transaction_ids:
+        return {}
+    details = list(
+        TransactionDetail.objects
+        .filter(transactionid__in=transaction_ids)
+        .values_list("transactionid", "productid")
+    )
+    product_ids = {pid for _, pid in details if pid is not None}
+    product_lookup = {
+        pid: (name or f"商品 {pid}")
+        for pid, name in Product.objects.filter(productid__in=product_ids).values_list("productid", "productname")
+    } if product_ids else {}
+
+    items: Dict[int, List[str]] = defaultdict(list)
+    for transaction_id, product_id in details:
+        if transaction_id is None:
+            continue
+        name = product_lookup.get(product_id)
+        if not name:
+            name = f"商品 {product_id}" if product_id else "未知商品"
+        items[transaction_id].append(name)
+    return items
+
+
+def load_customer_profile(customer_id: int, page: int = 1, order: str = "desc") -> Optional[Dict[str, Any]]:
+    """
+    顧客詳細頁的 member 資料（customer.html 使用的格式），找不到顧客時回傳 None。
+    消費紀錄只含第 page 頁，order 為 "desc"（近 → 遠）或 "asc"。
+    """
+    customer = _load_customer(customer_id)
+    if customer is None:
+        return None
+
+    transactions = Transaction.objects.filter(customerid=customer_id)
+    totals = transactions.aggregate(
+        total=Sum("totalprice"), count=Count("transactionid"), last_id=Max("transactionid")
+    )
+    transaction_count = totals["count"] or 0
+
+    page_size = _page_size()
+    total_pages = max(1, math.ceil(transaction_count / page_size))
+    page = min(max(1, int(page)), total_pages)
+    order = "asc" if order == "asc" else "desc"
+    ordering = ("transdate", "transactionid") if order == "asc" else ("-transdate", "-transactionid")
+
+    page_rows = list(
+        transactions.order_by(*ordering)
+        .values_list("transactionid", "transdate", "totalprice")[(page - 1) * page_size:page * page_size]
+    )
+    items = _page_items([tid for tid, _, _ in page_rows if tid is not None])
+    consumptions = [
+        {
+            "date": trans_date.strftime("%Y-%m-%d") if trans_date else "",
+            "amount": amount or 0,
+            "items": items.get(tid, []),
+        }
+        for tid, trans_date, amount in page_rows
+    ]
+
+    if not transaction_count:
+        category_stats = []
+    else:
+        category_stats = get_customer_category_stats(customer_id, live=not affinity_is_current(totals["last_id"]))
+    essential_items, flexible_items = classify_category_needs(category_stats)
+
+    join_day = customer["customerjoinday"]
+    return {
+        "customerID": customer["customerid"],
+        "customerName": customer["customername"] or "",
+        "gender": customer["gender"] or "",
+        "customerRegion": customer["customerregion"] or "",
+        "memberType": customer["category_name"] or "未分級",
+        "customerJoinDay": join_day.strftime("%Y-%m-%d") if join_day else "",
+        "totalSpending": totals["total"] or 0,
+        "consumptions": consumptions,
+        "categoryStats": category_stats,
+        "essential_items": essential_items,
+        "flexible_items": flexible_items,
+        "transactionCount": transaction_count,
+        "page": page,
+        "totalPages": total_pages,
+        "order": order,
+    }
@@ -0,0 +1,114 @@
+# myCRM/services/dashboard_cache.py
+"""
+首頁 KPI 快照快取：
+- 以「日期 + 資料版本」當 key，資料沒變就直接回傳快照
+- 版本變了（RFM 重算完成 / 有新交易）時先回傳上一份快照（stale-while-revalidate），
+  同時在背景重算；只有完全沒有快照時（第一次啟動）才會同步計算
+- RFM 重算完成送出 data_version_changed 後會在背景預先重算
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .basicRate import get_dashboard_kpis
+from .data_version import data_version_changed, get_data_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCLUDE_LABELS = ("其他客戶",)
+
+_KEY_PREFIX = "crm:dashboard"
+
+
+def _labels_key(exclude_labels) -> str:
+    return ",".join(sorted(exclude_labels or ()))
+
+
+def _snapshot_key(day: str, version: str, exclude_labels) -> str:
+    return f"{_KEY_PREFIX}:{day}:{version}:{_labels_key(exclude_labels)}"
+
+
+def _latest_key(exclude_labels) -> str:
+    return f"{_KEY_PREFIX}:latest:{_labels_key(exclude_labels)}"
+
+
+def _lock_key(exclude_labels) -> str:
+    return f"{_KEY_PREFIX}:refreshing:{_labels_key(exclude_labels)}"
+
+
+def refresh_dashboard_snapshot(exclude_labels=DEFAULT_EXCLUDE_LABELS):
+    """重新計算 KPI 並寫入快取，回傳新的快照。"""
+    day = date.today().isoformat()
+    # 先取版本再計算，計算期間若又有新資料，下一次讀取會再觸發重算
+    version = get_data_version()
+    kpis = get_dashboard_kpis(exclude_labels=list(exclude_labels or ()))
+    snapshot = {
+        "kpis": kpis,
+        "day": day,
+        "version": version,
+        "generated_at": timezone.now().isoformat(),
+    }
+    ttl = int(getattr(settings, "CRM_DASHBOARD_CACHE_TTL", 3600))
+    cache.set(_snapshot_key(day, version, exclude_labels), snapshot, ttl)
+    cache.set(_latest_key(exclude_labels), snapshot, None)
+    return snapshot
+
+
+def _refresh_in_background(exclude_labels) -> None:
+    try:
+        refresh_dashboard_snapshot(exclude_labels)
+    except Exception:
+        logger.exception("Dashboard snapshot refresh failed")
+    finally:
+        cache.delete(_lock_key(exclude_labels))
+        connection.close()
+
+
+def schedule_dashboard_refresh(exclude_labels=DEFAULT_EXCLUDE_LABELS) -> bool:
+    """在背景執行緒重算快照；已有重算在進行時不重複啟動。"""
+    if not cache.add(_lock_key(exclude_labels), True, 300):
+        return False
+    thread = threading.Thread(
+        target=_refresh_in_background,
+        args=(tuple(exclude_labels or ()),),
+        name="dashboard-refresh",
+        daemon=True,
+    )
+    thread.start()
+    return True
+
+
+def get_dashboard_snapshot(exclude_labels=DEFAULT_EXCLUDE_LABELS):
+    """
+    取得首頁 KPI 快照：
+    {"kpis": get_dashboard_kpis(...) 的結果, "day", "version", "generated_at", "stale": bool}
+    """
+    exclude_labels = tuple(exclude_labels or ())
+    day = date.today().isoformat()
+    version = get_data_version()
+
+    snapshot = cache.get(_snapshot_key(day, version, exclude_labels))
+    if snapshot is not None:
+        return {**snapshot, "stale": False}
+
+    latest = cache.get(_latest_key(exclude_labels))
+    if latest is not None:
+        schedule_dashboard_refresh(exclude_labels)
+        return {**latest, "stale": True}
+
+    # 冷啟動：沒有任何快照可用，只能同步計算
+    return {**refresh_dashboard_snapshot(exclude_labels), "stale": False}
+
+
+def _on_data_version_changed(sender, **kwargs):
+    schedule_dashboard_refresh()
+
+
+data_version_changed.connect(_on_data_version_changed, dispatch_uid="dashboard_snapshot_refresh")
@@ -0,0 +1,68 @@
+# myCRM/services/data_version.py
+"""
+分析資料版本（各種分析快取共用的失效依據）：
+- RFM 重算等批次更新完成後呼叫 bump_data_version()，寫入 CRM_DATA_DIR 下的版本檔，
+  所有 worker process 都讀得到
+- get_data_version() 再結合 transaction 表的最大 transactionID，有新交易進來時版本也會改變
+- 版本改變時會送出 data_version_changed signal，讓快取在背景預先重算
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.dispatch import Signal
+
+from myCRM.models import Transaction
+
+# sender=None, reason=str
+data_version_changed = Signal()
+
+_TXN_PROBE_KEY = "crm:data_version:max_transaction_id"
+
+
+def _stamp_path() -> str:
+    data_dir = str(settings.CRM_DATA_DIR)
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, "data_version")
+
+
+def _read_stamp() -> str:
+    try:
+        with open(_stamp_path(), "r", encoding="utf-8") as f:
+            return f.read().strip() or "0"
+    except OSError:
+        return "0"
+
+
+def max_transaction_id() -> int:
+    """transaction 表的最大 ID；每 CRM_DATA_VERSION_PROBE_SECONDS 秒才真的查一次資料庫。"""
+    max_id = cache.get(_TXN_PROBE_KEY)
+    if max_id is None:
+        max_id = Transaction.objects.aggregate(max_id=Max("transactionid"))["max_id"] or 0
+        cache.set(_TXN_PROBE_KEY, max_id, int(getattr(settings, "CRM_DATA_VERSION_PROBE_SECONDS", 30)))
+    return int(max_id)
+
+
+def get_data_version() -> str:
+    """目前的資料版本字串：「批次更新戳記:最大交易ID」。"""
+    return f"{_read_stamp()}:{max_transaction_id()}"
+
+
+def bump_data_version(reason: str = "") -> str:
+    """批次更新完成後呼叫：產生新的版本戳記並通知快取重算。"""
+    stamp = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    path = _stamp_path()
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(stamp)
+    os.replace(tmp_path, path)
+    # 交易 ID 也可能跟著變動，清掉探測快取讓下一次立即重查
+    cache.delete(_TXN_PROBE_KEY)
+    data_version_changed.send(sender=None, reason=reason)
+    return stamp
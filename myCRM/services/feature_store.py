@@ -0,0 +1,194 @@
+# myCRM/services/feature_store.py
+"""
+每位顧客的評分特徵快照（流失 / 下次購買模型共用）：
+- 以 columnar_store 寫成 .npy，各 gunicorn worker 以 mmap 唯讀開啟，page cache 裡只有一份
+- 寫入端完成後才替換 CURRENT，讀取端不會讀到寫到一半的檔案
+- 快照記錄 as_of 與當時的最大 transactionID；日期不同或有新交易時讀取端改走即時計算，
+  並在背景重建快照
+- customer_features：最近交易日、recency，以及 CRM_CHURN_STORE_WINDOWS 每個視窗的 F / M 原始值與 RFM 分數
+  （購買序列特徵 purchase_features 由 next_purchse 建立）
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from myCRM.models import Transaction
+
+from .columnar_store import read_snapshot, write_snapshot
+from .data_version import max_transaction_id
+from .rfm_count import classify_customers_array, rfm_scores_from_raw_array
+from .transaction_store import get_transaction_store, transaction_store_enabled
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_FEATURES = "customer_features"
+
+_LOCK_PREFIX = "crm:feature_store:refreshing"
+
+
+def _snapshot_name(name: str) -> str:
+    return f"features_{name}"
+
+
+def _feature_windows():
+    return sorted({int(w) for w in getattr(settings, "CRM_CHURN_STORE_WINDOWS", (365, 90, 30))})
+
+
+def write_feature_snapshot(
+    name: str,
+    as_of_date: date,
+    build: Callable[[], Tuple[Dict[str, np.ndarray], Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """
+    呼叫 build() 取得 (欄位, meta) 並寫成新版本快照，回傳 meta。
+    最大交易ID在計算前先取，計算期間有新交易時下一次讀取會判定為過期。
+    """
+    probed_max_id = max_transaction_id()
+    columns, meta = build()
+    meta = {
+        **meta,
+        "as_of": as_of_date.isoformat(),
+        "max_transaction_id": probed_max_id,
+        "generated_at": timezone.now().isoformat(),
+    }
+    version = write_snapshot(_snapshot_name(name), columns, meta)
+    return {**meta, "version": version}
+
+
+def load_feature_snapshot(name: str, as_of_date: date) -> Optional[Dict[str, Any]]:
+    """
+    取得與 as_of_date、目前交易資料一致的快照 {"version", "meta", "columns"}；
+    沒有快照或已過期時回傳 None。
+    """
+    snapshot = read_snapshot(_snapshot_name(name))
+    if snapshot is None:
+        return None
+    meta = snapshot["meta"]
+    if meta.get("as_of") != as_of_date.isoformat():
+        return None
+    if meta.get("max_transaction_id") != max_transaction_id():
+        return None
+    return snapshot
+
+
+def _refresh_in_background(name: str, refresh: Callable[[], Any]) -> None:
+    try:
+        refresh()
+    except Exception:
+        logger.exception("Feature snapshot %s refresh failed", name)
+    finally:
+        cache.delete(f"{_LOCK_PREFIX}:{name}")
+        connection.close()
+
+
+def schedule_feature_refresh(name: str, refresh: Callable[[], Any]) -> bool:
+    """在背景執行緒重建快照；同一份快照已在重建中時不重複啟動。"""
+    if not cache.add(f"{_LOCK_PREFIX}:{name}", True, 600):
+        return False
+    threading.Thread(
+        target=_refresh_in_background,
+        args=(name, refresh),
+        name=f"feature-refresh-{name}",
+        daemon=True,
+    ).start()
+    return True
+
+
+# ==================== RFM 原始值 ====================
+
+def rfm_raw_arrays(as_of_date: date, window_start: date) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    as_of_date 以前有交易的顧客（依顧客ID排序）：
+    (customer_ids, recency_days, window 內交易筆數, window 內消費金額)
+    """
+    if transaction_store_enabled():
+        store = get_transaction_store()
+        last_days = store.last_day_by_customer(store.day_mask(end=as_of_date))
+        in_window = store.day_mask(start=window_start, end=as_of_date)
+        keep = last_days > 0
+        return (
+            store.customer_ids[keep],
+            as_of_date.toordinal() - last_days[keep],
+            store.count_by_customer(in_window)[keep].astype(np.int64),
+            store.sum_by_customer(in_window)[keep].astype(np.float64),
+        )
+
+    last_dates = (
+        Transaction.objects
+        .filter(transdate__lte=as_of_date, customerid__isnull=False)
+        .values("customerid")
+        .annotate(last_date=Max("transdate"))
+    )
+    last_date_by_cust = {int(row["customerid"]): row["last_date"] for row in last_dates}
+
+    window_stats = (
+        Transaction.objects
+        .filter(transdate__gte=window_start, transdate__lte=as_of_date, customerid__isnull=False)
+        .values("customerid")
+        .annotate(freq=Count("transactionid"), money=Sum("totalprice"))
+    )
+    stats_by_cust = {int(row["customerid"]): row for row in window_stats}
+
+    cids = sorted(last_date_by_cust)
+    recency = np.array([(as_of_date - last_date_by_cust[cid]).days for cid in cids], dtype=np.int64)
+    freq = np.array([int((stats_by_cust.get(cid) or {}).get("freq") or 0) for cid in cids], dtype=np.int64)
+    money = np.array([float((stats_by_cust.get(cid) or {}).get("money") or 0.0) for cid in cids], dtype=np.float64)
+    return np.asarray(cids, dtype=np.int64), recency, freq, money
+
+
+def _build_customer_feature_columns(as_of_date: date) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    windows = _feature_windows()
+    columns: Dict[str, np.ndarray] = {}
+    for window_days in windows:
+        cids, recency, freq, money = rfm_raw_arrays(as_of_date, as_of_date - timedelta(days=window_days))
+        r, f, m = rfm_scores_from_raw_array(recency, freq, money)
+        columns.setdefault("customerid", cids)
+        columns.setdefault("recency_days", recency.astype(np.int32))
+        columns[f"frequency_w{window_days}"] = freq.astype(np.int32)
+        columns[f"monetary_w{window_days}"] = money
+        columns[f"rScore_w{window_days}"] = r.astype(np.int8)
+        columns[f"fScore_w{window_days}"] = f.astype(np.int8)
+        columns[f"mScore_w{window_days}"] = m.astype(np.int8)
+        columns[f"categoryID_w{window_days}"] = classify_customers_array(r, f, m).astype(np.int8)
+    return columns, {"windows": windows}
+
+
+def refresh_customer_features(as_of: Optional[date] = None) -> Dict[str, Any]:
+    """重建 customer_features 快照（as_of 預設今天），回傳 meta。"""
+    as_of_date = as_of or date.today()
+    return write_feature_snapshot(
+        CUSTOMER_FEATURES, as_of_date, lambda: _build_customer_feature_columns(as_of_date)
+    )
+
+
+def customer_rfm_features(as_of_date: date, window_days: int) -> Optional[Tuple[np.ndarray, ...]]:
+    """
+    從快照取得 rfm_raw_arrays() 格式的資料（唯讀 memmap）；
+    快照不可用時回傳 None，若是今天的資料則在背景重建。
+    """
+    snapshot = load_feature_snapshot(CUSTOMER_FEATURES, as_of_date)
+    if snapshot is None:
+        if as_of_date == date.today():
+            schedule_feature_refresh(CUSTOMER_FEATURES, refresh_customer_features)
+        return None
+
+    cols = snapshot["columns"]
+    freq_col = f"frequency_w{int(window_days)}"
+    if freq_col not in cols:
+        return None
+    return (
+        cols["customerid"],
+        cols["recency_days"].astype(np.int64),
+        cols[freq_col].astype(np.int64),
+        cols[f"monetary_w{int(window_days)}"],
+    )
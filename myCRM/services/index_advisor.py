@@ -0,0 +1,204 @@
+# myCRM/services/index_advisor.py
+"""
+索引建議（models 全是 managed = False，migration 不會替這些表建索引）：
+- RECOMMENDED_INDEXES：各分析服務常用過濾條件所需的索引
+- 以 introspection 讀取資料庫實際的索引，最左欄位涵蓋建議欄位即視為已存在
+- probe_queries() 列出各服務實際發出的代表性查詢，可取得 EXPLAIN 與執行時間
+- apply_indexes() / drop_indexes() 透過 schema_editor 建立 / 移除建議索引
+"""
+from __future__ import annotations
+
+import statistics
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db import connection, models
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from myCRM.models import ChatRecord, Customer, Transaction, TransactionDetail
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    model: type
+    fields: Tuple[str, ...]
+    name: str
+    reason: str
+
+    @property
+    def table(self) -> str:
+        return self.model._meta.db_table
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return tuple(self.model._meta.get_field(f).column for f in self.fields)
+
+    def as_index(self) -> models.Index:
+        return models.Index(fields=list(self.fields), name=self.name)
+
+
+RECOMMENDED_INDEXES: Tuple[IndexSpec, ...] = (
+    IndexSpec(Transaction, ("customerid", "transdate"), "idx_transaction_customer_date",
+              "顧客頁交易列表、單一顧客 RFM / 下次購買序列"),
+    IndexSpec(Transaction, ("transdate",), "idx_transaction_date",
+              "RFM 視窗統計、回購率 / 留存率、增量 RFM 的異動顧客"),
+    IndexSpec(Customer, ("categoryid",), "idx_customer_category",
+              "AI 建議 / 客群分析依 categoryID 取顧客"),
+    IndexSpec(Customer, ("customerjoinday",), "idx_customer_join_day",
+              "新顧客統計、活躍度、RFM 增量計算"),
+    IndexSpec(Customer, ("customerlastdaybuy",), "idx_customer_last_buy",
+              "活躍度區間、近30天活躍顧客"),
+    IndexSpec(ChatRecord, ("categoryID", "chatID"), "idx_chat_record_category",
+              "聊天時取同客群最近幾筆對話"),
+    IndexSpec(TransactionDetail, ("transactionid",), "idx_transaction_detail_txn",
+              "顧客頁依交易編號取明細（實際資料表沒有主鍵）"),
+)
+
+
+@dataclass
+class ProbeQuery:
+    label: str
+    index_name: str
+    queryset: models.QuerySet
+
+
+def existing_tables() -> set:
+    with connection.cursor() as cursor:
+        return set(connection.introspection.table_names(cursor))
+
+
+def existing_indexes(table: str) -> Dict[str, Tuple[str, ...]]:
+    """資料表上的索引 {名稱: 欄位}（含主鍵與 unique）"""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return {
+        name: tuple(info["columns"])
+        for name, info in constraints.items()
+        if (info.get("index") or info.get("primary_key") or info.get("unique")) and info.get("columns")
+    }
+
+
+def covering_index(spec: IndexSpec, indexes: Dict[str, Tuple[str, ...]]) -> Optional[str]:
+    """最左欄位與 spec 相同的既有索引名稱（大小寫不拘），沒有時回傳 None"""
+    wanted = tuple(c.lower() for c in spec.columns)
+    for name, columns in indexes.items():
+        if tuple(c.lower() for c in columns[:len(wanted)]) == wanted:
+            return name
+    return None
+
+
+def index_report() -> List[Dict[str, object]]:
+    """每個建議索引的狀態：table_missing / covered_by / missing"""
+    tables = existing_tables()
+    report = []
+    for spec in RECOMMENDED_INDEXES:
+        row = {"spec": spec, "table_missing": spec.table not in tables, "covered_by": None}
+        if not row["table_missing"]:
+            row["covered_by"] = covering_index(spec, existing_indexes(spec.table))
+        row["missing"] = not row["table_missing"] and row["covered_by"] is None
+        report.append(row)
+    return report
+
+
+def missing_indexes() -> List[IndexSpec]:
+    return [row["spec"] for row in index_report() if row["missing"]]
+
+
+def probe_queries() -> List[ProbeQuery]:
+    """
+    各服務實際發出的代表性查詢，參數取自目前資料
+    （最新一筆交易的日期與顧客），讓 EXPLAIN 反映真實的選擇性。
+    """
+    latest = Transaction.objects.filter(customerid__isnull=False).order_by("-transactionid").values(
+        "customerid", "transdate"
+    ).first() or {}
+    customer_id = latest.get("customerid") or 0
+    today = latest.get("transdate") or timezone.now().date()
+    transaction_ids = list(
+        Transaction.objects.filter(customerid=customer_id).values_list("transactionid", flat=True)[:50]
+    ) or [0]
+
+    return [
+        ProbeQuery(
+            "views.customer_page 單一顧客交易",
+            "idx_transaction_customer_date",
+            Transaction.objects.filter(customerid=customer_id).order_by("-transdate"),
+        ),
+        ProbeQuery(
+            "feature_store.rfm_raw_arrays 30 天視窗",
+            "idx_transaction_date",
+            Transaction.objects
+            .filter(transdate__gte=today - timedelta(days=30), transdate__lte=today, customerid__isnull=False)
+            .values("customerid")
+            .annotate(freq=Count("transactionid"), money=Sum("totalprice"), last_date=Max("transdate")),
+        ),
+        ProbeQuery(
+            "ai_suggestion_service 客群顧客",
+            "idx_customer_category",
+            Customer.objects.filter(categoryid__in=["1"]).values_list("customerid", "categoryid"),
+        ),
+        ProbeQuery(
+            "rfm_count 增量：新加入顧客",
+            "idx_customer_join_day",
+            Customer.objects
+            .filter(customerjoinday__gte=today - timedelta(days=1), customerjoinday__lt=today)
+            .values_list("customerid", flat=True),
+        ),
+        ProbeQuery(
+            "customerActivityRate 區間內有購買",
+            "idx_customer_last_buy",
+            Customer.objects
+            .filter(customerlastdaybuy__gte=today - timedelta(days=30), customerlastdaybuy__lte=today)
+            .values_list("customerid", flat=True),
+        ),
+        ProbeQuery(
+            "chat_views 最近對話",
+            "idx_chat_record_category",
+            ChatRecord.objects.filter(categoryID=1).order_by("-chatID")[:3],
+        ),
+        ProbeQuery(
+            "views.customer_page 交易明細",
+            "idx_transaction_detail_txn",
+            TransactionDetail.objects.filter(transactionid__in=transaction_ids).values_list(
+                "transactionid", "productid"
+            ),
+        ),
+    ]
+
+
+def explain(query: ProbeQuery) -> str:
+    return query.queryset.explain()
+
+
+def time_query(query: ProbeQuery, repeat: int = 5) -> float:
+    """重複執行 repeat 次，回傳中位數（毫秒）"""
+    samples = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        list(query.queryset.all())
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def apply_indexes(specs: Sequence[IndexSpec]) -> List[str]:
+    """建立索引，回傳建立的索引名稱"""
+    created = []
+    with connection.schema_editor() as editor:
+        for spec in specs:
+            editor.add_index(spec.model, spec.as_index())
+            created.append(spec.name)
+    return created
+
+
+def drop_indexes(specs: Sequence[IndexSpec]) -> List[str]:
+    """移除本工具建立的索引（依名稱比對），回傳移除的索引名稱"""
+    dropped = []
+    with connection.schema_editor() as editor:
+        for spec in specs:
+            if spec.name in existing_indexes(spec.table):
+                editor.remove_index(spec.model, spec.as_index())
+                dropped.append(spec.name)
+    return dropped
@@ -0,0 +1,359 @@
+# myCRM/services/job_runner.py
+"""
+背景作業執行器：
+- 用 ThreadPoolExecutor 在背景執行耗時工作（例如 RFM 重算），HTTP 請求只負責排入並回傳 job id
+- 作業狀態以 JSON 檔存在 CRM_DATA_DIR/jobs/，多個 worker process 都能查詢
+- 同一種作業（kind）同時間只會有一個在排隊或執行，重複送出會拿到同一個 job id
+- submit_job(..., run_lock="名稱") 的作業之間互斥：同一個 run_lock 同時間只有一個作業在執行，
+  其他的維持 queued 等它結束（例如 RFM 完整重算與增量重算）
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = {"queued", "running"}
+
+# 進度寫檔的最短間隔（秒），避免每一批都寫一次檔
+_PROGRESS_WRITE_INTERVAL = 0.5
+# lock 檔存在但讀不到對應作業時，仍視為被持有的秒數
+_LOCK_GRACE_SECONDS = 10
+# 等待 run_lock 時的輪詢間隔（秒）
+_WAIT_POLL_INTERVAL = 1.0
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_file_lock = threading.Lock()
+
+
+def _jobs_dir() -> str:
+    path = os.path.join(str(settings.CRM_DATA_DIR), "jobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(_jobs_dir(), f"{job_id}.json")
+
+
+def _lock_path(kind: str) -> str:
+    return os.path.join(_jobs_dir(), f"{kind}.lock")
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(getattr(settings, "CRM_JOB_WORKERS", 2)),
+                thread_name_prefix="crm-job",
+            )
+        return _executor
+
+
+def _update_job(job: Dict[str, Any], **changes: Any) -> None:
+    """修改作業狀態（執行中的作業會被作業執行緒與 heartbeat 執行緒同時存取，一律經由這裡或 _write_job）"""
+    with _file_lock:
+        job.update(changes)
+
+
+def _write_job(job: Dict[str, Any], **changes: Any) -> None:
+    """套用 changes 後寫檔；在鎖內序列化，寫出的一定是完整的一個狀態"""
+    path = _job_path(job["id"])
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with _file_lock:
+        job.update(changes)
+        job["updated_at"] = timezone.now().isoformat()
+        payload = json.dumps(job, ensure_ascii=False, default=str)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """讀取作業狀態，並補上 elapsed / eta（秒）。找不到時回傳 None。"""
+    if not job_id or not all(c.isalnum() or c in "-_" for c in job_id):
+        return None
+    try:
+        with open(_job_path(job_id), "r", encoding="utf-8") as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return _with_timing(job)
+
+
+def _with_timing(job: Dict[str, Any]) -> Dict[str, Any]:
+    started = job.get("started_ts")
+    finished = job.get("finished_ts")
+    elapsed = None
+    if started:
+        elapsed = (finished or time.time()) - started
+    job["elapsed"] = round(elapsed, 2) if elapsed is not None else None
+
+    eta = None
+    processed = job.get("processed") or 0
+    total = job.get("total") or 0
+    if job.get("status") == "running" and elapsed and processed and total:
+        eta = round(elapsed * (total - processed) / processed, 2)
+    elif job.get("status") == "succeeded":
+        eta = 0
+    job["eta"] = eta
+    return job
+
+
+def _is_stale(job: Dict[str, Any]) -> bool:
+    """排隊/執行中的作業太久沒有更新（例如 process 被重啟），視為失效。"""
+    stale_after = int(getattr(settings, "CRM_JOB_STALE_SECONDS", 900))
+    last = job.get("heartbeat_ts") or job.get("created_ts") or 0
+    return time.time() - last > stale_after
+
+
+def _read_lock(path: str) -> Optional[str]:
+    """lock 檔記錄的 job id；lock 檔不存在時回傳 None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+    except OSError:
+        return ""
+
+
+def _lock_age(path: str) -> float:
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def _remove_stale_lock(path: str, stale_id: str) -> None:
+    """lock 仍記錄著 stale_id 時才移除，避免刪掉其他 process 剛建立的新 lock"""
+    if _read_lock(path) != stale_id:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _acquire_lock(kind: str, job_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    確保同一 kind 只有一個作業：先把 job id 寫進暫存檔，再以 os.link 原子地建立 lock 檔，
+    其他請求看到的 lock 一定已經帶有 job id（作業檔也已先寫好）。
+    回傳 (是否取得, 已存在的 job id)。
+    """
+    path = _lock_path(kind)
+    tmp_path = f"{path}.{job_id}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(job_id)
+    try:
+        for _ in range(2):
+            try:
+                os.link(tmp_path, path)
+                return True, None
+            except FileExistsError:
+                pass
+            existing_id = _read_lock(path)
+            if existing_id is None:
+                continue
+            existing = get_job(existing_id)
+            if existing is None:
+                # 讀不到作業檔：lock 剛建立不久時視為仍被持有，不當成失效
+                if _lock_age(path) < _LOCK_GRACE_SECONDS:
+                    return False, existing_id
+            elif existing.get("status") in ACTIVE_STATUSES and not _is_stale(existing):
+                return False, existing_id
+            # lock 已失效：移除後重試一次
+            _remove_stale_lock(path, existing_id)
+        return False, None
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _run_lock_kind(run_lock: str) -> str:
+    return f"{run_lock}.run"
+
+
+def _release_lock(kind: str, job_id: str) -> None:
+    path = _lock_path(kind)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read().strip() != job_id:
+                return
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class JobProgress:
+    """傳給作業函數的進度回報器：progress(processed, total)。"""
+
+    def __init__(self, job: Dict[str, Any]):
+        self._job = job
+        self._last_write = 0.0
+
+    def __call__(self, processed: int, total: Optional[int] = None) -> None:
+        now = time.time()
+        changes = {"processed": int(processed), "heartbeat_ts": now}
+        if total is not None:
+            changes["total"] = int(total)
+        if now - self._last_write >= _PROGRESS_WRITE_INTERVAL or processed == (total or self._job.get("total")):
+            self._last_write = now
+            _write_job(self._job, **changes)
+        else:
+            _update_job(self._job, **changes)
+
+
+def _heartbeat_interval() -> float:
+    stale_after = int(getattr(settings, "CRM_JOB_STALE_SECONDS", 900))
+    return max(1.0, min(60.0, stale_after / 3))
+
+
+def _keep_alive(job: Dict[str, Any], stop: threading.Event) -> None:
+    """作業執行期間定期更新 heartbeat，沒有回報進度的階段也不會被當成失效"""
+    interval = _heartbeat_interval()
+    while not stop.wait(interval):
+        _write_job(job, heartbeat_ts=time.time())
+
+
+def _run_job(job: Dict[str, Any], func: Callable[..., Any], kwargs: Dict[str, Any]) -> None:
+    close_old_connections()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_keep_alive, args=(job, stop), name="crm-job-heartbeat", daemon=True)
+    heartbeat.start()
+    run_lock = job.get("run_lock")
+    try:
+        try:
+            # 維持 queued 狀態，直到取得 run_lock（持有者結束或失效時才拿得到）
+            while run_lock and not _acquire_lock(_run_lock_kind(run_lock), job["id"])[0]:
+                time.sleep(_WAIT_POLL_INTERVAL)
+            now = time.time()
+            _write_job(job, status="running", started_ts=now, heartbeat_ts=now)
+            result = func(progress=JobProgress(job), **kwargs)
+        finally:
+            stop.set()
+            heartbeat.join()
+            if run_lock:
+                _release_lock(_run_lock_kind(run_lock), job["id"])
+        _update_job(job, status="succeeded", result=result)
+    except Exception as exc:
+        logger.exception("Background job %s (%s) failed", job["id"], job["kind"])
+        _update_job(job, status="failed", error=str(exc))
+    finally:
+        _write_job(job, finished_ts=time.time())
+        _release_lock(job["kind"], job["id"])
+        connection.close()
+
+
+def submit_job(
+    kind: str, func: Callable[..., Any], run_lock: Optional[str] = None, **kwargs
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    排入背景作業。func 需接受 progress 關鍵字參數，回傳值需可 JSON 序列化。
+    回傳 (作業狀態, 是否為新建立)；同 kind 已有作業在跑時回傳既有的作業。
+    指定 run_lock 時，與其他同 run_lock 的作業（不分 kind）不會同時執行。
+    """
+    _prune_finished_jobs()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    job = {
+        "id": job_id,
+        "kind": kind,
+        "status": "queued",
+        "params": kwargs,
+        "run_lock": run_lock,
+        "processed": 0,
+        "total": None,
+        "result": None,
+        "error": None,
+        "created_ts": now,
+        "heartbeat_ts": now,
+        "started_ts": None,
+        "finished_ts": None,
+    }
+    # 先寫作業檔再取得 lock：看到 lock 的請求一定讀得到這個作業
+    _write_job(job)
+    acquired, existing_id = _acquire_lock(kind, job_id)
+    if not acquired:
+        _discard_job(job_id)
+        existing = get_job(existing_id) if existing_id else None
+        if existing:
+            return existing, False
+        raise RuntimeError(f"無法取得 {kind} 作業鎖")
+
+    try:
+        _get_executor().submit(_run_job, job, func, kwargs)
+    except Exception:
+        _release_lock(kind, job_id)
+        raise
+    with _file_lock:
+        submitted = dict(job)
+    return _with_timing(submitted), True
+
+
+def _discard_job(job_id: str) -> None:
+    try:
+        os.remove(_job_path(job_id))
+    except OSError:
+        pass
+
+
+def _prune_finished_jobs() -> None:
+    """刪除超過保留期限的已結束作業檔。"""
+    retention = int(getattr(settings, "CRM_JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+    cutoff = time.time() - retention
+    for name in os.listdir(_jobs_dir()):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(_jobs_dir(), name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                job = get_job(name[:-5])
+                if not job or job.get("status") not in ACTIVE_STATUSES:
+                    os.remove(path)
+        except OSError:
+            pass
+
+
+def active_job(kind: str) -> Optional[Dict[str, Any]]:
+    """某 kind 目前在排隊或執行中（且未失效）的作業，沒有時回傳 None。"""
+    job = get_job(_read_lock(_lock_path(kind)) or "")
+    if job and job.get("status") in ACTIVE_STATUSES and not _is_stale(job):
+        return job
+    return None
+
+
+def latest_job(kind: str) -> Optional[Dict[str, Any]]:
+    """回傳某 kind 目前進行中的作業；沒有的話回傳最近一次的作業。"""
+    try:
+        with open(_lock_path(kind), "r", encoding="utf-8") as f:
+            job = get_job(f.read().strip())
+            if job:
+                return job
+    except OSError:
+        pass
+
+    latest = None
+    for name in os.listdir(_jobs_dir()):
+        if not name.endswith(".json"):
+            continue
+        job = get_job(name[:-5])
+        if job and job.get("kind") == kind:
+            if latest is None or job.get("created_ts", 0) > latest.get("created_ts", 0):
+                latest = job
+    return latest
@@ -0,0 +1,88 @@
+# myCRM/services/llm_cache.py
+"""
+ChatGPT 回覆快取（程序內 LRU）：
+- key 為「模型 + messages + temperature + max_tokens」的 SHA-256，提示詞完全相同才會命中
+- 每筆最多保存 CRM_LLM_CACHE_TTL 秒，超過 CRM_LLM_CACHE_MAX_ENTRIES 筆時淘汰最久沒用到的
+- 資料版本改變時分析摘要與提示詞也會改變，自然不會再命中舊的回覆
+- llm_cache_stats() 回報命中 / 未命中 / 淘汰次數
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+_entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+_lock = threading.Lock()
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CRM_LLM_CACHE_TTL", 3600))
+
+
+def _max_entries() -> int:
+    return int(getattr(settings, "CRM_LLM_CACHE_MAX_ENTRIES", 256))
+
+
+def make_key(model: str, messages: list, temperature: float, max_tokens: Optional[int] = None) -> str:
+    raw = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_reply(key: str) -> Optional[str]:
+    """取得快取的回覆；沒有或已過期時回傳 None。"""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del _entries[key]
+            _stats["expired"] += 1
+            entry = None
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry[1]
+
+
+def store_reply(key: str, reply: str) -> None:
+    ttl = _ttl()
+    if ttl <= 0 or not reply:
+        return
+    with _lock:
+        _entries[key] = (time.monotonic() + ttl, reply)
+        _entries.move_to_end(key)
+        _stats["stores"] += 1
+        while len(_entries) > max(1, _max_entries()):
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def clear_llm_cache() -> None:
+    """清空快取並把命中 / 未命中 / 淘汰等計數歸零。"""
+    with _lock:
+        _entries.clear()
+        for name in _stats:
+            _stats[name] = 0
+
+
+def llm_cache_stats() -> Dict[str, Any]:
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["entries"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    stats["max_entries"] = _max_entries()
+    stats["ttl"] = _ttl()
+    return stats
@@ -6,8 +6,8 @@ from statistics import mean
 
 from django.utils import timezone
 
-# 這是你自己的 CatBoost 流失預測服務
-from .churn_service import predict_churn
+# 這是你自己的 CatBoost 流失預測服務（讀取預先計算的分數）
+from .churn_store import get_churn_scores
 
 
 # 7 種價值顧客對應的中文名稱（可依你的 RFM 規則調整）
@@ -44,7 +44,7 @@ def catboost_segment_summary(
     as_of: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
-    以 churn_service.predict_churn() 的結果為基礎，整理出某一個 categoryID 的摘要：
+    以預先計算的流失分數（churn_store.get_churn_scores()）為基礎，整理出某一個 categoryID 的摘要：
 
     回傳的 summary 會包含：
         - segment_name: 中文名稱（例如「忠誠客戶」）
@@ -59,8 +59,8 @@ def catboost_segment_summary(
     """
     window_days = _window_days_for_period(period)
 
-    # 呼叫 CatBoost 預測服務，拿到所有顧客的預測結果
-    results: List[Dict[str, Any]] = predict_churn(
+    # 讀取 CatBoost 流失分數，拿到所有顧客的預測結果
+    results: List[Dict[str, Any]] = get_churn_scores(
         as_of=as_of,
         window_days=window_days,
     )
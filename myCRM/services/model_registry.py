@@ -0,0 +1,98 @@
+# myCRM/services/model_registry.py
+"""
+程序內的模型快取：
+- 模型檔只在第一次使用時載入，之後的呼叫直接共用同一個物件
+- 每次取用會比對模型檔 / meta 檔的 mtime 與大小，重新訓練後自動重新載入
+- 新模型完整載入後才替換舊的，其他執行緒不會拿到載入到一半的模型
+- model_registry_stats() 回報各模型的載入耗時、命中 / 載入次數
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_entries: Dict[str, Dict[str, Any]] = {}
+_stats: Dict[str, Dict[str, Any]] = {}
+_load_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _file_signature(paths: Sequence[str]) -> Tuple:
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append((path, None, None))
+    return tuple(sig)
+
+
+def _stats_for(name: str) -> Dict[str, Any]:
+    with _registry_lock:
+        if name not in _stats:
+            _stats[name] = {
+                "hits": 0,
+                "loads": 0,
+                "load_errors": 0,
+                "last_load_seconds": None,
+                "loaded_at": None,
+            }
+            _load_locks[name] = threading.Lock()
+        return _stats[name]
+
+
+def get_model(name: str, loader: Callable[[], Any], paths: Sequence[str]) -> Any:
+    """
+    取得名為 name 的模型；paths 內任一檔案變動時呼叫 loader() 重新載入。
+    loader 丟出例外時，若已有舊模型則繼續沿用舊的。
+    """
+    stats = _stats_for(name)
+    signature = _file_signature(paths)
+
+    entry = _entries.get(name)
+    if entry is not None and entry["signature"] == signature:
+        stats["hits"] += 1
+        return entry["value"]
+
+    with _load_locks[name]:
+        # 等鎖期間可能已有其他執行緒載入完成
+        entry = _entries.get(name)
+        if entry is not None and entry["signature"] == signature:
+            stats["hits"] += 1
+            return entry["value"]
+
+        start = time.perf_counter()
+        try:
+            value = loader()
+        except Exception:
+            stats["load_errors"] += 1
+            if entry is not None:
+                logger.exception("Reloading model %s failed, keeping previous version", name)
+                return entry["value"]
+            raise
+        elapsed = time.perf_counter() - start
+
+        _entries[name] = {"value": value, "signature": signature}
+        stats["loads"] += 1
+        stats["last_load_seconds"] = round(elapsed, 4)
+        stats["loaded_at"] = time.time()
+        logger.info("Loaded model %s in %.3fs", name, elapsed)
+        return value
+
+
+def invalidate_model(name: Optional[str] = None) -> None:
+    """清除快取的模型（name=None 時全部清除），下次取用會重新載入。"""
+    if name is None:
+        _entries.clear()
+    else:
+        _entries.pop(name, None)
+
+
+def model_registry_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: dict(stats) for name, stats in _stats.items()}
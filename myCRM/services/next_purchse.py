@@ -18,6 +18,9 @@ except Exception:
 
 from myCRM.models import Transaction, Customer
 from .rfm_count import rfm_score_from_raw
+from .model_registry import get_model
+from .feature_store import load_feature_snapshot, schedule_feature_refresh, write_feature_snapshot
+from .transaction_store import get_transaction_store, transaction_store_enabled
 
 
 # ==================== 輔助函數 ====================
@@ -125,124 +128,191 @@ class PurchaseDataset(Dataset):
 
 # ==================== 資料準備函數 ====================
 
+def _load_purchase_arrays(
+    as_of_date: date,
+    customer_ids: Optional[List[int]] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    一次取出交易資料並轉成 NumPy 陣列（依客戶、日期、交易編號排序）
+
+    Returns:
+        cids: 客戶 ID (int64)
+        days: 交易日期的 ordinal 天數 (int64)
+        prices: 交易金額 (float64)
+    """
+    if transaction_store_enabled():
+        store = get_transaction_store()
+        mask = store.day_mask(end=as_of_date)
+        if customer_ids is not None:
+            mask &= store.customer_mask(customer_ids)[store.row_customer]
+        return (
+            store.customer_ids[store.row_customer[mask]],
+            store.days[mask].astype(np.int64),
+            store.prices[mask],
+        )
+
+    transactions = (
+        Transaction.objects
+        .filter(transdate__lte=as_of_date, customerid__isnull=False)
+        .order_by('customerid', 'transdate', 'transactionid')
+    )
+    if customer_ids is not None:
+        transactions = transactions.filter(customerid__in=customer_ids)
+
+    cids = []
+    days = []
+    prices = []
+    for cid, trans_date, price in transactions.values_list('customerid', 'transdate', 'totalprice').iterator(chunk_size=5000):
+        if isinstance(trans_date, datetime):
+            trans_date = trans_date.date()
+        cids.append(cid)
+        days.append(trans_date.toordinal())
+        prices.append(float(price or 0))
+
+    return (
+        np.asarray(cids, dtype=np.int64),
+        np.asarray(days, dtype=np.int64),
+        np.asarray(prices, dtype=np.float64),
+    )
+
+
+def _group_by_customer(cids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """已排序的客戶 ID → (客戶 ID, 每位客戶在陣列中的起點, 終點)"""
+    if len(cids) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    starts = np.flatnonzero(np.r_[True, cids[1:] != cids[:-1]])
+    ends = np.r_[starts[1:], len(cids)]
+    return cids[starts], starts, ends
+
+
+def _range_mean(prefix: np.ndarray, start: np.ndarray, end: np.ndarray, fallback: np.ndarray) -> np.ndarray:
+    """用前綴和計算每段 [start, end) 的平均值；空區段回傳 fallback"""
+    count = end - start
+    total = prefix[end] - prefix[start]
+    return np.where(count > 0, total / np.maximum(count, 1), fallback)
+
+
+def build_purchase_features(
+    days: np.ndarray,
+    prices: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    max_sequence_length: int,
+    training: bool,
+) -> Dict[str, np.ndarray]:
+    """
+    訓練與推論共用的序列特徵（向量化）
+
+    每位客戶的第 k 筆「歷史」= 第 k 筆交易的金額 + 它到下一筆交易的間隔天數。
+    - training=True：最後一個間隔當作目標，序列取它之前的最多 max_sequence_length 筆，
+      不足時間隔用「除了目標以外的平均間隔」、金額用「序列內平均金額」往前填充
+    - training=False：序列取最後 max_sequence_length 筆，不足時用全部歷史的平均值填充
+
+    每個時間步 6 個特徵：間隔天數、金額、累積次數、累積金額、平均間隔、平均金額
+
+    Returns:
+        features: (客戶數, max_sequence_length, 6) float32
+        targets: (客戶數,) 訓練目標（training=False 時為 None）
+        avg_interval: (客戶數,) 歷史平均間隔
+    """
+    L = int(max_sequence_length)
+    n_customers = len(starts)
+    if n_customers == 0:
+        return {
+            'features': np.zeros((0, L, 6), dtype=np.float32),
+            'targets': np.zeros(0, dtype=np.float64) if training else None,
+            'avg_interval': np.zeros(0, dtype=np.float64),
+        }
+
+    # 第 k 筆交易到下一筆的間隔；每位客戶最後一筆交易沒有間隔（不會被用到）
+    intervals = np.zeros(len(days), dtype=np.float64)
+    intervals[:-1] = np.diff(days)
+    interval_prefix = np.r_[0.0, np.cumsum(intervals)]
+    price_prefix = np.r_[0.0, np.cumsum(prices)]
+
+    history_end = ends - 1  # 有間隔的歷史為 [starts, ends - 1)
+    if training:
+        targets = intervals[history_end - 1]
+        window_end = history_end - 1
+        avg_interval = np.where(
+            window_end - starts > 0,
+            _range_mean(interval_prefix, starts, window_end, targets),
+            targets,
+        )
+    else:
+        targets = None
+        window_end = history_end
+        avg_interval = _range_mean(interval_prefix, starts, window_end, np.zeros(n_customers))
+    window_start = np.maximum(starts, window_end - L)
+
+    if training:
+        pad_price = _range_mean(price_prefix, window_start, window_end, np.zeros(n_customers))
+    else:
+        pad_price = _range_mean(price_prefix, starts, window_end, np.zeros(n_customers))
+
+    # 取出每位客戶的序列視窗，前面不足的部分用平均值填充
+    idx = window_end[:, None] - L + np.arange(L)[None, :]
+    valid = idx >= window_start[:, None]
+    idx = np.clip(idx, 0, None)
+    seq_intervals = np.where(valid, intervals[idx], avg_interval[:, None])
+    seq_prices = np.where(valid, prices[idx], pad_price[:, None])
+
+    steps = np.arange(1, L + 1, dtype=np.float64)
+    cum_prices = np.cumsum(seq_prices, axis=1)
+
+    features = np.empty((n_customers, L, 6), dtype=np.float32)
+    features[:, :, 0] = seq_intervals                             # 交易間隔天數
+    features[:, :, 1] = seq_prices                                # 交易金額
+    features[:, :, 2] = steps                                     # 累積次數
+    features[:, :, 3] = cum_prices                                # 累積金額
+    features[:, :, 4] = np.cumsum(seq_intervals, axis=1) / steps  # 平均間隔
+    features[:, :, 5] = cum_prices / steps                        # 平均金額
+
+    return {'features': features, 'targets': targets, 'avg_interval': avg_interval}
+
+
 def _build_purchase_sequences(
     min_transactions: int = 3,
     max_sequence_length: int = 10,
     as_of: Optional[str] = None,
-) -> Tuple[List[List[List[float]]], List[float], Dict[str, Any]]:
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
     """
     建立購買序列資料
     
     Returns:
-        sequences: 每位顧客的購買序列特徵 [客戶數, 序列長度, 特徵數]
+        sequences: 每位顧客的購買序列特徵 [客戶數, 序列長度, 特徵數]（float32）
         targets: 每位顧客的下次購買天數 [客戶數]
         stats: 資料統計資訊
     """
     as_of_date = _parse_as_of(as_of)
-    
+
     # 取得所有交易記錄（按客戶和日期排序）
-    transactions = (
-        Transaction.objects
-        .filter(transdate__lte=as_of_date)
-        .order_by('customerid', 'transdate')
-        .values('customerid', 'transdate', 'totalprice')
+    cids, days, prices = _load_purchase_arrays(as_of_date)
+    _customer_ids, starts, ends = _group_by_customer(cids)
+
+    # 至少需要 min_transactions 筆歷史 + 1 筆作為目標
+    keep = (ends - starts) >= max(min_transactions + 1, 2)
+    built = build_purchase_features(
+        days, prices, starts[keep], ends[keep], max_sequence_length, training=True,
     )
-    
-    # 按客戶分組
-    customer_transactions: Dict[int, List] = {}
-    for trans in transactions:
-        cid = trans['customerid']
-        if cid not in customer_transactions:
-            customer_transactions[cid] = []
-        customer_transactions[cid].append({
-            'date': trans['transdate'],
-            'price': float(trans['totalprice'] or 0),
-        })
-    
-    sequences = []
-    targets = []
-    customer_ids = []
-    
-    for cid, trans_list in customer_transactions.items():
-        if len(trans_list) < min_transactions + 1:
-            # 至少需要 min_transactions 筆歷史 + 1 筆作為目標
-            continue
-        
-        # 計算交易間隔
-        intervals = []
-        prices = []
-        for i in range(len(trans_list) - 1):
-            date1 = trans_list[i]['date']
-            date2 = trans_list[i + 1]['date']
-            if isinstance(date1, datetime):
-                date1 = date1.date()
-            if isinstance(date2, datetime):
-                date2 = date2.date()
-            
-            interval = (date2 - date1).days
-            intervals.append(interval)
-            prices.append(trans_list[i]['price'])
-        
-        # 如果間隔數量不足，跳過
-        if len(intervals) < min_transactions:
-            continue
-        
-        # 計算 RFM 特徵（基於歷史交易）
-        total_trans = len(trans_list) - 1
-        total_spent = sum(prices)
-        avg_interval = float(np.mean(intervals[:-1])) if len(intervals) > 1 else float(intervals[0])
-        
-        # 建立序列（使用倒數第 max_sequence_length 到倒數第二筆交易）
-        seq_intervals = intervals[-(max_sequence_length+1):-1]
-        seq_prices = prices[-(max_sequence_length+1):-1]
-        
-        # 填充序列至固定長度
-        seq_len = len(seq_intervals)
-        if seq_len < max_sequence_length:
-            # 用平均值填充
-            pad_len = max_sequence_length - seq_len
-            seq_intervals = [float(avg_interval)] * pad_len + seq_intervals
-            avg_price = float(np.mean(seq_prices)) if seq_prices else 0.0
-            seq_prices = [float(avg_price)] * pad_len + seq_prices
-        
-        # 建立特徵序列
-        sequence_features = []
-        for i in range(max_sequence_length):
-            # 每個時間步的特徵：
-            # 1. 交易間隔天數
-            # 2. 交易金額
-            # 3. 累積交易次數
-            # 4. 累積交易金額
-            # 5. 平均間隔
-            # 6. 平均金額
-            features = [
-                float(seq_intervals[i]),
-                float(seq_prices[i]),
-                float(i + 1),  # 累積次數
-                float(sum(seq_prices[:i+1])),  # 累積金額
-                float(np.mean(seq_intervals[:i+1])),  # 平均間隔
-                float(np.mean(seq_prices[:i+1])),  # 平均金額
-            ]
-            sequence_features.append(features)
-        
-        sequences.append(sequence_features)
-        targets.append(float(intervals[-1]))  # 最後一個間隔作為目標
-        customer_ids.append(cid)
-    
+    sequences = built['features']
+    targets = built['targets']
+
     stats = {
         'total_customers': int(len(sequences)),
         'sequence_length': int(max_sequence_length),
         'feature_size': 6,
-        'avg_target': float(np.mean(targets)) if targets else 0.0,
-        'std_target': float(np.std(targets)) if targets else 0.0,
+        'avg_target': float(np.mean(targets)) if len(targets) else 0.0,
+        'std_target': float(np.std(targets)) if len(targets) else 0.0,
     }
     
     return sequences, targets, stats
 
 
 def _normalize_data(
-    sequences: List[List[List[float]]],
-    targets: List[float],
+    sequences: np.ndarray,
+    targets: np.ndarray,
     scaler_params: Optional[Dict] = None,
 ) -> Tuple[np.ndarray, np.ndarray, Dict]:
     """
@@ -484,6 +554,172 @@ def train_next_purchase_model(
 
 # ==================== 預測函數 ====================
 
+# 批次推論時每次送進模型的顧客數
+DEFAULT_INFERENCE_BATCH_SIZE = 512
+
+LSTM_MODEL_NAME = "next_purchase_lstm"
+# 推論用序列特徵快照（feature_store）的名稱
+PURCHASE_FEATURES = "purchase_features"
+
+
+def _load_lstm_model() -> Dict[str, Any]:
+    """載入 LSTM 權重、元資料與標準化參數（透過 model_registry 快取）"""
+    with open(_lstm_meta_path(), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    with open(_scaler_path(), 'r', encoding='utf-8') as f:
+        scaler_params = json.load(f)
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = PurchaseTimeLSTM(
+        input_size=6,
+        hidden_size=meta['hidden_size'],
+        num_layers=meta['num_layers'],
+    ).to(device)
+    model.load_state_dict(torch.load(_lstm_model_path(), map_location=device))
+    model.eval()
+
+    return {
+        'model': model,
+        'meta': meta,
+        'device': device,
+        'seq_mean': np.array(scaler_params['seq_mean']),
+        'seq_std': np.array(scaler_params['seq_std']),
+        'scaler_params': scaler_params,
+    }
+
+
+def _get_lstm_model() -> Dict[str, Any]:
+    if not _TORCH_AVAILABLE:
+        raise RuntimeError("PyTorch 未安裝")
+
+    if not os.path.exists(_lstm_model_path()):
+        raise FileNotFoundError("模型尚未訓練，請先執行 train_next_purchase_model()")
+
+    return get_model(
+        LSTM_MODEL_NAME,
+        _load_lstm_model,
+        [_lstm_model_path(), _lstm_meta_path(), _scaler_path()],
+    )
+
+
+def _predict_from_arrays(
+    customer_ids: np.ndarray,
+    days: np.ndarray,
+    prices: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    loaded: Dict[str, Any],
+    batch_size: int = DEFAULT_INFERENCE_BATCH_SIZE,
+) -> List[Dict[str, Any]]:
+    """
+    依 build_purchase_features 產生 (N, seq_len, 6) 的特徵，分批送進模型，一次取得所有顧客的預測
+    （每位客戶至少要有 2 筆交易）
+    """
+    if len(customer_ids) == 0:
+        return []
+
+    built = build_purchase_features(
+        days, prices, starts, ends, loaded['meta']['max_sequence_length'], training=False,
+    )
+    return _predict_from_features(
+        customer_ids, built['features'], built['avg_interval'], days[ends - 1], ends - starts, loaded, batch_size,
+    )
+
+
+def _predict_from_features(
+    customer_ids: np.ndarray,
+    features: np.ndarray,
+    avg_interval: np.ndarray,
+    last_days: np.ndarray,
+    total_transactions: np.ndarray,
+    loaded: Dict[str, Any],
+    batch_size: int = DEFAULT_INFERENCE_BATCH_SIZE,
+) -> List[Dict[str, Any]]:
+    """已算好的序列特徵 → 分批送進模型 → 預測結果（last_days 為最後一筆交易的 ordinal 日期）"""
+    if len(customer_ids) == 0:
+        return []
+
+    # 標準化
+    normalized_seq = ((features - loaded['seq_mean']) / loaded['seq_std']).astype(np.float32)
+
+    # 分批預測
+    model = loaded['model']
+    device = loaded['device']
+    batch_size = max(1, int(batch_size))
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(normalized_seq), batch_size):
+            batch = torch.from_numpy(normalized_seq[start:start + batch_size]).to(device)
+            outputs.append(model(batch).cpu().numpy().reshape(-1))
+    predictions = np.concatenate(outputs)
+
+    # 反標準化
+    predicted_days_all = _denormalize_predictions(predictions, loaded['scaler_params'])
+
+    results = []
+    for i, cid in enumerate(customer_ids):
+        predicted_days = max(1, int(round(float(predicted_days_all[i]))))  # 至少 1 天，確保是 int
+
+        # 計算預測日期
+        last_purchase_date = date.fromordinal(int(last_days[i]))
+        predicted_date = last_purchase_date + timedelta(days=predicted_days)
+
+        results.append({
+            'customer_id': int(cid),
+            'last_purchase_date': last_purchase_date.isoformat(),
+            'predicted_days': int(predicted_days),
+            'predicted_date': predicted_date.isoformat(),
+            'avg_interval_history': float(round(float(avg_interval[i]), 1)),
+            'total_transactions': int(total_transactions[i]),
+        })
+    return results
+
+
+# ==================== 序列特徵快照 ====================
+
+def _build_purchase_feature_columns(as_of_date: date, max_sequence_length: int):
+    cids, days, prices = _load_purchase_arrays(as_of_date)
+    grouped_ids, starts, ends = _group_by_customer(cids)
+    keep = (ends - starts) >= 2
+    starts, ends = starts[keep], ends[keep]
+    built = build_purchase_features(days, prices, starts, ends, max_sequence_length, training=False)
+    columns = {
+        'customer_id': grouped_ids[keep],
+        'features': built['features'],
+        'avg_interval': built['avg_interval'],
+        'last_day': days[ends - 1],
+        'total_transactions': ends - starts,
+    }
+    return columns, {'max_sequence_length': int(max_sequence_length)}
+
+
+def refresh_purchase_features(as_of: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    """
+    重建所有顧客（至少 2 筆交易）的推論用序列特徵快照，序列長度依目前的 LSTM 模型；
+    尚未訓練模型時不建立，回傳 None。
+    """
+    if not os.path.exists(_lstm_meta_path()):
+        return None
+    with open(_lstm_meta_path(), 'r', encoding='utf-8') as f:
+        max_sequence_length = int(json.load(f)['max_sequence_length'])
+
+    as_of_date = as_of or date.today()
+    return write_feature_snapshot(
+        PURCHASE_FEATURES, as_of_date, lambda: _build_purchase_feature_columns(as_of_date, max_sequence_length),
+    )
+
+
+def _load_purchase_features(as_of_date: date, max_sequence_length: int) -> Optional[Dict[str, np.ndarray]]:
+    """與 as_of_date、目前交易資料及模型序列長度一致的特徵快照欄位；不可用時回傳 None（今天的資料會在背景重建）"""
+    snapshot = load_feature_snapshot(PURCHASE_FEATURES, as_of_date)
+    if snapshot is not None and snapshot['meta'].get('max_sequence_length') == int(max_sequence_length):
+        return snapshot['columns']
+    if as_of_date == date.today():
+        schedule_feature_refresh(PURCHASE_FEATURES, refresh_purchase_features)
+    return None
+
+
 def predict_next_purchase_time(
     customer_id: int,
     as_of: Optional[str] = None,
@@ -498,125 +734,25 @@ def predict_next_purchase_time(
     Returns:
         預測結果字典
     """
-    if not _TORCH_AVAILABLE:
-        raise RuntimeError("PyTorch 未安裝")
-    
     # 載入模型和參數
-    model_path = _lstm_model_path()
-    meta_path = _lstm_meta_path()
-    scaler_path = _scaler_path()
-    
-    if not os.path.exists(model_path):
-        raise FileNotFoundError("模型尚未訓練，請先執行 train_next_purchase_model()")
-    
-    # 載入元資料
-    with open(meta_path, 'r', encoding='utf-8') as f:
-        meta = json.load(f)
-    
-    with open(scaler_path, 'r', encoding='utf-8') as f:
-        scaler_params = json.load(f)
-    
-    max_sequence_length = meta['max_sequence_length']
-    
+    loaded = _get_lstm_model()
+
     # 取得客戶交易記錄
     as_of_date = _parse_as_of(as_of)
-    transactions = (
-        Transaction.objects
-        .filter(customerid=customer_id, transdate__lte=as_of_date)
-        .order_by('transdate')
-        .values('transdate', 'totalprice')
-    )
-    
-    trans_list = list(transactions)
-    if len(trans_list) < 2:
+    cids, days, prices = _load_purchase_arrays(as_of_date, customer_ids=[customer_id])
+
+    if len(days) < 2:
         raise ValueError(f"客戶 {customer_id} 的交易記錄不足（需至少 2 筆）")
-    
-    # 計算交易間隔和金額
-    intervals = []
-    prices = []
-    for i in range(len(trans_list) - 1):
-        date1 = trans_list[i]['transdate']
-        date2 = trans_list[i + 1]['transdate']
-        if isinstance(date1, datetime):
-            date1 = date1.date()
-        if isinstance(date2, datetime):
-            date2 = date2.date()
-        
-        interval = (date2 - date1).days
-        intervals.append(interval)
-        prices.append(float(trans_list[i]['totalprice'] or 0))
-    
-    # 建立序列
-    avg_interval = float(np.mean(intervals))
-    avg_price = float(np.mean(prices))
-    
-    seq_intervals = intervals[-max_sequence_length:]
-    seq_prices = prices[-max_sequence_length:]
-    
-    # 填充至固定長度
-    if len(seq_intervals) < max_sequence_length:
-        pad_len = max_sequence_length - len(seq_intervals)
-        seq_intervals = [float(avg_interval)] * pad_len + seq_intervals
-        seq_prices = [float(avg_price)] * pad_len + seq_prices
-    
-    # 建立特徵
-    sequence_features = []
-    for i in range(max_sequence_length):
-        features = [
-            float(seq_intervals[i]),
-            float(seq_prices[i]),
-            float(i + 1),
-            float(sum(seq_prices[:i+1])),
-            float(np.mean(seq_intervals[:i+1])),
-            float(np.mean(seq_prices[:i+1])),
-        ]
-        sequence_features.append(features)
-    
-    # 標準化
-    sequence_array = np.array([sequence_features])
-    seq_mean = np.array(scaler_params['seq_mean'])
-    seq_std = np.array(scaler_params['seq_std'])
-    normalized_seq = (sequence_array - seq_mean) / seq_std
-    
-    # 載入模型
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = PurchaseTimeLSTM(
-        input_size=6,
-        hidden_size=meta['hidden_size'],
-        num_layers=meta['num_layers'],
-    ).to(device)
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.eval()
-    
-    # 預測
-    with torch.no_grad():
-        input_tensor = torch.FloatTensor(normalized_seq).to(device)
-        prediction = model(input_tensor).cpu().numpy()[0][0]
-    
-    # 反標準化
-    predicted_days = _denormalize_predictions(np.array([prediction]), scaler_params)[0]
-    predicted_days = max(1, int(round(float(predicted_days))))  # 至少 1 天，確保是 int
-    
-    # 計算預測日期
-    last_purchase_date = trans_list[-1]['transdate']
-    if isinstance(last_purchase_date, datetime):
-        last_purchase_date = last_purchase_date.date()
-    
-    predicted_date = last_purchase_date + timedelta(days=predicted_days)
-    
-    return {
-        'customer_id': int(customer_id),
-        'last_purchase_date': last_purchase_date.isoformat(),
-        'predicted_days': int(predicted_days),
-        'predicted_date': predicted_date.isoformat(),
-        'avg_interval_history': float(round(avg_interval, 1)),
-        'total_transactions': int(len(trans_list)),
-    }
+
+    starts = np.array([0])
+    ends = np.array([len(days)])
+    return _predict_from_arrays(np.array([customer_id]), days, prices, starts, ends, loaded)[0]
 
 
 def predict_next_purchase_batch(
     as_of: Optional[str] = None,
     top_n: Optional[int] = None,
+    batch_size: int = DEFAULT_INFERENCE_BATCH_SIZE,
 ) -> List[Dict[str, Any]]:
     """
     批次預測所有符合條件的顧客下次購買時間
@@ -624,35 +760,72 @@ def predict_next_purchase_batch(
     Args:
         as_of: 預測基準日期
         top_n: 只返回前 N 位客戶
+        batch_size: 每次送進模型的顧客數
     
     Returns:
         預測結果列表
     """
+    try:
+        loaded = _get_lstm_model()
+    except (RuntimeError, FileNotFoundError):
+        # 沒有 torch 或尚未訓練模型時沒有可預測的客戶
+        return []
+
     # 取得所有有足夠交易記錄的客戶
     as_of_date = _parse_as_of(as_of)
-    
-    customers_with_trans = (
-        Transaction.objects
-        .filter(transdate__lte=as_of_date)
-        .values('customerid')
-        .annotate(trans_count=Count('transactionid'))
-        .filter(trans_count__gte=2)
-        .order_by('-trans_count')
+
+    # 有可用的特徵快照時直接取用（快照內都是至少 2 筆交易的客戶），不必讀交易
+    columns = _load_purchase_features(as_of_date, loaded['meta']['max_sequence_length'])
+    if columns is not None:
+        order = np.argsort(-columns['total_transactions'], kind='stable')
+        if top_n:
+            order = np.sort(order[:top_n])
+        results = _predict_from_features(
+            columns['customer_id'][order],
+            columns['features'][order],
+            columns['avg_interval'][order],
+            columns['last_day'][order],
+            columns['total_transactions'][order],
+            loaded,
+            batch_size=batch_size,
+        )
+        results.sort(key=lambda x: x['predicted_days'])
+        return results
+    
+    if transaction_store_enabled():
+        store = get_transaction_store()
+        counts = store.count_by_customer(store.day_mask(end=as_of_date))
+        eligible = np.flatnonzero(counts >= 2)
+        eligible = eligible[np.argsort(-counts[eligible], kind="stable")]
+        if top_n:
+            eligible = eligible[:top_n]
+        customer_ids = store.customer_ids[eligible].tolist()
+    else:
+        customers_with_trans = (
+            Transaction.objects
+            .filter(transdate__lte=as_of_date)
+            .values('customerid')
+            .annotate(trans_count=Count('transactionid'))
+            .filter(trans_count__gte=2)
+            .order_by('-trans_count')
+        )
+        
+        if top_n:
+            customers_with_trans = customers_with_trans[:top_n]
+
+        customer_ids = [row['customerid'] for row in customers_with_trans if row['customerid'] is not None]
+    if not customer_ids:
+        return []
+
+    # 一次取回這些客戶的交易（依客戶、日期排序）
+    cids, days, prices = _load_purchase_arrays(as_of_date, customer_ids=customer_ids if top_n else None)
+    grouped_ids, starts, ends = _group_by_customer(cids)
+
+    keep = np.isin(grouped_ids, customer_ids) & ((ends - starts) >= 2)
+    results = _predict_from_arrays(
+        grouped_ids[keep], days, prices, starts[keep], ends[keep], loaded, batch_size=batch_size,
     )
-    
-    if top_n:
-        customers_with_trans = customers_with_trans[:top_n]
-    
-    results = []
-    for row in customers_with_trans:
-        cid = row['customerid']
-        try:
-            prediction = predict_next_purchase_time(cid, as_of=as_of)
-            results.append(prediction)
-        except Exception:
-            # 跳過預測失敗的客戶
-            continue
-    
+
     # 按預測天數排序（即將購買的排前面）
     results.sort(key=lambda x: x['predicted_days'])
     
@@ -1,9 +1,42 @@
 #===============RFM分數計算=================
 
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
 from django.shortcuts import render, redirect
+from django.db import connection, transaction as db_transaction
+from django.utils import timezone
 from myCRM.models import Transaction, RFMscore, Customer, CustomerCategory
+from myCRM.services.category_affinity import rebuild_category_affinity, update_category_affinity
+from myCRM.services.data_version import bump_data_version
+from myCRM.services.job_runner import active_job, submit_job
+from myCRM.services.transaction_store import get_transaction_store, transaction_store_enabled
 from datetime import datetime
 from django.db.models import Count, Sum, Max
+
+# 批次寫入時每批的筆數
+DEFAULT_BATCH_SIZE = 1000
+
+RFM_UPDATE_FIELDS = ["rScore", "fScore", "mScore", "RFMscore", "categoryID", "RFMupdate"]
+
+# 背景 RFM 重算作業的 kind（各自同一時間只會有一個）：完整重算、增量重算；
+# 兩者共用 RFM_RUN_LOCK，不會同時寫入水位線與 RFMscore
+RFM_REFRESH_JOB = "rfm_refresh"
+RFM_INCREMENTAL_JOB = "rfm_refresh_incremental"
+RFM_RUN_LOCK = "rfm"
+
+# R 分數的級距邊界（天），跨過任一邊界 R 分數就會改變
+RECENCY_BOUNDARIES = (30, 60, 90, 120)
+# F / M 分數的級距門檻（>= 門檻就加一分），與 rfm_score_from_raw 相同
+FREQUENCY_THRESHOLDS = (2, 6, 10, 15)
+MONETARY_THRESHOLDS = (100, 500, 2000, 2500)
+
 #分類邏輯
 def classify_customer(recency_score, frequency_score, monetary_score):
     # 忠誠客戶: 最近活躍、消費金額高、頻繁交易
@@ -76,10 +109,62 @@ def rfm_score_from_raw(recency_days: int, frequency: int, monetary: float):
     return r_score, f_score, m_score
 
 
+## 向量化版本（NumPy），結果與上面兩個純量函數逐筆相同
+def rfm_scores_from_raw_array(recency_days, frequency, monetary):
+    """
+    rfm_score_from_raw 的陣列版：輸入三個等長陣列，回傳 (r, f, m) 三個 int64 陣列。
+    - R：recency_days 大於幾個邊界就從 5 分扣幾分
+    - F / M：大於等於幾個門檻就從 1 分加幾分
+    """
+    recency_days = np.asarray(recency_days)
+    frequency = np.asarray(frequency)
+    monetary = np.asarray(monetary, dtype=np.float64)
+
+    r_score = 5 - np.searchsorted(RECENCY_BOUNDARIES, recency_days, side="left")
+    f_score = 1 + np.searchsorted(FREQUENCY_THRESHOLDS, frequency, side="right")
+    m_score = 1 + np.searchsorted(MONETARY_THRESHOLDS, monetary, side="right")
+    # NaN 在 searchsorted 會排到最後，純量版則所有比較都不成立 → 1 分
+    m_score = np.where(np.isnan(monetary), 1, m_score)
+
+    return (
+        r_score.astype(np.int64),
+        f_score.astype(np.int64),
+        m_score.astype(np.int64),
+    )
+
+
+def classify_customers_array(recency_score, frequency_score, monetary_score):
+    """classify_customer 的陣列版，條件順序與純量版一致，回傳 int64 分類陣列。"""
+    r = np.asarray(recency_score)
+    f = np.asarray(frequency_score)
+    m = np.asarray(monetary_score)
+    conditions = [
+        (r >= 4) & (f >= 5) & (m >= 5),
+        (r >= 3) & (f >= 3) & (m >= 4),
+        (r <= 2) & (f >= 3) & (m >= 3),
+        (r <= 1) & (f <= 1) & (m <= 1),
+        (r <= 3) & ((f <= 3) | (m <= 3)),
+    ]
+    return np.select(conditions, [1, 2, 3, 6, 5], default=4).astype(np.int64)
+
+
+def recency_days_array(today, last_dates):
+    """把最近交易日（date 或 datetime）列表轉成距離 today 的天數陣列。"""
+    days = np.array(
+        [d.date() if isinstance(d, datetime) else d for d in last_dates],
+        dtype="datetime64[D]",
+    )
+    return (np.datetime64(today, "D") - days).astype(np.int64)
+
+
 
 
 
-def recalc_rfm_scores():
+def recalc_rfm_scores(
+    bulk: bool = True,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    incremental: bool = False,
+):
     """
     重新計算所有顧客的 RFM 分數：
     - R（Recency）最近消費間隔天數
@@ -88,7 +173,30 @@ def recalc_rfm_scores():
     並更新：
       - RFMscore 資料表
       - Customer 資料表中的客戶分類（categoryid）
+
+    bulk=True（預設）使用批次引擎 recalc_rfm_scores_bulk()，
+    bulk=False 則保留逐筆 update_or_create 的舊流程。
+    incremental=True 只重算上次水位線之後受影響的顧客（見 recalc_rfm_scores_incremental）。
     """
+    if incremental:
+        report = recalc_rfm_scores_incremental(batch_size=batch_size)
+        print(format_rfm_report(report))
+        return RFMscore.objects.all()
+
+    if bulk:
+        report = recalc_rfm_scores_bulk(batch_size=batch_size)
+        print(format_rfm_report(report))
+        return RFMscore.objects.all()
+
+    watermark = _current_watermark(datetime.now().date())
+    result = _recalc_rfm_scores_rowwise()
+    _write_watermark(watermark)
+    bump_data_version("rfm_rowwise")
+    return result
+
+
+def _recalc_rfm_scores_rowwise():
+    """逐筆版 RFM 重算（每位顧客 2~3 次資料庫往返）。"""
 
     today = datetime.now().date()  # 取得今天的日期（避免 date/datetime 型別衝突）
     this_month_start = today.replace(day=1)  # 🔹 本月第一天，判斷「本月新註冊」用
@@ -193,18 +301,396 @@ def recalc_rfm_scores():
     return RFMscore.objects.all()
 
 
+# ========== 批次 RFM 引擎 ==========
+
+class _PhaseTimer:
+    """記錄各階段耗時與處理筆數，最後輸出 rows/sec 報告。"""
+
+    def __init__(self):
+        self.phases = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        info = {"rows": 0}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            rows = int(info.get("rows") or 0)
+            self.phases[name] = {
+                "rows": rows,
+                "seconds": round(seconds, 4),
+                "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None,
+            }
+
+    def report(self, **extra):
+        return {
+            "phases": self.phases,
+            "total_seconds": round(time.perf_counter() - self._started, 4),
+            **extra,
+        }
+
+
+def format_rfm_report(report) -> str:
+    """把 recalc_rfm_scores_bulk() 的計時報告轉成一行行文字，方便印在 log。"""
+    mode = report.get("mode", "bulk")
+    lines = [f"RFM {mode} recalc: {report.get('customers', 0)} customers in {report.get('total_seconds')}s"]
+    for name, info in report.get("phases", {}).items():
+        lines.append(
+            f"  - {name}: {info['rows']} rows, {info['seconds']}s, {info['rows_per_sec']} rows/sec"
+        )
+    return "\n".join(lines)
+
+
+def _load_rfm_aggregates(today, customer_ids=None):
+    """
+    一次聚合查詢取得每位顧客在 today 以前的 R/F/M 原始值：
+    {customerid: {"recency": 最近交易日, "frequency": 筆數, "monetary": 總金額}}
+    """
+    if transaction_store_enabled():
+        return _rfm_aggregates_from_store(today, customer_ids)
+
+    qs = Transaction.objects.filter(transdate__lt=today)
+    if customer_ids is not None:
+        qs = qs.filter(customerid__in=customer_ids)
+    qs = (
+        qs
+        .values("customerid")
+        .annotate(
+            recency=Max("transdate"),
+            frequency=Count("transactionid"),
+            monetary=Sum("totalprice"),
+        )
+    )
+    return {row["customerid"]: row for row in qs}
+
+
+def _rfm_aggregates_from_store(today, customer_ids=None):
+    """_load_rfm_aggregates 的交易快照版本（不查 transaction 表）"""
+    store = get_transaction_store()
+    mask = store.day_mask(end=today, end_inclusive=False)
+    frequency = store.count_by_customer(mask)
+    monetary = store.sum_by_customer(mask)
+    last_days = store.last_day_by_customer(mask)
+
+    selected = frequency > 0
+    if customer_ids is not None:
+        selected &= store.customer_mask(customer_ids)
+
+    result = {}
+    for k in np.flatnonzero(selected):
+        customer_id = int(store.customer_ids[k])
+        result[customer_id] = {
+            "customerid": customer_id,
+            "recency": date.fromordinal(int(last_days[k])),
+            "frequency": int(frequency[k]),
+            "monetary": float(monetary[k]),
+        }
+    return result
+
+
+def _compute_rfm_rows(customers, transaction_dict, today, this_month_start):
+    """
+    依照 recalc_rfm_scores 的規則在記憶體中算出每位顧客的結果。
+    customers: [(customerid, customerjoinday, 目前的 categoryid), ...]
+    回傳 [(customerid, r, f, m, rfm, rfm 表 categoryID, customer 表 categoryid, 目前的 categoryid), ...]
+    """
+    rows = []
+    scored = []
+    for customer_id, join_day, current_category in customers:
+        # 本月內註冊的會員：rfm 表記 7、customer 表記 8（與逐筆版相同）
+        if join_day and join_day >= this_month_start:
+            rows.append((customer_id, 0, 0, 0, 0, 7, 8, current_category))
+            continue
+
+        row = transaction_dict.get(customer_id)
+        if row is None:
+            # 已加入但尚未消費：rfm 表記 8、customer 表記 7
+            rows.append((customer_id, 0, 0, 0, 0, 8, 7, current_category))
+            continue
+
+        scored.append((customer_id, current_category, row))
+
+    if not scored:
+        return rows
+
+    # 有交易的顧客一次用向量化函數計分
+    recency = recency_days_array(today, [row["recency"] for _, _, row in scored])
+    frequency = np.array([row["frequency"] or 0 for _, _, row in scored], dtype=np.int64)
+    monetary = np.array([row["monetary"] or 0 for _, _, row in scored], dtype=np.float64)
+
+    r, f, m = rfm_scores_from_raw_array(recency, frequency, monetary)
+    categories = classify_customers_array(r, f, m)
+    totals = r + f + m
+
+    for i, (customer_id, current_category, _) in enumerate(scored):
+        category_id = int(categories[i])
+        rows.append((
+            customer_id, int(r[i]), int(f[i]), int(m[i]), int(totals[i]),
+            category_id, category_id, current_category,
+        ))
+    return rows
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _upsert_rfm_rows(rows, batch_size, updated_at, progress=None):
+    """
+    用 bulk_create(update_conflicts=True) 分批 upsert 到 rfm_score。
+    progress(processed, total) 會在每批寫完後被呼叫。
+    """
+    objs = [
+        RFMscore(
+            customerID=customer_id,
+            rScore=r,
+            fScore=f,
+            mScore=m,
+            RFMscore=rfm,
+            categoryID=rfm_category,
+            RFMupdate=updated_at,
+        )
+        for customer_id, r, f, m, rfm, rfm_category, _, _ in rows
+    ]
+    # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定 unique_fields，其他資料庫則必須指定
+    unique_fields = ["customerID"] if connection.features.supports_update_conflicts_with_target else None
+    written = 0
+    with db_transaction.atomic():
+        for chunk in _chunks(objs, batch_size):
+            RFMscore.objects.bulk_create(
+                chunk,
+                update_conflicts=True,
+                update_fields=RFM_UPDATE_FIELDS,
+                unique_fields=unique_fields,
+            )
+            written += len(chunk)
+            if progress:
+                progress(written, len(objs))
+    return written
+
+
+def _update_customer_categories(rows, batch_size):
+    """
+    只更新分類有變動的顧客；同一分類的顧客合併成
+    UPDATE ... WHERE customerID IN (...) 分批送出。
+    """
+    ids_by_category = {}
+    for customer_id, _, _, _, _, _, customer_category, current_category in rows:
+        if current_category is not None and str(current_category) == str(customer_category):
+            continue
+        ids_by_category.setdefault(customer_category, []).append(customer_id)
+
+    changed = 0
+    with db_transaction.atomic():
+        for category_id, ids in ids_by_category.items():
+            for chunk in _chunks(ids, batch_size):
+                Customer.objects.filter(customerid__in=chunk).update(categoryid=category_id)
+                changed += len(chunk)
+    return changed
+
+
+def recalc_rfm_scores_bulk(batch_size: int = DEFAULT_BATCH_SIZE, progress=None):
+    """
+    批次版 RFM 重算：
+      1. load           一次撈出顧客與交易聚合
+      2. compute        在記憶體中算出所有分數與分類
+      3. write_rfm      分批 upsert rfm_score
+      4. write_customer 只把分類有變動的顧客分批 update 回 customer
+    回傳各階段的筆數、秒數與 rows/sec。
+    progress(processed, total) 可用來回報寫入進度（背景作業用）。
+    """
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+    timer = _PhaseTimer()
+
+    today = datetime.now().date()
+    this_month_start = today.replace(day=1)
+    # 先記下開始時的水位線，計算期間新進的交易留給下一次增量更新
+    watermark = _current_watermark(today)
+
+    with timer.phase("load") as info:
+        customers = list(
+            Customer.objects
+            .filter(customerjoinday__lt=today)
+            .values_list("customerid", "customerjoinday", "categoryid")
+        )
+        transaction_dict = _load_rfm_aggregates(today)
+        info["rows"] = len(customers) + len(transaction_dict)
+
+    with timer.phase("compute") as info:
+        rows = _compute_rfm_rows(customers, transaction_dict, today, this_month_start)
+        info["rows"] = len(rows)
+
+    with timer.phase("write_rfm") as info:
+        info["rows"] = _upsert_rfm_rows(rows, batch_size, timezone.now(), progress=progress)
+
+    with timer.phase("write_customer") as info:
+        info["rows"] = _update_customer_categories(rows, batch_size)
+
+    _write_watermark(watermark)
+    bump_data_version("rfm_bulk")
+    return timer.report(mode="bulk", customers=len(rows), batch_size=batch_size, watermark=watermark)
+
+
+# ========== 增量 RFM（交易水位線） ==========
+
+def _watermark_path() -> str:
+    data_dir = str(settings.CRM_DATA_DIR)
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, "rfm_watermark.json")
+
+
+def _current_watermark(today: date):
+    """目前 transaction 表的最大 transactionID，搭配這次計算所用的日期。"""
+    max_id = Transaction.objects.aggregate(max_id=Max("transactionid"))["max_id"]
+    return {
+        "last_transaction_id": int(max_id or 0),
+        "as_of": today.isoformat(),
+        "updated_at": timezone.now().isoformat(),
+    }
+
+
+def read_watermark():
+    """讀取上次 RFM 更新的水位線；沒有或格式錯誤時回傳 None。"""
+    try:
+        with open(_watermark_path(), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {
+            **data,
+            "last_transaction_id": int(data["last_transaction_id"]),
+            "as_of": data["as_of"],
+        }
+    except Exception:
+        return None
+
+
+def _write_watermark(watermark) -> None:
+    path = _watermark_path()
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(watermark, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _distinct_customers(qs):
+    return {cid for cid in qs.values_list("customerid", flat=True).distinct() if cid is not None}
+
+
+def _affected_customer_ids(last_transaction_id: int, last_as_of: date, today: date):
+    """
+    找出自上次水位線以來 RFM 可能改變的顧客：
+      - 有新交易（transactionID > 水位線）
+      - 交易日落在 [上次計算日, 今天) 之間（上次因 transdate < today 被排除，這次要算進來）
+      - 最近交易日跨過 R 分數級距邊界（單純因為日期往前推）
+      - 加入日落在 [上次計算日, 今天)，這次才被納入計算
+      - 跨月時，上個月註冊的「新顧客」要重新分類
+    """
+    affected = set()
+    affected |= _distinct_customers(Transaction.objects.filter(transactionid__gt=last_transaction_id))
+    affected |= _distinct_customers(
+        Transaction.objects.filter(transdate__gte=last_as_of, transdate__lt=today)
+    )
+
+    for boundary in RECENCY_BOUNDARIES:
+        # recency 從 <= boundary 變成 > boundary 的最近交易日區間
+        window_start = last_as_of - timedelta(days=boundary)
+        window_end = today - timedelta(days=boundary)
+        if window_start >= window_end:
+            continue
+        affected |= _distinct_customers(
+            Transaction.objects.filter(transdate__gte=window_start, transdate__lt=window_end)
+        )
+
+    affected |= set(
+        Customer.objects
+        .filter(customerjoinday__gte=last_as_of, customerjoinday__lt=today)
+        .values_list("customerid", flat=True)
+    )
+
+    this_month_start = today.replace(day=1)
+    last_month_start = last_as_of.replace(day=1)
+    if last_month_start < this_month_start:
+        affected |= set(
+            Customer.objects
+            .filter(customerjoinday__gte=last_month_start, customerjoinday__lt=this_month_start)
+            .values_list("customerid", flat=True)
+        )
+
+    return affected
+
+
+def recalc_rfm_scores_incremental(batch_size: int = DEFAULT_BATCH_SIZE, progress=None):
+    """
+    增量版 RFM 重算：依照上次的水位線（最大 transactionID + 計算日期）
+    只重算受影響的顧客，成本從 O(全部交易) 降到 O(新交易 + 跨級距顧客)。
+
+    沒有水位線（第一次執行）或日期倒退時，自動改跑完整的 recalc_rfm_scores_bulk()。
+    注意：修改或刪除既有交易不會被偵測到，需要時請跑完整重算。
+    """
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+    today = datetime.now().date()
+
+    previous = read_watermark()
+    try:
+        last_as_of = date.fromisoformat(previous["as_of"]) if previous else None
+    except (TypeError, ValueError):
+        last_as_of = None
+    if previous is None or last_as_of is None or last_as_of > today:
+        return recalc_rfm_scores_bulk(batch_size=batch_size, progress=progress)
+
+    timer = _PhaseTimer()
+    this_month_start = today.replace(day=1)
+    watermark = _current_watermark(today)
+
+    with timer.phase("detect") as info:
+        affected = _affected_customer_ids(previous["last_transaction_id"], last_as_of, today)
+        info["rows"] = len(affected)
+
+    with timer.phase("load") as info:
+        customers = []
+        transaction_dict = {}
+        for chunk in _chunks(sorted(affected), batch_size):
+            customers.extend(
+                Customer.objects
+                .filter(customerid__in=chunk, customerjoinday__lt=today)
+                .values_list("customerid", "customerjoinday", "categoryid")
+            )
+            transaction_dict.update(_load_rfm_aggregates(today, customer_ids=chunk))
+        info["rows"] = len(customers) + len(transaction_dict)
+
+    with timer.phase("compute") as info:
+        rows = _compute_rfm_rows(customers, transaction_dict, today, this_month_start)
+        info["rows"] = len(rows)
+
+    with timer.phase("write_rfm") as info:
+        info["rows"] = _upsert_rfm_rows(rows, batch_size, timezone.now(), progress=progress)
+
+    with timer.phase("write_customer") as info:
+        info["rows"] = _update_customer_categories(rows, batch_size)
+
+    _write_watermark(watermark)
+    # 沒有顧客受影響時分數不變，不換版本，避免各種快取白白失效重算
+    if rows:
+        bump_data_version("rfm_incremental")
+    return timer.report(
+        mode="incremental",
+        customers=len(rows),
+        batch_size=batch_size,
+        previous_watermark=previous,
+        watermark=watermark,
+    )
+
+
 def get_rfm_category_distribution(exclude_labels=None):
     """
     Aggregate customer counts per RFM category.
     Labels matching any value in exclude_labels (e.g. '其他') are skipped.
     Returns {"labels": [...], "counts": [...], "total": int}.
     """
-    label_map = {
-        str(cat.categoryid): (cat.customercategory or f"分類{cat.categoryid}")
-        for cat in CustomerCategory.objects.all()
-    }
-    excluded = {label.strip() for label in exclude_labels} if exclude_labels else set()
-
     rows = (
         Customer.objects
         .exclude(categoryid__isnull=True)
@@ -213,13 +699,30 @@ def get_rfm_category_distribution(exclude_labels=None):
         .annotate(count=Count("customerid"))
         .order_by("-count")
     )
+    return build_category_distribution(
+        [(row["categoryid"], row["count"]) for row in rows],
+        exclude_labels=exclude_labels,
+    )
+
+
+def build_category_distribution(category_counts, exclude_labels=None):
+    """
+    把 [(categoryid, count), ...] 轉成 get_rfm_category_distribution 的格式，
+    依人數由多到少排序並套上 CustomerCategory 的名稱（首頁 KPI 也共用這段）。
+    """
+    label_map = {
+        str(cat.categoryid): (cat.customercategory or f"分類{cat.categoryid}")
+        for cat in CustomerCategory.objects.all()
+    }
+    excluded = {label.strip() for label in exclude_labels} if exclude_labels else set()
 
     labels = []
     counts = []
     total = 0
 
-    for row in rows:
-        category_id = row["categoryid"]
+    for category_id, count in sorted(category_counts, key=lambda item: item[1], reverse=True):
+        if category_id is None or category_id == "":
+            continue
         label = label_map.get(str(category_id), str(category_id))
         if not label:
             continue
@@ -227,11 +730,43 @@ def get_rfm_category_distribution(exclude_labels=None):
         if label in excluded:
             continue
         labels.append(label)
-        counts.append(row["count"])
-        total += row["count"]
+        counts.append(count)
+        total += count
 
     return {
         "labels": labels,
         "counts": counts,
         "total": total,
     }
+
+
+def run_rfm_refresh_job(progress=None, incremental: bool = False, batch_size: int = DEFAULT_BATCH_SIZE):
+    """給 job_runner 使用的 RFM 重算作業，回傳計時報告。"""
+    if incremental:
+        report = recalc_rfm_scores_incremental(batch_size=batch_size, progress=progress)
+    else:
+        report = recalc_rfm_scores_bulk(batch_size=batch_size, progress=progress)
+    print(format_rfm_report(report))
+
+    # 順便把新進的交易明細併入顧客 × 商品類別偏好表；失敗不影響 RFM 結果
+    try:
+        if incremental:
+            report["category_affinity"] = update_category_affinity(batch_size=batch_size)
+        else:
+            report["category_affinity"] = rebuild_category_affinity(batch_size=batch_size)
+    except Exception as exc:
+        print(f"Category affinity update failed: {exc}")
+    return report
+
+
+def schedule_rfm_refresh(incremental: bool = False):
+    """
+    排入背景 RFM 重算，回傳 (作業狀態, 是否為新建立)。
+    完整重算排隊或執行中時，增量重算直接共用它（完整重算已涵蓋增量）。
+    """
+    if incremental:
+        full_job = active_job(RFM_REFRESH_JOB)
+        if full_job:
+            return full_job, False
+    kind = RFM_INCREMENTAL_JOB if incremental else RFM_REFRESH_JOB
+    return submit_job(kind, run_rfm_refresh_job, run_lock=RFM_RUN_LOCK, incremental=incremental)
@@ -0,0 +1,12 @@
+# myCRM/services/sql_utils.py
+"""
+手寫 SQL 共用的小工具：欄位名稱一律由 model 的 db_column 取得並加上引號，
+不把實際的欄位大小寫寫死在 SQL 裡。
+"""
+from __future__ import annotations
+
+from django.db import connection
+
+
+def quote_column(model, field_name: str) -> str:
+    return connection.ops.quote_name(model._meta.get_field(field_name).column)
@@ -0,0 +1,217 @@
+# myCRM/services/transaction_store.py
+"""
+transaction 表的程序內欄位快照（CRM_TRANSACTION_STORE=True 時各分析服務改用它，不再重查 transaction）：
+- 第一次使用時整表載入成 NumPy 陣列：顧客ID、交易日（date.toordinal()）、金額、交易編號，
+  依「顧客、日期、交易編號」排序，並以 CSR 方式記錄每位顧客的列範圍（offsets）
+- 之後只讀取 transactionID 大於快照最大值的新交易併入；
+  修改 / 刪除既有交易偵測不到，所以每 CRM_TRANSACTION_STORE_FULL_RELOAD_SECONDS 秒整表重載一次
+- transaction_store_report() 回報各陣列佔用的記憶體
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from myCRM.models import Transaction
+
+from .data_version import max_transaction_id
+
+logger = logging.getLogger(__name__)
+
+_LOAD_CHUNK_SIZE = 20000
+
+
+class TransactionSnapshot:
+    """
+    唯讀的交易欄位快照：
+      customer_ids[k]                 第 k 位顧客的 ID（遞增）
+      offsets[k]:offsets[k+1]         該顧客的交易在下列陣列中的範圍
+      transaction_ids / days / prices 每筆交易一列，days 為 date.toordinal()
+      row_customer                    每一列屬於第幾位顧客（給 np.bincount 分組用）
+    """
+
+    def __init__(self, customer_per_row: np.ndarray, days: np.ndarray, prices: np.ndarray, transaction_ids: np.ndarray):
+        order = np.lexsort((transaction_ids, days, customer_per_row))
+        cids = customer_per_row[order]
+        self.transaction_ids = np.ascontiguousarray(transaction_ids[order], dtype=np.int64)
+        self.days = np.ascontiguousarray(days[order], dtype=np.int32)
+        self.prices = np.ascontiguousarray(prices[order], dtype=np.float64)
+
+        self.customer_ids, starts = np.unique(cids, return_index=True)
+        self.customer_ids = self.customer_ids.astype(np.int64)
+        self.offsets = np.append(starts, len(cids)).astype(np.int64)
+        self.row_customer = np.repeat(
+            np.arange(len(self.customer_ids), dtype=np.int32), np.diff(self.offsets)
+        )
+        self.max_transaction_id = int(self.transaction_ids.max()) if len(self.transaction_ids) else 0
+
+    @property
+    def rows(self) -> int:
+        return len(self.days)
+
+    @property
+    def customers(self) -> int:
+        return len(self.customer_ids)
+
+    def customer_mask(self, customer_ids: Iterable[int]) -> np.ndarray:
+        """每位顧客是否在 customer_ids 內（長度 = customers）"""
+        wanted = np.fromiter((int(c) for c in customer_ids if c is not None), dtype=np.int64)
+        return np.isin(self.customer_ids, wanted)
+
+    def customer_rows(self, customer_id: int) -> slice:
+        k = int(np.searchsorted(self.customer_ids, int(customer_id)))
+        if k >= self.customers or self.customer_ids[k] != int(customer_id):
+            return slice(0, 0)
+        return slice(int(self.offsets[k]), int(self.offsets[k + 1]))
+
+    def day_mask(self, start: Optional[date] = None, end: Optional[date] = None, end_inclusive: bool = True) -> np.ndarray:
+        """start <= 交易日 <= end（end_inclusive=False 時 < end）的列"""
+        mask = np.ones(self.rows, dtype=bool)
+        if start is not None:
+            mask &= self.days >= start.toordinal()
+        if end is not None:
+            mask &= (self.days <= end.toordinal()) if end_inclusive else (self.days < end.toordinal())
+        return mask
+
+    def count_by_customer(self, mask: np.ndarray) -> np.ndarray:
+        return np.bincount(self.row_customer[mask], minlength=self.customers)
+
+    def sum_by_customer(self, mask: np.ndarray) -> np.ndarray:
+        return np.bincount(self.row_customer[mask], weights=self.prices[mask], minlength=self.customers)
+
+    def last_day_by_customer(self, mask: np.ndarray) -> np.ndarray:
+        """每位顧客在 mask 內最後一筆交易的 ordinal 日期，沒有時為 0"""
+        last = np.zeros(self.customers, dtype=np.int64)
+        rows = np.flatnonzero(mask)
+        if rows.size:
+            groups = self.row_customer[rows]
+            boundaries = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+            last[groups[boundaries]] = np.maximum.reduceat(self.days[rows].astype(np.int64), boundaries)
+        return last
+
+    def nbytes(self) -> Dict[str, int]:
+        arrays = ("customer_ids", "offsets", "row_customer", "transaction_ids", "days", "prices")
+        return {name: int(getattr(self, name).nbytes) for name in arrays}
+
+
+_state: Dict[str, Any] = {"snapshot": None, "full_loaded_at": 0.0, "refreshed_at": 0.0, "full_loads": 0, "increments": 0}
+_lock = threading.Lock()
+
+
+def transaction_store_enabled() -> bool:
+    return bool(getattr(settings, "CRM_TRANSACTION_STORE", False))
+
+
+def _load_rows(after_transaction_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    qs = Transaction.objects.filter(customerid__isnull=False, transdate__isnull=False)
+    if after_transaction_id is not None:
+        qs = qs.filter(transactionid__gt=after_transaction_id)
+
+    cids, days, prices, txn_ids = [], [], [], []
+    for txn_id, cid, trans_date, price in qs.values_list(
+        "transactionid", "customerid", "transdate", "totalprice"
+    ).iterator(chunk_size=_LOAD_CHUNK_SIZE):
+        if isinstance(trans_date, datetime):
+            trans_date = trans_date.date()
+        txn_ids.append(txn_id)
+        cids.append(cid)
+        days.append(trans_date.toordinal())
+        prices.append(float(price or 0))
+
+    return (
+        np.asarray(cids, dtype=np.int64),
+        np.asarray(days, dtype=np.int32),
+        np.asarray(prices, dtype=np.float64),
+        np.asarray(txn_ids, dtype=np.int64),
+    )
+
+
+def refresh_transaction_store(full: bool = False) -> TransactionSnapshot:
+    """整表重載（full=True 或尚未載入）或只併入新交易，回傳新的快照。"""
+    with _lock:
+        return _refresh_locked(full)
+
+
+def _refresh_locked(full: bool) -> TransactionSnapshot:
+    snapshot: Optional[TransactionSnapshot] = _state["snapshot"]
+    start = time.perf_counter()
+    # 先記下目前的最大交易ID：customerID 為空而沒載入的交易不會每次都觸發重讀
+    probed_max_id = max_transaction_id()
+
+    if full or snapshot is None:
+        snapshot = TransactionSnapshot(*_load_rows())
+        _state["full_loaded_at"] = time.time()
+        _state["full_loads"] += 1
+        logger.info(
+            "Loaded transaction store: %s rows, %s customers, %.1f MB in %.3fs",
+            snapshot.rows, snapshot.customers, sum(snapshot.nbytes().values()) / 2**20, time.perf_counter() - start,
+        )
+    else:
+        cids, days, prices, txn_ids = _load_rows(after_transaction_id=snapshot.max_transaction_id)
+        if len(txn_ids):
+            snapshot = TransactionSnapshot(
+                np.concatenate([snapshot.customer_ids[snapshot.row_customer], cids]),
+                np.concatenate([snapshot.days, days]),
+                np.concatenate([snapshot.prices, prices]),
+                np.concatenate([snapshot.transaction_ids, txn_ids]),
+            )
+            _state["increments"] += 1
+            logger.info("Merged %s new transactions into store in %.3fs", len(txn_ids), time.perf_counter() - start)
+
+    snapshot.max_transaction_id = max(snapshot.max_transaction_id, probed_max_id)
+    _state["snapshot"] = snapshot
+    _state["refreshed_at"] = time.time()
+    return snapshot
+
+
+def get_transaction_store() -> TransactionSnapshot:
+    """
+    取得最新的交易快照：第一次呼叫時整表載入；
+    之後 transaction 最大 ID 變大時只併入新交易，超過重載間隔時整表重載。
+    """
+    snapshot: Optional[TransactionSnapshot] = _state["snapshot"]
+    max_age = float(getattr(settings, "CRM_TRANSACTION_STORE_FULL_RELOAD_SECONDS", 3600))
+    needs_full = snapshot is None or (max_age > 0 and time.time() - _state["full_loaded_at"] > max_age)
+    if not needs_full and max_transaction_id() <= snapshot.max_transaction_id:
+        return snapshot
+
+    with _lock:
+        # 等鎖期間可能已有其他執行緒更新完成
+        snapshot = _state["snapshot"]
+        needs_full = snapshot is None or (max_age > 0 and time.time() - _state["full_loaded_at"] > max_age)
+        if not needs_full and max_transaction_id() <= snapshot.max_transaction_id:
+            return snapshot
+        return _refresh_locked(full=needs_full)
+
+
+def transaction_store_report() -> Dict[str, Any]:
+    """快照的大小與記憶體用量；尚未載入時 loaded=False。"""
+    snapshot: Optional[TransactionSnapshot] = _state["snapshot"]
+    report: Dict[str, Any] = {
+        "enabled": transaction_store_enabled(),
+        "loaded": snapshot is not None,
+        "full_loads": _state["full_loads"],
+        "increments": _state["increments"],
+    }
+    if snapshot is None:
+        return report
+
+    nbytes = snapshot.nbytes()
+    report.update({
+        "rows": snapshot.rows,
+        "customers": snapshot.customers,
+        "max_transaction_id": snapshot.max_transaction_id,
+        "bytes": nbytes,
+        "total_bytes": sum(nbytes.values()),
+        "total_mb": round(sum(nbytes.values()) / 2**20, 2),
+        "bytes_per_row": round(sum(nbytes.values()) / snapshot.rows, 1) if snapshot.rows else 0,
+        "full_loaded_at": _state["full_loaded_at"],
+        "refreshed_at": _state["refreshed_at"],
+    })
+    return report
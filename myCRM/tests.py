@@ -1,3 +1,258 @@
-from django.test import TestCase
+import itertools
+from datetime import date
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from myCRM.services import llm_cache
+from myCRM.services.activity_engine import ActivityIndex
+from myCRM.services.activity_list import SORT_OPTIONS, InvalidCursor, decode_cursor, encode_cursor
+from myCRM.services.category_affinity import build_affinity_rows
+from myCRM.services.customerActivityRate import _bucket_activity_counts, _get_time_periods
+from myCRM.services.customer_profile import classify_category_needs
+from myCRM.services.next_purchse import build_purchase_features
+from myCRM.services.rfm_count import (
+    classify_customer,
+    classify_customers_array,
+    rfm_score_from_raw,
+    rfm_scores_from_raw_array,
+)
+
+
+class VectorizedRfmScoringTests(SimpleTestCase):
+    """向量化 RFM 計分 / 分類必須與純量版逐筆完全一致。"""
+
+    def test_scores_match_scalar(self):
+        recency_values = list(range(-5, 200)) + [10**9]
+        frequency_values = list(range(0, 25))
+        monetary_values = [
+            0, 0.01, 99, 99.99, 100, 100.5, 499.99, 500, 1999.99, 2000,
+            2499.99, 2500, 2500.01, 10**7, -1, float("nan"),
+        ]
+        rng = np.random.default_rng(42)
+        monetary_values += rng.uniform(0, 5000, size=50).tolist()
+
+        grid = list(itertools.product(recency_values, frequency_values, monetary_values))
+        recency = np.array([g[0] for g in grid], dtype=np.int64)
+        frequency = np.array([g[1] for g in grid], dtype=np.int64)
+        monetary = np.array([g[2] for g in grid], dtype=np.float64)
+
+        r, f, m = rfm_scores_from_raw_array(recency, frequency, monetary)
+        expected = np.array([rfm_score_from_raw(*g) for g in grid], dtype=np.int64)
+
+        np.testing.assert_array_equal(r, expected[:, 0])
+        np.testing.assert_array_equal(f, expected[:, 1])
+        np.testing.assert_array_equal(m, expected[:, 2])
+
+    def test_classification_matches_scalar(self):
+        grid = list(itertools.product(range(0, 6), repeat=3))
+        r = np.array([g[0] for g in grid])
+        f = np.array([g[1] for g in grid])
+        m = np.array([g[2] for g in grid])
+
+        expected = np.array([classify_customer(*g) for g in grid], dtype=np.int64)
+        np.testing.assert_array_equal(classify_customers_array(r, f, m), expected)
+
+    def test_empty_input(self):
+        r, f, m = rfm_scores_from_raw_array([], [], [])
+        self.assertEqual(len(r), 0)
+        self.assertEqual(len(classify_customers_array(r, f, m)), 0)
+
+
+def _naive_sequence(intervals, prices, pad_interval, pad_price, length):
+    """逐步計算的參考版本（舊的 Python 迴圈寫法）"""
+    seq_intervals = intervals[-length:] if intervals else []
+    seq_prices = prices[-length:] if prices else []
+    pad_len = length - len(seq_intervals)
+    seq_intervals = [pad_interval] * pad_len + list(seq_intervals)
+    seq_prices = [pad_price] * pad_len + list(seq_prices)
+    return [
+        [
+            seq_intervals[i],
+            seq_prices[i],
+            i + 1,
+            sum(seq_prices[:i + 1]),
+            float(np.mean(seq_intervals[:i + 1])),
+            float(np.mean(seq_prices[:i + 1])),
+        ]
+        for i in range(length)
+    ]
+
+
+class PurchaseFeatureBuilderTests(SimpleTestCase):
+    """向量化的下次購買特徵必須與逐筆計算的結果一致（訓練 / 推論兩種模式）。"""
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        counts = [2, 3, 4, 11, 12, 25]
+        self.starts = np.cumsum([0] + counts[:-1])
+        self.ends = self.starts + np.array(counts)
+        self.days = np.concatenate([np.cumsum(rng.integers(0, 40, size=n)) + 700000 for n in counts])
+        self.prices = rng.uniform(0, 3000, size=sum(counts)).round(2)
+
+    def _history(self, i):
+        days = self.days[self.starts[i]:self.ends[i]].tolist()
+        prices = self.prices[self.starts[i]:self.ends[i]].tolist()
+        return np.diff(days).astype(float).tolist(), prices[:-1]
+
+    def test_training_features(self):
+        length = 10
+        built = build_purchase_features(self.days, self.prices, self.starts, self.ends, length, training=True)
+        self.assertEqual(built["features"].dtype, np.float32)
+        for i in range(len(self.starts)):
+            intervals, prices = self._history(i)
+            window_intervals = intervals[:-1][-length:]
+            window_prices = prices[:-1][-length:]
+            pad_interval = float(np.mean(intervals[:-1])) if len(intervals) > 1 else intervals[0]
+            pad_price = float(np.mean(window_prices)) if window_prices else 0.0
+            expected = _naive_sequence(window_intervals, window_prices, pad_interval, pad_price, length)
+            np.testing.assert_allclose(built["features"][i], expected, rtol=1e-6)
+            self.assertEqual(built["targets"][i], intervals[-1])
+
+    def test_inference_features(self):
+        length = 10
+        built = build_purchase_features(self.days, self.prices, self.starts, self.ends, length, training=False)
+        self.assertIsNone(built["targets"])
+        for i in range(len(self.starts)):
+            intervals, prices = self._history(i)
+            expected = _naive_sequence(
+                intervals, prices, float(np.mean(intervals)), float(np.mean(prices)), length,
+            )
+            np.testing.assert_allclose(built["features"][i], expected, rtol=1e-6)
+            self.assertAlmostEqual(built["avg_interval"][i], float(np.mean(intervals)))
+
+
+class LlmCacheTests(SimpleTestCase):
+    """ChatGPT 回覆快取：key 只看提示詞內容，超過上限時淘汰最久沒用到的。"""
+
+    def setUp(self):
+        llm_cache.clear_llm_cache()
+
+    def test_key_depends_on_prompt(self):
+        messages = [{"role": "system", "content": "客群 1"}, {"role": "user", "content": "建議？"}]
+        key = llm_cache.make_key("gpt-4o-mini", messages, 0.7, 1500)
+        self.assertEqual(key, llm_cache.make_key("gpt-4o-mini", [dict(m) for m in messages], 0.7, 1500))
+        self.assertNotEqual(key, llm_cache.make_key("gpt-4o-mini", messages, 0.2, 1500))
+        self.assertNotEqual(key, llm_cache.make_key("gpt-4o", messages, 0.7, 1500))
+
+    @override_settings(CRM_LLM_CACHE_MAX_ENTRIES=2, CRM_LLM_CACHE_TTL=60)
+    def test_lru_eviction(self):
+        llm_cache.store_reply("a", "A")
+        llm_cache.store_reply("b", "B")
+        self.assertEqual(llm_cache.get_cached_reply("a"), "A")  # a 變成最近使用
+        llm_cache.store_reply("c", "C")
+
+        self.assertIsNone(llm_cache.get_cached_reply("b"))
+        self.assertEqual(llm_cache.get_cached_reply("a"), "A")
+        self.assertEqual(llm_cache.get_cached_reply("c"), "C")
+        stats = llm_cache.llm_cache_stats()
+        self.assertEqual((stats["evictions"], stats["entries"]), (1, 2))
+
+    @override_settings(CRM_LLM_CACHE_TTL=0)
+    def test_disabled_when_ttl_zero(self):
+        llm_cache.store_reply("a", "A")
+        self.assertIsNone(llm_cache.get_cached_reply("a"))
+
+
+class CategoryNeedsTests(SimpleTestCase):
+    """剛需品 / 彈性需求品的分類門檻"""
+
+    def test_classification(self):
+        stats = [
+            {"name": "生鮮", "count": 6, "total_amount": 300},
+            {"name": "家電", "count": 1, "total_amount": 5000},
+            {"name": "文具", "count": 3, "total_amount": 30},
+            {"name": "零食", "count": 30, "total_amount": 600},
+        ]
+        essential, flexible = classify_category_needs(stats)
+        # 家電金額佔比高但只買 1 次；文具次數夠但佔比太低
+        self.assertEqual([item["name"] for item in essential], ["零食"])
+        self.assertEqual([item["name"] for item in flexible], ["生鮮", "文具", "家電"])
+        self.assertEqual(essential[0]["frequency"], "75.0%")
+
+    def test_empty(self):
+        self.assertEqual(classify_category_needs([]), ([], []))
+
+
+class AffinityRowsTests(SimpleTestCase):
+    """偏好表列的佔比與剛需判斷"""
+
+    def test_shares_per_customer(self):
+        aggregates = [
+            # (顧客, 商品類別原始值, 件數, 明細筆數, 數量, 金額, 最大交易ID)
+            (1, "1", 8, 6, 7, 400, 10),
+            (1, "01", 2, 2, 2, 100, 12),  # 同一類別的不同寫法合併
+            (1, "2", 10, 10, 10, 500, 11),
+            (1, "x", 5, 5, 5, 50, 9),  # 無法辨識的類別略過
+            (2, "2", 1, 1, 0, 0, 3),
+        ]
+        rows = {(r.customerid, r.productcategoryid): r for r in build_affinity_rows(aggregates)}
+        self.assertEqual(sorted(rows), [(1, 1), (1, 2), (2, 2)])
+
+        merged = rows[(1, 1)]
+        self.assertEqual((merged.purchasecount, merged.subtotal, merged.lasttransactionid), (10, 500, 12))
+        self.assertAlmostEqual(merged.countshare, 0.5)
+        self.assertAlmostEqual(merged.amountshare, 0.5)
+        self.assertTrue(merged.isessential)
+        # 只買過 1 件，佔比再高也不是剛需
+        self.assertFalse(rows[(2, 2)].isessential)
+        self.assertEqual(rows[(2, 2)].amountshare, 0)
+
+
+class ActivityCursorTests(SimpleTestCase):
+    """活躍度列表 keyset 分頁的 cursor"""
+
+    def test_round_trip(self):
+        ordering = SORT_OPTIONS["level"]
+        values = [1, date(2025, 3, 4), 5, 42]
+        self.assertEqual(decode_cursor(encode_cursor(values), ordering), values)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not-a-cursor", SORT_OPTIONS["level"])
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor([1, 2]), SORT_OPTIONS["level"])
+
+
+class ActivityBucketTests(SimpleTestCase):
+    """活躍度：日期分組的數量分到各周"""
+
+    def test_weekly_buckets(self):
+        as_of = date(2025, 3, 12)  # 週三
+        periods = _get_time_periods("week", 2, as_of)  # 3/3~3/9、3/10~3/12
+        joined = {date(2025, 1, 1): 10, date(2025, 3, 4): 2, date(2025, 3, 11): 1}
+        last_buy = {date(2025, 3, 5): 4, date(2025, 3, 12): 3, date(2025, 2, 1): 9}
+        # 3/5 最近購買、3/11 才加入：第一周不算它
+        joined_later = [(date(2025, 3, 5), date(2025, 3, 11))]
+
+        totals, active = _bucket_activity_counts(periods, (joined, last_buy, joined_later))
+        self.assertEqual(totals, [12, 13])
+        self.assertEqual(active, [3, 3])
+
+
+class ActivityIndexTests(SimpleTestCase):
+    """活躍度 bitset：任意區間的不同顧客數"""
+
+    def test_counts_match_distinct_customers(self):
+        rows = [
+            (1, date(2025, 1, 15)), (1, date(2025, 5, 2)), (2, date(2025, 3, 31)),
+            (3, date(2025, 4, 1)), (3, date(2025, 4, 1)), (4, date(2024, 12, 30)),
+        ]
+        index = ActivityIndex(
+            np.array([cid for cid, _ in rows]),
+            np.array([d.toordinal() for _, d in rows]),
+            {1: date(2024, 1, 1).toordinal(), 2: date(2025, 4, 10).toordinal(), 3: date(2024, 6, 1).toordinal()},
+        )
+        ranges = [
+            (date(2025, 1, 1), date(2025, 3, 31)),   # 完整一季
+            (date(2024, 12, 30), date(2025, 4, 1)),  # 前後各有零碎天數
+            (date(2025, 4, 2), date(2025, 4, 30)),
+            (date(2024, 12, 1), date(2025, 6, 30)),
+        ]
+        for start, end in ranges:
+            expected = {cid for cid, d in rows if start <= d <= end}
+            self.assertEqual(set(index.active_customer_ids(start, end).tolist()), expected)
+            self.assertEqual(index.count_active(start, end), len(expected))
+        # 2 號 4/10 才加入、4 號沒有加入日
+        self.assertEqual(index.count_active(date(2024, 12, 1), date(2025, 3, 31), joined_by=date(2025, 3, 31)), 1)
 
-# Create your tests here.
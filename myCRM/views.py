@@ -1,36 +1,42 @@
 ﻿from __future__ import annotations
 import json
 import numpy as np
-from collections import defaultdict
 from django.http import HttpResponse, JsonResponse
 from django.contrib import messages
 from django.utils import timezone
 
-from .services.churn_service import predict_churn, train_churn_model
+from .services.churn_service import train_churn_model, churn_model_info, predict_churn_for_customer
+from .services.churn_store import (
+  MAX_WINDOW_DAYS,
+  MIN_WINDOW_DAYS,
+  churn_store_info,
+  get_churn_scores,
+  schedule_churn_refresh,
+)
 from .services.next_purchse import (
     train_next_purchase_model,
     predict_next_purchase_time,
     predict_next_purchase_batch,
 )
-from .services.customerActivityRate import get_customer_activity
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from myCRM.models import (
   Transaction,
-  TransactionDetail,
-  Product,
   Customer,
   CustomerCategory,
-  ProductCategory,
+  RFMscore,
 )
-from django.db.models import Count, Sum, Max,Q
+from django.db.models import Sum
 from datetime import datetime, timedelta
 from .services.login import authenticate_user
 from .services.login import create_user
 #from .services.customerActivityRate import get_customer_growth
-from .services.rfm_count import recalc_rfm_scores, get_rfm_category_distribution
+from .services.customer_profile import load_customer_profile
+from .services.activity_list import DEFAULT_PAGE_SIZE as ACTIVITY_DEFAULT_PAGE_SIZE, InvalidCursor, get_activity_page, level_counts
+from .services.rfm_count import RFM_INCREMENTAL_JOB, RFM_REFRESH_JOB, schedule_rfm_refresh
+from .services.job_runner import ACTIVE_STATUSES, get_job, latest_job
 from django.views.decorators.http import require_POST, require_GET
-from .services.basicRate import calculate_CRR, calculate_RPR, calculate_vip_ratio, calculate_allCus
+from .services.dashboard_cache import get_dashboard_snapshot
 from .services.customerActivityRate import get_customer_growth
 
 
@@ -62,40 +68,19 @@ def index_view(request):
     if not request.session.get('user_id'):
         return redirect('login')
 
-    # === 顧客留存率 CRR ===
-    try:
-        crr_raw = calculate_CRR()
-    except Exception:
-        crr_raw = None
-    crr_value, crr_display = _format_rate(crr_raw)
+    # === 首頁 KPI（CRR、RPR、高價值佔比、總顧客數、分群分布、活躍度）===
+    # 讀快取快照，資料版本變動時先回舊快照並在背景重算
+    # 可以排除「其他客戶」，也可以傳空陣列就全部顯示
+    kpis = get_dashboard_snapshot(exclude_labels=["其他客戶"])["kpis"]
 
-    # === 顧客回購率 RPR ===
-    try:
-        rpr_raw = calculate_RPR()
-    except Exception:
-        rpr_raw = None
-    rpr_value, rpr_display = _format_rate(rpr_raw)
-
-    # === 高價值顧客佔比 ===
-    try:
-        vip_raw = calculate_vip_ratio()
-    except Exception:
-        vip_raw = None
-    vip_value, vip_display = _format_rate(vip_raw)
-
-    # === 總顧客數 ===
-    try:
-        total_customers = calculate_allCus() or 0
-    except Exception:
-        total_customers = 0
+    crr_value, crr_display = _format_rate(kpis["crr"])
+    rpr_value, rpr_display = _format_rate(kpis["rpr"])
+    vip_value, vip_display = _format_rate(kpis["vip_ratio"])
+    total_customers = kpis["total_customers"] or 0
 
     # === 圓餅圖：RFM 分群分布 ===
-    try:
-        # 可以排除「其他客戶」，也可以傳空陣列就全部顯示
-        dist = get_rfm_category_distribution(exclude_labels=["其他客戶"])
-        # dist = {"labels": [...], "counts": [...], "total": n}
-    except Exception:
-        dist = {"labels": [], "counts": [], "total": 0}
+    # dist = {"labels": [...], "counts": [...], "total": n}
+    dist = kpis["distribution"]
 
     label_to_count = {
         label: count
@@ -115,25 +100,19 @@ def index_view(request):
 
     segments = [label_to_count.get(lbl, 0) for lbl in desired_labels]
 
-    # 取得季度和週活躍度數據
-    try:
-        quarter_activity = get_customer_activity(period="quarter", points=4)
-        week_activity = get_customer_activity(period="week", points=4)
-    except Exception as e:
-        print(f"活躍度計算錯誤: {e}")
-        # 預設值
-        quarter_activity = {
-            "labels": ["Q1", "Q2", "Q3", "Q4"],
-            "activity_rates": [0, 0, 0, 0],
-            "active_customers": [0, 0, 0, 0],
-            "total_customers": [0, 0, 0, 0]
-        }
-        week_activity = {
-            "labels": ["第1周", "第2周", "第3周", "第4周"],
-            "activity_rates": [0, 0, 0, 0],
-            "active_customers": [0, 0, 0, 0],
-            "total_customers": [0, 0, 0, 0]
-        }
+    # 取得季度和週活躍度數據（計算失敗時使用預設值）
+    quarter_activity = kpis["quarter_activity"] or {
+        "labels": ["Q1", "Q2", "Q3", "Q4"],
+        "activity_rates": [0, 0, 0, 0],
+        "active_customers": [0, 0, 0, 0],
+        "total_customers": [0, 0, 0, 0]
+    }
+    week_activity = kpis["week_activity"] or {
+        "labels": ["第1周", "第2周", "第3周", "第4周"],
+        "activity_rates": [0, 0, 0, 0],
+        "active_customers": [0, 0, 0, 0],
+        "total_customers": [0, 0, 0, 0]
+    }
 
     #  丟給前端 JS 用的資料
     dashboard_data = {
@@ -175,9 +154,13 @@ def history_view(request):
 # rfm分數計算
 def calculate_rfm(request):
   """
-  呼叫 service 重新計算 RFM，然後把結果丟到 rfm.html 顯示。
+  排入背景完整重算 RFM（與其他 RFM 重算互斥），rfm.html 先顯示目前的分數。
   """
-  transactions = recalc_rfm_scores()
+  try:
+    schedule_rfm_refresh(incremental=False)
+  except Exception as exc:
+    messages.error(request, f"RFM 更新失敗: {exc}")
+  transactions = RFMscore.objects.all()
   return render(request, 'rfm.html', {'transactions': transactions})
 
 
@@ -263,20 +246,51 @@ def churn_predictions(request):
     window_days = int(request.GET.get('window_days', 365))
   except Exception:
     window_days = 365
+  window_days = min(max(window_days, MIN_WINDOW_DAYS), MAX_WINDOW_DAYS)
 
   as_of = request.GET.get('as_of')  # ISO 格式 yyyy-mm-dd，可選
+  # 預設讀取預先計算的流失分數，?rescore=1 才即時重新評分
+  rescore = request.GET.get('rescore', 'false').lower() in ('1', 'true', 'yes', 'y')
 
   try:
     # 如果 predict_churn 有支援 use_recency，可以改成傳入 use_recency=use_recency
-    results = predict_churn(as_of=as_of, window_days=window_days)
+    results = get_churn_scores(as_of=as_of, window_days=window_days, rescore=rescore)
     return JsonResponse({
       "count": len(results),
+      "model": churn_model_info(),
+      "store": None if rescore else churn_store_info(window_days),
       "results": results
     }, json_dumps_params={"ensure_ascii": False})
   except Exception as e:
     return JsonResponse({"error": str(e)}, status=500)
 
 
+def churn_single(request):
+  """API：單一客戶的流失預測（只查該客戶的交易）"""
+  customer_id = request.GET.get('customer_id')
+
+  if not customer_id:
+    return JsonResponse({"error": "缺少 customer_id 參數"}, status=400)
+
+  try:
+    customer_id = int(customer_id)
+  except ValueError:
+    return JsonResponse({"error": "customer_id 必須是數字"}, status=400)
+
+  try:
+    window_days = int(request.GET.get('window_days', 365))
+  except Exception:
+    window_days = 365
+
+  try:
+    result = predict_churn_for_customer(customer_id, as_of=request.GET.get('as_of'), window_days=window_days)
+    return JsonResponse(result, json_dumps_params={"ensure_ascii": False})
+  except ValueError as e:
+    return JsonResponse({"error": str(e)}, status=404)
+  except Exception as e:
+    return JsonResponse({"error": str(e)}, status=500)
+
+
 def churn_train(request):
   try:
     window_days = int(request.GET.get('window_days', 365))
@@ -302,6 +316,9 @@ def churn_train(request):
       learning_rate=learning_rate,
       use_recency=use_recency,
     )
+    # 模型更新後在背景重新計算流失分數快照
+    if info.get("samples_total"):
+      info["scoring_job_id"] = schedule_churn_refresh()
     return JsonResponse(info, json_dumps_params={"ensure_ascii": False})
   except Exception as e:
     return JsonResponse({"error": str(e)}, status=500)
@@ -348,160 +365,11 @@ def customer_page(request):
     return render(request, "customer.html", {"member": None})
 
   try:
-    customer = Customer.objects.get(customerid=member_id_int)
-  except Customer.DoesNotExist:
-    return render(request, "customer.html", {"member": None})
-
-  customer_category_name = "未分級"
-  if customer.categoryid is not None:
-    category = CustomerCategory.objects.filter(categoryid=customer.categoryid).first()
-    if category and category.customercategory:
-      customer_category_name = category.customercategory
-
-  transactions_qs = Transaction.objects.filter(customerid=customer.customerid).order_by("-transdate")
-  total_spending = transactions_qs.aggregate(total=Sum("totalprice")).get("total") or 0
-  transactions = list(transactions_qs)
-  transaction_ids = [t.transactionid for t in transactions if t.transactionid is not None]
-
-  detail_map: dict[int, list[str]] = defaultdict(list)
-  if transaction_ids:
-    details = list(TransactionDetail.objects.filter(transactionid__in=transaction_ids))
-    product_ids = {d.productid for d in details if d.productid is not None}
-    product_lookup = {}
-    if product_ids:
-      product_lookup = {
-        p.productid: (p.productname or f"商品 {p.productid}")
-        for p in Product.objects.filter(productid__in=product_ids)
-      }
-
-    for detail in details:
-      item_name = product_lookup.get(detail.productid)
-      if not item_name:
-        item_name = f"商品 {detail.productid}" if detail.productid else "未知商品"
-      if detail.transactionid is not None:
-        detail_map[detail.transactionid].append(item_name)
-
-  # 收集產品類別統計
-  category_stats = {}
-  if transaction_ids:
-    # 取得所有交易明細中的產品 ID
-    product_ids_list = list(product_ids) if product_ids else []
-    
-    if product_ids_list:
-      # 查詢產品及其類別資訊
-      products_with_categories = Product.objects.filter(
-        productid__in=product_ids_list
-      ).values('productid', 'productname', 'categoryid')
-      
-      # 建立類別ID到類別名稱的映射
-      category_ids = set()
-      for product in products_with_categories:
-        if product['categoryid']:
-          try:
-            category_ids.add(int(product['categoryid']))
-          except (ValueError, TypeError):
-            pass
-      
-      # 查詢產品類別名稱
-      category_lookup = {}
-      if category_ids:
-        categories = ProductCategory.objects.filter(categoryid__in=category_ids)
-        for cat in categories:
-          # 確保使用實際的 categoryname，如果為空則使用 ID
-          display_name = cat.categoryname
-          if display_name and display_name.strip():
-            category_lookup[cat.categoryid] = display_name.strip()
-          else:
-            category_lookup[cat.categoryid] = f"類別 {cat.categoryid}"
-      
-      # 統計每個類別的購買次數和總金額
-      for detail in details:
-        if detail.productid in product_ids:
-          product_info = next(
-            (p for p in products_with_categories if p['productid'] == detail.productid),
-            None
-          )
-          if product_info and product_info['categoryid']:
-            try:
-              category_id = int(product_info['categoryid'])
-              productCategory_name = category_lookup.get(category_id, f"類別 {category_id}")
-              
-              if productCategory_name not in category_stats:
-                category_stats[productCategory_name] = {
-                  'name': productCategory_name,
-                  'count': 0,
-                  'total_amount': 0
-                }
-              category_stats[productCategory_name]['count'] += (detail.quantity or 1)
-              category_stats[productCategory_name]['total_amount'] += (detail.subtotal or 0)
-            except (ValueError, TypeError):
-              # 如果 categoryid 無法轉換為整數，跳過
-              pass
-
-  # 分析剛需品和彈性需求品
-  essential_items = []
-  flexible_items = []
-  
-  if category_stats:
-    # 計算總購買次數和總金額
-    total_purchases = sum(cat['count'] for cat in category_stats.values())
-    total_amount_spent = sum(cat['total_amount'] for cat in category_stats.values())
-    
-    for category_name, stats in category_stats.items():
-      # 計算購買頻率（次數佔比）
-      purchase_frequency = stats['count'] / total_purchases if total_purchases > 0 else 0
-      # 計算金額佔比
-      amount_ratio = stats['total_amount'] / total_amount_spent if total_amount_spent > 0 else 0
-      
-      # 剛需品判斷條件：
-      # 1. 購買頻率 >= 20% (經常購買)
-      # 2. 或者金額佔比 >= 15% (重要支出)
-      # 3. 購買次數 >= 3 次 (有一定規律性)
-      if (purchase_frequency >= 0.2 or amount_ratio >= 0.15) and stats['count'] >= 3:
-        essential_items.append({
-          'name': category_name,
-          'count': stats['count'],
-          'total_amount': stats['total_amount'],
-          'frequency': f"{purchase_frequency:.1%}",
-          'amount_ratio': f"{amount_ratio:.1%}"
-        })
-      else:
-        # 彈性需求品：購買頻率較低或金額佔比較小的商品
-        flexible_items.append({
-          'name': category_name,
-          'count': stats['count'],
-          'total_amount': stats['total_amount'],
-          'frequency': f"{purchase_frequency:.1%}",
-          'amount_ratio': f"{amount_ratio:.1%}"
-        })
-    
-    # 按購買次數排序
-    essential_items.sort(key=lambda x: x['count'], reverse=True)
-    flexible_items.sort(key=lambda x: x['count'], reverse=True)
-
-  consumptions = []
-  for txn in transactions:
-    consumptions.append(
-      {
-        "date": txn.transdate.strftime("%Y-%m-%d") if txn.transdate else "",
-        "amount": txn.totalprice or 0,
-        "items": detail_map.get(txn.transactionid, []),
-      }
-    )
+    page = int(request.GET.get("page", 1))
+  except ValueError:
+    page = 1
 
-  member = {
-    "customerID": customer.customerid,
-    "customerName": customer.customername or "",
-    "gender": customer.gender or "",
-    "customerRegion": customer.customerregion or "",
-    "memberType": customer_category_name,
-    "customerJoinDay": customer.customerjoinday.strftime("%Y-%m-%d") if customer.customerjoinday else "",
-    "totalSpending": total_spending,
-    "consumptions": consumptions,
-    "categoryStats": list(category_stats.values()),
-    "essential_items": essential_items,
-    "flexible_items": flexible_items,
-  }
+  member = load_customer_profile(member_id_int, page=page, order=request.GET.get("order", "desc"))
   return render(request, "customer.html", {"member": member})
 
 
@@ -642,116 +510,149 @@ def register_view(request):
 
 ## 顧客活躍度
 
-def customer_activity(request):
-  """依據月/季/年區間統計顧客活躍度。"""
-  today = datetime.now().date()
+def _activity_period(request):
   period_key = request.GET.get("period", "month")
   if period_key not in ACTIVITY_PERIODS:
     period_key = "month"
-  period_info = ACTIVITY_PERIODS[period_key]
-  since_date = today - timedelta(days=period_info["days"])
-
-  #  欄位名稱統一使用與其他地方一致的小寫命名
-
-  activity_queryset = (
-    Transaction.objects
-    .filter(transdate__gte=since_date, transdate__lt=today)
-    .values("customerid")
-    .annotate(
-      last_purchase=Max("transdate"),
-      orders=Count("transactionid"),
-      total_spent=Sum("totalprice"),
-    )
-  )
-
-  customer_ids = [row["customerid"] for row in activity_queryset]
-  customer_lookup = Customer.objects.filter(customerid__in=customer_ids).in_bulk(field_name="customerid")
-
-  activities = []
-  high = medium = low = 0
-  for row in activity_queryset:
-    recency_days = (today - row["last_purchase"]).days if row["last_purchase"] else None
-    orders = row["orders"]
-    total_spent = row["total_spent"] or 0
-    if recency_days is not None and recency_days <= 14 and orders >= 3:
-      activity_level = "高活躍"
-      high += 1
-    elif recency_days is not None and recency_days <= 45 and orders >= 2:
-      activity_level = "中活躍"
-      medium += 1
-    else:
-      activity_level = "低活躍"
-      low += 1
-
-    customer = customer_lookup.get(row["customerid"])
-    activities.append({
-      "customer_id": row["customerid"],
-      "customer_name": getattr(customer, "customername", "未知顧客"),
-      "orders": orders,
-      "total_spent": total_spent,
-      "last_purchase": row["last_purchase"],
-      "recency_days": recency_days,
-      "activity_level": activity_level,
-    })
+  today = datetime.now().date()
+  return period_key, today - timedelta(days=ACTIVITY_PERIODS[period_key]["days"]), today
 
-  activities.sort(
-    key=lambda x: (
-      0 if x["activity_level"] == "高活躍"
-      else (1 if x["activity_level"] == "中活躍" else 2),
-      x["recency_days"] if x["recency_days"] is not None else 9999,
-      -x["orders"],
-    )
-  )
 
+def customer_activity(request):
+  """依據月/季/年區間統計顧客活躍度；列表與各等級人數由 customer_activity_api 分頁載入。"""
+  period_key, since_date, today = _activity_period(request)
   period_options = [{"key": key, "label": info["label"]} for key, info in ACTIVITY_PERIODS.items()]
 
   context = {
     "period_key": period_key,
-    "period_label": period_info["label"],
+    "period_label": ACTIVITY_PERIODS[period_key]["label"],
     "period_options": period_options,
     "since_date": since_date,
     "today": today,
-    "activities": activities,
-    "high_count": high,
-    "medium_count": medium,
-    "low_count": low,
-    "total_count": len(activities),
+    "page_size": ACTIVITY_DEFAULT_PAGE_SIZE,
   }
   return render(request, "customer_activity.html", context)
 
 
+@require_GET
+def customer_activity_api(request):
+  """
+  GET /activity/api/?period=month|quarter|year&level=high|medium|low&sort=level|recency|orders|spent
+                     &cursor=...&page_size=50
+  沒有 cursor（第一頁）時另外回傳各活躍度等級人數 counts。
+  """
+  period_key, since_date, today = _activity_period(request)
+  try:
+    page_size = int(request.GET.get("page_size", ACTIVITY_DEFAULT_PAGE_SIZE))
+  except (TypeError, ValueError):
+    page_size = ACTIVITY_DEFAULT_PAGE_SIZE
+  cursor = request.GET.get("cursor") or None
+
+  try:
+    page = get_activity_page(
+      since_date,
+      today,
+      level=request.GET.get("level") or None,
+      sort=request.GET.get("sort", "level"),
+      cursor=cursor,
+      page_size=page_size,
+    )
+  except InvalidCursor:
+    return JsonResponse({"error": "cursor 格式錯誤"}, status=400)
+
+  payload = {
+    "period": period_key,
+    "since_date": since_date.isoformat(),
+    "today": today.isoformat(),
+    **page,
+  }
+  if cursor is None:
+    payload["counts"] = level_counts(since_date, today)
+  return JsonResponse(payload, json_dumps_params={"ensure_ascii": False})
+
+
 ## =============RFM數據更新API=================
 @require_POST
 def trigger_rfm_update(request):
   """
   Manual or automatic trigger for recomputing RFM scores; requires login.
+  重算改在背景作業執行，這裡只排入作業並立即回傳 job id；
+  同時間重複送出的同類更新請求會共用同一個作業；
+  完整重算進行中時自動更新直接共用它；完整與增量重算不會同時執行（見 schedule_rfm_refresh）。
   """
   if not request.session.get('user_id'):
+    if _should_return_json(request):
+      return JsonResponse({"error": "請先登入"}, status=401)
     return redirect('login')
 
   # 檢查是否為自動更新
   is_auto_update = request.POST.get('auto_update') == 'true'
 
   try:
-    updated_qs = recalc_rfm_scores()
-    
-    # 只有手動更新時才顯示成功訊息
-    if not is_auto_update:
-      messages.success(request, f"RFM 分數已更新 ({updated_qs.count()} 筆記錄)。")
-    else:
-      # 自動更新時在日誌中記錄（可選）
-      print(f"Auto RFM update completed: {updated_qs.count()} records updated at {timezone.now()}")
-      
+    # 自動更新只重算水位線之後受影響的顧客；手動按鈕跑完整重算
+    job, created = schedule_rfm_refresh(incremental=is_auto_update)
   except Exception as exc:
     # 錯誤訊息總是顯示，無論手動或自動
+    if _should_return_json(request):
+      return JsonResponse({"error": f"RFM 更新失敗: {exc}"}, status=500)
     if not is_auto_update:
       messages.error(request, f"RFM 更新失敗: {exc}")
     else:
       print(f"Auto RFM update failed: {exc}")
+    return redirect('index')
+
+  if _should_return_json(request):
+    return JsonResponse({
+      "job_id": job["id"],
+      "status": job["status"],
+      "deduplicated": not created,
+      "status_url": f"{reverse('rfm_update_status')}?job_id={job['id']}",
+    }, status=202)
+
+  # 只有手動更新時才顯示訊息
+  if not is_auto_update:
+    if created:
+      messages.success(request, f"RFM 分數更新已在背景執行（作業 {job['id'][:8]}）。")
+    else:
+      messages.info(request, f"RFM 分數更新進行中（作業 {job['id'][:8]}），請稍後重新整理。")
+  else:
+    print(f"Auto RFM update queued: job {job['id']} at {timezone.now()}")
 
   return redirect('index')
 
 
+@require_GET
+def rfm_update_status(request):
+  """
+  查詢 RFM 背景更新進度：
+  GET /rfm/update/status/?job_id=...（省略 job_id 時回傳進行中或最近一次的作業）
+  回傳 status / processed / total / elapsed / eta（秒）。
+  """
+  if not request.session.get('user_id'):
+    return JsonResponse({"error": "請先登入"}, status=401)
+
+  job_id = request.GET.get('job_id')
+  if job_id:
+    job = get_job(job_id)
+  else:
+    # 完整 / 增量重算中以進行中的優先，其次是最近建立的
+    jobs = [j for j in (latest_job(RFM_REFRESH_JOB), latest_job(RFM_INCREMENTAL_JOB)) if j]
+    job = max(jobs, key=lambda j: (j.get("status") in ACTIVE_STATUSES, j.get("created_ts") or 0)) if jobs else None
+  if not job:
+    return JsonResponse({"error": "找不到作業"}, status=404)
+
+  return JsonResponse({
+    "job_id": job["id"],
+    "status": job["status"],
+    "processed": job.get("processed") or 0,
+    "total": job.get("total"),
+    "elapsed": job.get("elapsed"),
+    "eta": job.get("eta"),
+    "error": job.get("error"),
+    "result": job.get("result"),
+  }, json_dumps_params={"ensure_ascii": False})
+
+
 ## =============下次購買預測相關=================
 
 def next_purchase_chart(request):
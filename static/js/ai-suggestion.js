@@ -45,6 +45,8 @@ function renderTitle() {
 // =========================================================
 const API_INIT     = "/ai-suggestion/init/";
 const API_CHAT     = "/chat/";
+const API_INIT_STREAM = "/ai-suggestion/init/stream/";
+const API_CHAT_STREAM = "/chat/stream/";
 const API_EXECUTE  = "/ai-suggestion/execute/";
 
 
@@ -94,8 +96,43 @@ const CATEGORY_ID = getCategoryIdFromSeg();
 // 1. 初始載入 — 從後端要模型建議
 // =========================================================
 async function loadInitialSuggestion() {
+  const query = `categoryID=${CATEGORY_ID}&period=${encodeURIComponent(period || "")}`;
+  let aiBubble = null;
+
+  try {
+    // 串流版本：先顯示使用者問題，再逐段顯示 AI 回覆
+    const resp = await fetch(`${API_INIT_STREAM}?${query}`);
+    if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+
+    await readSSE(resp, (event, data) => {
+      if (event === "meta") {
+        appendMessage("user", data.question);
+        aiBubble = appendMessage("ai", "思考中…", true);
+      } else if (event === "token") {
+        appendStreamText(aiBubble, data.delta);
+      } else if (event === "done") {
+        finishStreamText(aiBubble, data.reply);
+        if (data.initial) {
+          suggestions.unshift(data.initial);
+          renderSuggestionList();
+        }
+      } else if (event === "error") {
+        finishStreamText(aiBubble, `錯誤：${data.error}`);
+      }
+    });
+    return;
+  } catch (err) {
+    console.warn("串流初始建議失敗，改用一般 API:", err);
+    // 移除串流途中已顯示的問答，改由一般 API 重新顯示
+    if (aiBubble) {
+      const aiMsg = aiBubble.closest(".msg");
+      aiMsg.previousElementSibling?.remove();
+      aiMsg.remove();
+    }
+  }
+
   try {
-    const resp = await fetch(`${API_INIT}?categoryID=${CATEGORY_ID}&period=${encodeURIComponent(period || "")}`);
+    const resp = await fetch(`${API_INIT}?${query}`);
     if (!resp.ok) {
       console.error("初始建議載入失敗：HTTP", resp.status);
       return;
@@ -327,10 +364,95 @@ async function sendChatToBackend(text) {
   return data;
 }
 
+// 讀取 SSE 串流（fetch 版本，POST 也能用），每個事件呼叫 onEvent(event, data)
+async function readSSE(resp, onEvent) {
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder("utf-8");
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let idx;
+    while ((idx = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, idx);
+      buffer = buffer.slice(idx + 2);
+
+      let event = "message";
+      const dataLines = [];
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+      }
+      if (dataLines.length) onEvent(event, JSON.parse(dataLines.join("\n")));
+    }
+  }
+}
+
+function appendStreamText(bubble, delta) {
+  if (!bubble) return;
+  if (bubble.classList.contains("loading")) {
+    bubble.textContent = "";
+    bubble.classList.remove("loading");
+  }
+  bubble.textContent += delta;
+  chatBox.scrollTop = chatBox.scrollHeight;
+}
+
+function finishStreamText(bubble, text) {
+  if (!bubble) return;
+  if (text) bubble.textContent = text;
+  bubble.classList.remove("loading");
+}
+
+async function askStream(question, bubble) {
+  const resp = await fetch(API_CHAT_STREAM, {
+    method: "POST",
+    headers: {"Content-Type":"application/json"},
+    body: JSON.stringify({
+      message:   question,
+      categoryID: CATEGORY_ID,
+      userID:    1
+    })
+  });
+  if (!resp.ok) {
+    throw new Error(`HTTP ${resp.status}`);
+  }
+
+  let received = false;
+  await readSSE(resp, (event, data) => {
+    if (event === "token") {
+      received = true;
+      appendStreamText(bubble, data.delta);
+    } else if (event === "done") {
+      received = true;
+      finishStreamText(bubble, data.reply);
+      // 若回覆有建議 → 自動加入左側欄
+      if (data.newSuggestion) {
+        suggestions.unshift(data.newSuggestion);
+        currentPage = 1;
+        renderSuggestionList();
+      }
+    } else if (event === "error") {
+      received = true;
+      finishStreamText(bubble, `錯誤：${data.error}`);
+    }
+  });
+  return received;
+}
+
 async function ask(question) {
   appendMessage("user", question);
   const loadingBubble = appendMessage("ai", "思考中…", true);
 
+  try {
+    if (await askStream(question, loadingBubble)) return;
+  } catch (err) {
+    console.warn("串流聊天失敗，改用一般 API:", err);
+  }
+
   try {
     const data = await sendChatToBackend(question);
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+測試串流聊天 API（SSE），只用標準函式庫
+    python test_chat_stream.py                 # POST /chat/stream/
+    python test_chat_stream.py --init          # GET /ai-suggestion/init/stream/
+    python test_chat_stream.py --base http://127.0.0.1:8000 --category 2
+
+會印出逐段收到的回覆、第一段 token 的等待時間與總時間。
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+
+def iter_sse(response):
+    """解析 SSE，逐一產生 (event, data)"""
+    event, data_lines = "message", []
+    for raw in response:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+            continue
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].strip())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--category", type=int, default=1)
+    parser.add_argument("--message", default="請幫我設計下個月的回購優惠券")
+    parser.add_argument("--init", action="store_true", help="測試初始建議的串流 API")
+    args = parser.parse_args()
+
+    if args.init:
+        query = urllib.parse.urlencode({"categoryID": args.category, "period": "month"})
+        req = urllib.request.Request(f"{args.base}/ai-suggestion/init/stream/?{query}")
+    else:
+        body = json.dumps({"message": args.message, "categoryID": args.category, "userID": 1}).encode("utf-8")
+        req = urllib.request.Request(
+            f"{args.base}/chat/stream/",
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+
+    start = time.perf_counter()
+    first_token = None
+    tokens = 0
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        print(f"HTTP {resp.status} {resp.headers.get('Content-Type')}")
+        for event, data in iter_sse(resp):
+            if event == "meta":
+                print(f"[meta] {json.dumps(data, ensure_ascii=False)[:120]}...")
+            elif event == "token":
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                tokens += 1
+                sys.stdout.write(data["delta"])
+                sys.stdout.flush()
+            elif event == "done":
+                print("\n[done] 建議：", json.dumps(data.get("newSuggestion") or data.get("initial"), ensure_ascii=False)[:200])
+            elif event == "error":
+                print(f"\n[error] {data}")
+
+    total = time.perf_counter() - start
+    ttft = f"{first_token:.3f}s" if first_token is not None else "-"
+    print(f"\n第一段 token：{ttft}，共 {tokens} 段，總時間 {total:.3f}s")
+
+
+if __name__ == "__main__":
+    main()